@@ -0,0 +1,93 @@
+# app/broadcast_worker.py
+import asyncio
+import logging
+from datetime import datetime
+
+from .cache import UserCache
+from .db import Db
+from .models import Broadcast
+from .repo import UsersRepo, BroadcastsRepo
+from .sender import Sender, SENT, BLOCKED
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 5
+# после падения повторно уйдёт не больше одной пачки: курсор пишется после каждой
+BATCH_SIZE = 100
+
+STATUS_TITLES = {
+    BroadcastsRepo.RUNNING: "идёт",
+    BroadcastsRepo.DONE: "завершена",
+    BroadcastsRepo.CANCELLED: "остановлена",
+}
+
+
+def report_text(b: Broadcast) -> str:
+    processed = b.sent + b.failed + b.blocked
+    elapsed = max(1.0, ((b.finished_at or datetime.utcnow()) - b.created_at).total_seconds())
+    progress = f"{processed}/{b.total}" if b.total else str(processed)
+    return (
+        f"📣 <b>Рассылка #{b.id}</b> — {STATUS_TITLES.get(b.status, b.status)}\n"
+        f"Обработано: <b>{progress}</b>\n"
+        f"Доставлено: <b>{b.sent}</b>\n"
+        f"Заблокировали бота: <b>{b.blocked}</b>\n"
+        f"Ошибки: <b>{b.failed}</b>\n"
+        f"Скорость: <b>{processed / elapsed:.1f}</b> сообщ./с, прошло {int(elapsed) // 60}:{int(elapsed) % 60:02d}"
+    )
+
+
+async def run_broadcast(
+    db: Db, sender: Sender, broadcast_id: int, cache: UserCache | None = None, batch_size: int = BATCH_SIZE
+) -> Broadcast | None:
+    """
+    Шлёт рассылку с сохранённого курсора, пока не кончатся получатели или её
+    не отменят. Пачка уходит через Sender (общий и поштучный по чатам лимит,
+    ограниченное число воркеров); курсор, счётчики и заблокировавшие бота
+    пишутся одной транзакцией после каждой пачки.
+    """
+    while True:
+        async with db.sessionmaker() as s:
+            repo = BroadcastsRepo(s)
+            b = await repo.get(broadcast_id)
+            if b is None or b.status != BroadcastsRepo.RUNNING:
+                return b
+            user_ids = await UsersRepo(s).get_broadcast_recipients(b.cursor, batch_size)
+            if not user_ids:
+                await repo.finish(broadcast_id, BroadcastsRepo.DONE)
+                await s.commit()
+                return await repo.get(broadcast_id)
+
+        results = await asyncio.gather(*(sender.send_status(uid, b.text, parse_mode="HTML") for uid in user_ids))
+        blocked = [uid for uid, r in zip(user_ids, results) if r == BLOCKED]
+        sent = sum(r == SENT for r in results)
+
+        async with db.sessionmaker() as s:
+            users = UsersRepo(s, cache=cache)
+            await BroadcastsRepo(s).advance(
+                broadcast_id, user_ids[-1], sent=sent, failed=len(results) - sent - len(blocked), blocked=len(blocked)
+            )
+            # больше им не пишем, пока сами не вернутся в бота (/start)
+            await users.mark_blocked(blocked)
+            await s.commit()
+            users.invalidate_dirty()
+
+
+async def run_broadcast_worker(
+    db: Db, sender: Sender, admin_id: int, cache: UserCache | None = None, interval: float = POLL_INTERVAL
+):
+    """Подхватывает рассылку в статусе running (новую или прерванную перезапуском) и по итогу шлёт отчёт админу."""
+    while True:
+        try:
+            async with db.sessionmaker() as s:
+                b = await BroadcastsRepo(s).get_running()
+            if b is not None:
+                logger.info(f"Broadcast {b.id}: starting from user_id > {b.cursor}")
+                b = await run_broadcast(db, sender, b.id, cache)
+                if b is not None:
+                    logger.info(f"Broadcast {b.id} {b.status}: sent={b.sent} blocked={b.blocked} failed={b.failed}")
+                    if admin_id:
+                        await sender.send(admin_id, report_text(b), parse_mode="HTML")
+                continue
+        except Exception as e:
+            logger.error(f"Error in broadcast_worker: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,46 @@
+# app/cache.py
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+
+from sqlalchemy import inspect
+
+from .models import User
+
+_USER_COLUMNS = [a.key for a in inspect(User).column_attrs]
+
+
+class UserCache:
+    """
+    Снимки User на процесс: LRU с ограничением размера и TTL.
+
+    Хранятся значения колонок, наружу отдаётся новый transient User —
+    правки вызывающего кода не портят кэш и не попадают в чужую сессию.
+    TTL ограничивает рассинхрон с записями из других процессов.
+    """
+
+    def __init__(self, max_size: int = 100_000, ttl: float = 30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+
+    def get(self, user_id: int) -> User | None:
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+        expires_at, values = item
+        if expires_at < time.monotonic():
+            del self._items[user_id]
+            return None
+        self._items.move_to_end(user_id)
+        return User(**values)
+
+    def put(self, u: User):
+        self._items[u.user_id] = (time.monotonic() + self.ttl, {k: getattr(u, k) for k in _USER_COLUMNS})
+        self._items.move_to_end(u.user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self._items.pop(user_id, None)
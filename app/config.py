@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+import json
 import os
 from dotenv import load_dotenv
 
@@ -11,6 +12,29 @@ class Settings:
     db_dsn: str
     monthly_price_rub: int
     warning_days: int
+    # polling | webhook
+    bot_mode: str = "polling"
+    # публичный https-адрес для setWebhook; пусто — только локальный сервер (для отладки)
+    webhook_base_url: str = ""
+    webhook_path: str = "/tg/webhook"
+    webhook_secret: str = ""
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    # локальный /metrics; 0 — выключен
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9108
+    # >1 — супервизор поднимает столько процессов-воркеров (только webhook)
+    workers: int = 1
+    # номер воркера, выставляется супервизором; -1 — не воркер
+    worker_index: int = -1
+    # лимит трафика на оплаченный период, ГБ; 0 — без лимита
+    traffic_quota_gb: float = 0
+    # ежечасная сверка с панелью исправляет расхождения сама; False — только отчёт в лог
+    reconcile_apply: bool = False
+
+    @property
+    def traffic_quota_bytes(self) -> int:
+        return int(self.traffic_quota_gb * 1024 ** 3)
 
     @property
     def daily_price(self) -> float:
@@ -23,6 +47,18 @@ def load_settings() -> Settings:
         db_dsn=os.getenv("DB_DSN", "sqlite+aiosqlite:///vpn_bot.db").strip(),
         monthly_price_rub=int(os.getenv("MONTHLY_PRICE_RUB", "150")),
         warning_days=int(os.getenv("WARNING_DAYS", "3")),
+        bot_mode=os.getenv("BOT_MODE", "polling").strip().lower(),
+        webhook_base_url=os.getenv("WEBHOOK_BASE_URL", "").strip().rstrip("/"),
+        webhook_path=os.getenv("WEBHOOK_PATH", "/tg/webhook").strip(),
+        webhook_secret=os.getenv("WEBHOOK_SECRET", "").strip(),
+        webhook_host=os.getenv("WEBHOOK_HOST", "0.0.0.0").strip(),
+        webhook_port=int(os.getenv("WEBHOOK_PORT", "8080")),
+        metrics_host=os.getenv("METRICS_HOST", "127.0.0.1").strip(),
+        metrics_port=int(os.getenv("METRICS_PORT", "9108")),
+        workers=int(os.getenv("BOT_WORKERS", "1")),
+        worker_index=int(os.getenv("BOT_WORKER_INDEX", "-1")),
+        traffic_quota_gb=float(os.getenv("TRAFFIC_QUOTA_GB", "0")),
+        reconcile_apply=os.getenv("RECONCILE_APPLY", "0").strip().lower() in ("1", "true", "yes"),
     )
 # app/config.py
 @dataclass(frozen=True)
@@ -36,6 +72,9 @@ class XuiConfig:
     public_key: str
     sni: str
     short_id: str
+    node_id: int = 1
+    # относительная ёмкость ноды при выборе наименее загруженной
+    weight: int = 1
 
 def load_xui_config() -> XuiConfig:
     return XuiConfig(
@@ -50,6 +89,19 @@ def load_xui_config() -> XuiConfig:
         short_id=os.getenv("SHORT_ID", "").strip(),
     )
 
+def load_nodes() -> list[XuiConfig]:
+    """
+    XUI_NODES — JSON-список нод: объекты с полями XuiConfig (url, username, password,
+    inbound_id, server_ip, server_port, public_key, sni, short_id, node_id, weight).
+    Не указанные поля берутся из XUI_*; node_id по умолчанию — номер в списке.
+    Без XUI_NODES — одна нода из XUI_* как раньше.
+    """
+    base = load_xui_config()
+    raw = os.getenv("XUI_NODES", "").strip()
+    if not raw:
+        return [base]
+    return [replace(base, **{"node_id": i, **item}) for i, item in enumerate(json.loads(raw), start=1)]
+
 # Backward compatibility - deprecated, use load_xui_config() instead
 class Config:
     _cached_config = None
@@ -0,0 +1,59 @@
+# app/container.py
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, field
+from aiogram import Bot
+
+from .cache import UserCache
+from .config import Settings, load_nodes
+from .nodes import NodeRegistry
+from .scheduler import ExpiryScheduler
+from .sender import Sender
+from .services import SubscriptionService, PaymentService
+from .ui import UiService
+
+
+@dataclass
+class Container:
+    """
+    Всё, что живёт весь процесс: конфиги, ноды с клиентами панелей (с их пулами
+    соединений и cookie) и сервисы без состояния. Собирается один раз в main().
+    """
+    settings: Settings
+    registry: NodeRegistry
+    subs: SubscriptionService
+    pay: PaymentService
+    ui: UiService
+    scheduler: ExpiryScheduler
+    # None — кэша нет (воркеры под супервизором)
+    user_cache: UserCache | None
+    sender: Sender
+    # будит outbox_worker после commit с новыми операциями панели
+    outbox_wakeup: asyncio.Event = field(default_factory=asyncio.Event)
+
+    async def close(self):
+        await self.sender.close()
+        await self.registry.close()
+
+
+def build_container(settings: Settings, bot: Bot) -> Container:
+    # под супервизором фоновые задачи могут жить в разных воркерах — пишем в панель поклиентно
+    registry = NodeRegistry(load_nodes(), exclusive=settings.workers <= 1)
+    return Container(
+        settings=settings,
+        registry=registry,
+        subs=SubscriptionService(registry),
+        pay=PaymentService(),
+        # кэш экранов процесса не видит рендеры соседних воркеров — под супервизором он выключен
+        ui=UiService(
+            bot,
+            max_cached_menus=0 if settings.worker_index >= 0 else 50_000,
+            traffic_quota=settings.traffic_quota_bytes,
+        ),
+        scheduler=ExpiryScheduler(),
+        # соседние воркеры пишут в users мимо этого кэша: баланс, is_active и active_until
+        # читались бы устаревшими до TTL; как и кэш экранов, под супервизором он выключен
+        user_cache=None if settings.worker_index >= 0 else UserCache(),
+        sender=Sender(bot),
+    )
@@ -21,5 +21,47 @@ class Db:
             await conn.execute(text("PRAGMA synchronous=NORMAL;"))
             await conn.execute(text("PRAGMA busy_timeout=30000;"))
 
+    def lazy_session(self) -> "LazySession":
+        return LazySession(self.sessionmaker)
+
     async def dispose(self):
-        await self.engine.dispose()
\ No newline at end of file
+        await self.engine.dispose()
+
+
+class LazySession:
+    """
+    Обёртка над AsyncSession, которая создаёт сессию при первом обращении
+    репозитория (execute, get, add, ...). Пока сессии нет, commit/rollback/close
+    ничего не делают — апдейты без работы с БД её и не открывают.
+    """
+
+    def __init__(self, sessionmaker: async_sessionmaker):
+        self._sessionmaker = sessionmaker
+        self._session: AsyncSession | None = None
+
+    @property
+    def opened(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name):
+        if self._session is None:
+            self._session = self._sessionmaker()
+        return getattr(self._session, name)
+
+    async def commit(self):
+        if self._session is not None:
+            await self._session.commit()
+
+    async def rollback(self):
+        if self._session is not None:
+            await self._session.rollback()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self) -> "LazySession":
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
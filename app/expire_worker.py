@@ -1,32 +1,126 @@
 # app/expire_worker.py
 import asyncio
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import UserCache
+from .db import Db
+from .models import User
+from .nodes import NodeRegistry
+from .repo import UsersRepo, StatsRepo, OutboxRepo
+from .scheduler import ExpiryScheduler
 
 logger = logging.getLogger(__name__)
 
-async def expire_worker(users, xui, config):
-    """Background worker that disables expired subscriptions"""
+RETRY_DELAY = 30
+
+
+async def disable_clients(registry: NodeRegistry, users: list[User]) -> tuple[list[int], list[int]]:
+    """
+    Выключает клиентов в панели одной записью на ноду.
+    Возвращает (user_id выключенных, user_id, которых выключить не удалось).
+    """
+    done, failed = [], []
+    by_node = {}
+    for u in users:
+        try:
+            by_node.setdefault(registry.get(u.node_id).node_id, []).append(u)
+        except RuntimeError as e:
+            logger.error(f"Cannot disable user {u.user_id}: {e}")
+            failed.append(u.user_id)
+
+    for node_id, node_users in by_node.items():
+        node = registry.get(node_id)
+        # одна запись в панель на весь пакет вместо update_client на каждого
+        updates = [
+            (u.vpn_uuid, False, int(u.active_until.timestamp() * 1000) if u.active_until else 0)
+            for u in node_users
+        ]
+        applied = await node.xui.update_clients(node.inbound_id, updates, timeout=60)
+        done.extend(u.user_id for u in node_users if u.vpn_uuid in applied)
+        failed.extend(u.user_id for u in node_users if u.vpn_uuid not in applied)
+    return done, failed
+
+
+async def reenable_clients(s: AsyncSession, users: list[User]):
+    """
+    Клиенты выключены в панели, а подписка в БД за это время продлилась
+    (активация, пока шла запись в панель). Ставим включение в outbox — по
+    свежему состоянию строки; коммитит вызывающий.
+    """
+    outbox = OutboxRepo(s)
+    now = datetime.utcnow()
+    for u in users:
+        await s.refresh(u)
+        if u.is_active and u.vpn_uuid and u.active_until and u.active_until > now:
+            await outbox.enqueue(
+                u.user_id, u.node_id, "update", u.vpn_uuid, True, int(u.active_until.timestamp() * 1000)
+            )
+
+
+async def expire_due(
+    db: Db, registry: NodeRegistry, user_ids: list[int] | None = None, cache: UserCache | None = None
+) -> list[int]:
+    """
+    Выключает истёкших клиентов (всех или только из user_ids) одним пакетом на ноду.
+    Возвращает user_id, которых не удалось выключить в панели.
+    """
+    async with db.sessionmaker() as s:
+        users = UsersRepo(s, cache=cache)
+        expired = await users.get_expired_active(user_ids)
+        if not expired:
+            return []
+
+        done, failed = await disable_clients(registry, expired)
+        if failed:
+            logger.error(f"Failed to disable {len(failed)} expired clients")
+        if done:
+            # пока ходили в панель, пользователь мог оплатить и продлить подписку
+            deactivated = await users.deactivate_many(done, User.active_until < datetime.utcnow())
+            kept = set(done) - set(deactivated)
+            await reenable_clients(s, [u for u in expired if u.user_id in kept])
+            expired_now = len(deactivated)
+            await StatsRepo(s).bump(expirations=expired_now, active_delta=-expired_now)
+            await s.commit()
+            users.invalidate_dirty()
+            logger.info(f"Disabled {expired_now} expired subscriptions")
+        return failed
+
+
+async def run_expire_worker(
+    db: Db, registry: NodeRegistry, scheduler: ExpiryScheduler, cache: UserCache | None = None
+):
+    """
+    Спит ровно до ближайшего active_until из кучи планировщика вместо
+    опроса раз в минуту. Окно дедлайнов строится из БД при старте, поэтому
+    всё, что истекло, пока бот был выключен, отрабатывается первым.
+    """
+    async def reload():
+        async with db.sessionmaker() as s:
+            scheduler.load(await UsersRepo(s).get_upcoming_deadlines(scheduler.window))
+
+    reload_needed = True
     while True:
+        due = []
         try:
-            expired = await users.get_expired_active()
-            for u in expired:
-                try:
-                    if not xui.login():
-                        logger.error(f"XUI login failed when disabling expired user {u.user_id}")
-                        continue
-                    
-                    expiry_ms = int(u.active_until.timestamp() * 1000) if u.active_until else 0
-                    ok = xui.update_client(config.INBOUND_ID, u.vpn_uuid, False, expiry_ms)
-                    if not ok:
-                        logger.error(f"Failed to disable client for expired user {u.user_id}")
-                    else:
-                        await users.set_active(u.user_id, False)
-                        logger.info(f"Disabled expired subscription for user {u.user_id}")
-                except Exception as e:
-                    logger.error(f"Error processing expired user {u.user_id}: {e}")
-            
-            await asyncio.sleep(60)
+            if reload_needed or scheduler.needs_reload:
+                await reload()
+                reload_needed = False
+
+            now = datetime.utcnow()
+            due = scheduler.pop_due(now)
+            if due:
+                retry_at = now + timedelta(seconds=RETRY_DELAY)
+                for user_id in await expire_due(db, registry, due, cache):
+                    scheduler.schedule(user_id, retry_at)
+                continue
+
+            reload_needed = await scheduler.wait(now)
         except Exception as e:
             logger.error(f"Error in expire_worker: {e}")
-            await asyncio.sleep(60)
+            retry_at = datetime.utcnow() + timedelta(seconds=RETRY_DELAY)
+            for user_id in due:
+                scheduler.schedule(user_id, retry_at)
+            await asyncio.sleep(RETRY_DELAY)
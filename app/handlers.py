@@ -1,42 +1,60 @@
 # app/handlers.py
+from datetime import datetime, timedelta
+
 from aiogram import Router, F
 from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder  # ✅ ВАЖНО
 from .services import SubscriptionService, PaymentService
-from .keyboards import main_kb, profile_kb, admin_deposit_kb
+from .keyboards import (
+    main_kb, profile_kb, admin_deposit_kb, admin_pending_kb, admin_users_kb, admin_user_kb, USER_FILTERS,
+)
 from .ui import UiService
-from .repo import UsersRepo
+from .repo import UsersRepo, DepositsRepo, NodesRepo, OutboxRepo, StatsRepo, BroadcastsRepo
+from .broadcast_worker import report_text
 from app.config import Config
-from app.utils.vless import build_vless_link
 
 router = Router()
 
 
+async def _ensure_user(users: UsersRepo, stats: StatsRepo, user_id: int, username: str | None):
+    # новая строка users и +1 к регистрациям дня — в одной транзакции
+    u = await users.get(user_id)
+    if u is None:
+        # из двух одновременных первых апдейтов строку вставит (и засчитает) только один
+        if await users.insert_if_missing(user_id, username):
+            await stats.bump(signups=1)
+        return
+    if u.blocked_at is not None:
+        # снова пишет боту — значит, разблокировал; рассылки опять до него доходят
+        await users.clear_blocked(user_id)
+    await users.add_if_missing(user_id, username)
+
+
 @router.message(Command("start"))
-async def start(m: Message, ui: UiService, users: UsersRepo):
-    await users.add_if_missing(m.from_user.id, m.from_user.username)
+async def start(m: Message, ui: UiService, users: UsersRepo, stats: StatsRepo):
+    await _ensure_user(users, stats, m.from_user.id, m.from_user.username)
     # ✅ всегда создаём новое меню, чтобы после очистки чата всё оживало
-    await ui.reset_menu(m.from_user.id, m.chat.id)
+    await ui.reset_menu(users, m.from_user.id, m.chat.id)
 
 
 @router.callback_query(F.data == "main_menu")
-async def main_menu(cq: CallbackQuery, ui: UiService):
+async def main_menu(cq: CallbackQuery, ui: UiService, users: UsersRepo):
     await cq.answer()
-    await ui.show_main_menu(cq.from_user.id, cq.message.chat.id)
+    await ui.show_main_menu(users, cq.from_user.id, cq.message.chat.id)
 
 
 @router.callback_query(F.data == "support")
-async def support(cq: CallbackQuery, ui: UiService):
+async def support(cq: CallbackQuery, ui: UiService, users: UsersRepo):
     await cq.answer()
     text = "🆘 Support: @admin_username"
     b = InlineKeyboardBuilder()
     b.button(text="Назад", callback_data="main_menu")
-    await ui.render(cq.from_user.id, cq.message.chat.id, text, b.as_markup())
+    await ui.render(users, cq.from_user.id, cq.message.chat.id, text, b.as_markup())
 
 
 @router.callback_query(F.data == "connect")
-async def connect(cq: CallbackQuery, ui: UiService):
+async def connect(cq: CallbackQuery, ui: UiService, users: UsersRepo):
     await cq.answer()
     text = (
         "📡 Инструкция по подключению:\n"
@@ -46,34 +64,34 @@ async def connect(cq: CallbackQuery, ui: UiService):
     )
     b = InlineKeyboardBuilder()
     b.button(text="Назад", callback_data="main_menu")
-    await ui.render(cq.from_user.id, cq.message.chat.id, text, b.as_markup())
+    await ui.render(users, cq.from_user.id, cq.message.chat.id, text, b.as_markup())
 
 
 @router.callback_query(F.data == "profile")
-async def profile(cq: CallbackQuery, ui: UiService, users: UsersRepo):
+async def profile(cq: CallbackQuery, ui: UiService, users: UsersRepo, stats: StatsRepo):
     await cq.answer()
-    await users.add_if_missing(cq.from_user.id, cq.from_user.username)
-    await ui.show_profile(cq.from_user.id, cq.message.chat.id)
+    await _ensure_user(users, stats, cq.from_user.id, cq.from_user.username)
+    await ui.show_profile(users, cq.from_user.id, cq.message.chat.id)
 
 
 @router.callback_query(F.data == "topup")
-async def topup(cq: CallbackQuery, ui: UiService):
+async def topup(cq: CallbackQuery, ui: UiService, users: UsersRepo):
     await cq.answer()
     text = "Введите сумму (число), например: 150\nКоманда: /dep 150"
     b = InlineKeyboardBuilder()
     b.button(text="Назад", callback_data="main_menu")
-    await ui.render(cq.from_user.id, cq.message.chat.id, text, b.as_markup())
+    await ui.render(users, cq.from_user.id, cq.message.chat.id, text, b.as_markup())
 
 
 @router.message(Command("dep"))
-async def dep_create(m: Message, pay: PaymentService, settings, ui: UiService):
+async def dep_create(m: Message, pay: PaymentService, settings, ui: UiService, users: UsersRepo, deposits: DepositsRepo):
     try:
         amount = float(m.text.split(maxsplit=1)[1])
     except Exception:
         await m.answer("Формат: /dep 150")
         return
 
-    dep_id = await pay.create_deposit(m.from_user.id, amount)
+    dep_id = await pay.create_deposit(deposits, m.from_user.id, amount)
     await m.answer("✅ Заявка создана. Ждите подтверждения.")
     try:
         await m.delete()
@@ -84,17 +102,20 @@ async def dep_create(m: Message, pay: PaymentService, settings, ui: UiService):
     try:
         await m.bot.send_message(
             settings.admin_id,
-            f"💳 Deposit #{dep_id}\nUser: {m.from_user.id}\nAmount: {amount}",
+            f"💳 Deposit #{dep_id}\nUser: {m.from_user.id}\nAmount: {amount}\nВсе заявки: /pending",
             reply_markup=admin_deposit_kb(dep_id),
         )
     except Exception:
         pass
 
-    await ui.show_main_menu(m.from_user.id, m.chat.id)
+    await ui.show_main_menu(users, m.from_user.id, m.chat.id)
 # ----------------- ADMIN ACTIONS -----------------
 
 @router.callback_query(F.data.startswith("adm_dep_ok:"))
-async def adm_ok(cq: CallbackQuery, pay: PaymentService, settings):
+async def adm_ok(
+    cq: CallbackQuery, pay: PaymentService, settings, users: UsersRepo, deposits: DepositsRepo, stats: StatsRepo,
+    notify: list,
+):
     # админ-check
     if cq.from_user.id != settings.admin_id:
         await cq.answer("Ты не админ", show_alert=True)
@@ -103,7 +124,7 @@ async def adm_ok(cq: CallbackQuery, pay: PaymentService, settings):
     await cq.answer()
     dep_id = int(cq.data.split(":")[1])
 
-    dr = await pay.approve(dep_id)
+    dr = await pay.approve(users, deposits, dep_id, stats)
     if not dr:
         try:
             await cq.message.edit_text("⚠️ Already handled")
@@ -117,14 +138,11 @@ async def adm_ok(cq: CallbackQuery, pay: PaymentService, settings):
     except Exception:
         pass
 
-    try:
-        await cq.bot.send_message(dr.user_id, f"✅ Оплата принята на {dr.amount}")
-    except Exception:
-        pass
+    notify.append((dr.user_id, f"✅ Оплата принята на {dr.amount}"))
 
 
 @router.callback_query(F.data.startswith("adm_dep_no:"))
-async def adm_no(cq: CallbackQuery, pay: PaymentService, settings):
+async def adm_no(cq: CallbackQuery, pay: PaymentService, settings, deposits: DepositsRepo, notify: list):
     if cq.from_user.id != settings.admin_id:
         await cq.answer("Ты не админ", show_alert=True)
         return
@@ -132,7 +150,7 @@ async def adm_no(cq: CallbackQuery, pay: PaymentService, settings):
     await cq.answer()
     dep_id = int(cq.data.split(":")[1])
 
-    dr = await pay.reject(dep_id)
+    dr = await pay.reject(deposits, dep_id)
     if not dr:
         try:
             await cq.message.edit_text("⚠️ Already handled")
@@ -145,36 +163,242 @@ async def adm_no(cq: CallbackQuery, pay: PaymentService, settings):
     except Exception:
         pass
 
+    notify.append((dr.user_id, "❌ Оплата отклонена"))
+
+
+# ----------------- BATCH REVIEW (/pending) -----------------
+
+PENDING_PAGE = 10
+
+
+def _pending_cursor(d) -> str:
+    return f"{d.created_at.isoformat()},{d.id}"
+
+
+def _parse_pending_cursor(token: str):
+    if not token:
+        return None
+    created, dep_id = token.rsplit(",", 1)
+    return datetime.fromisoformat(created), int(dep_id)
+
+
+async def _pending_view(deposits: DepositsRepo, after: str) -> tuple[str, InlineKeyboardMarkup | None]:
+    # +1 строка — узнать, есть ли следующая страница, без count по всему хвосту
+    deps = await deposits.get_pending_page(_parse_pending_cursor(after), PENDING_PAGE + 1)
+    next_after = _pending_cursor(deps[PENDING_PAGE - 1]) if len(deps) > PENDING_PAGE else None
+    deps = deps[:PENDING_PAGE]
+    total = await deposits.count_pending()
+    if not total:
+        return "🧾 Заявок на пополнение нет", None
+    text = (
+        f"🧾 Ожидают подтверждения: {total}\n"
+        "Отметьте заявки и нажмите «Одобрить» или «Отклонить»."
+    )
+    return text, admin_pending_kb(deps, after, next_after)
+
+
+def _pending_selected(markup: InlineKeyboardMarkup) -> list[int]:
+    return [
+        int(btn.callback_data.split(":")[1])
+        for row in markup.inline_keyboard for btn in row
+        if (btn.callback_data or "").startswith("pend_t:") and btn.text.startswith("☑")
+    ]
+
+
+def _pending_mark(markup: InlineKeyboardMarkup, ids: set[int], checked: bool) -> InlineKeyboardMarkup:
+    """Выбор живёт в тексте кнопок — меняем отметку у ids, остальное как было."""
+    rows = []
+    for row in markup.inline_keyboard:
+        new_row = []
+        for btn in row:
+            data = btn.callback_data or ""
+            if data.startswith("pend_t:") and int(data.split(":")[1]) in ids:
+                btn = btn.model_copy(update={"text": ("☑" if checked else "☐") + btn.text[1:]})
+            new_row.append(btn)
+        rows.append(new_row)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@router.message(Command("pending"))
+async def adm_pending(m: Message, settings, deposits: DepositsRepo):
+    if m.from_user.id != settings.admin_id:
+        return
+    text, kb = await _pending_view(deposits, "")
+    await m.answer(text, reply_markup=kb)
+
+
+@router.callback_query(F.data.startswith("pend_pg:"))
+async def adm_pending_page(cq: CallbackQuery, settings, deposits: DepositsRepo):
+    if cq.from_user.id != settings.admin_id:
+        await cq.answer("Ты не админ", show_alert=True)
+        return
+    await cq.answer()
+    text, kb = await _pending_view(deposits, cq.data.split(":", 1)[1])
     try:
-        await cq.bot.send_message(dr.user_id, "❌ Оплата отклонена")
+        await cq.message.edit_text(text, reply_markup=kb)
     except Exception:
         pass
 
+
+@router.callback_query(F.data.startswith("pend_t:") | (F.data == "pend_all"))
+async def adm_pending_toggle(cq: CallbackQuery, settings):
+    if cq.from_user.id != settings.admin_id:
+        await cq.answer("Ты не админ", show_alert=True)
+        return
+    await cq.answer()
+    markup = cq.message.reply_markup
+    selected = set(_pending_selected(markup))
+    if cq.data == "pend_all":
+        on_page = {
+            int(btn.callback_data.split(":")[1])
+            for row in markup.inline_keyboard for btn in row
+            if (btn.callback_data or "").startswith("pend_t:")
+        }
+        # всё уже отмечено — снимаем, иначе отмечаем всё
+        markup = _pending_mark(markup, on_page, checked=selected != on_page)
+    else:
+        dep_id = int(cq.data.split(":")[1])
+        markup = _pending_mark(markup, {dep_id}, checked=dep_id not in selected)
+    try:
+        await cq.message.edit_reply_markup(reply_markup=markup)
+    except Exception:
+        pass
+
+
+@router.callback_query(F.data.startswith("pend_ok:") | F.data.startswith("pend_no:"))
+async def adm_pending_apply(
+    cq: CallbackQuery, pay: PaymentService, settings, users: UsersRepo, deposits: DepositsRepo, stats: StatsRepo,
+    notify: list,
+):
+    if cq.from_user.id != settings.admin_id:
+        await cq.answer("Ты не админ", show_alert=True)
+        return
+    dep_ids = _pending_selected(cq.message.reply_markup)
+    if not dep_ids:
+        await cq.answer("Ничего не выбрано")
+        return
+
+    action, after = cq.data.split(":", 1)
+    # одна транзакция на всю пачку; уже обработанные кем-то заявки пропускаются
+    if action == "pend_ok":
+        resolved = await pay.approve_many(users, deposits, dep_ids, stats)
+        notify.extend((dr.user_id, f"✅ Оплата принята на {dr.amount}") for dr in resolved)
+        await cq.answer(f"Одобрено: {len(resolved)}")
+    else:
+        resolved = await pay.reject_many(deposits, dep_ids)
+        notify.extend((dr.user_id, "❌ Оплата отклонена") for dr in resolved)
+        await cq.answer(f"Отклонено: {len(resolved)}")
+
+    text, kb = await _pending_view(deposits, after)
+    try:
+        await cq.message.edit_text(text, reply_markup=kb)
+    except Exception:
+        pass
+
+
+@router.message(Command("stats"))
+async def adm_stats(m: Message, settings, stats: StatsRepo):
+    if m.from_user.id != settings.admin_id:
+        return
+
+    today = datetime.utcnow().date()
+    rows = await stats.get_since(today - timedelta(days=29))
+    active = await stats.active_total()
+
+    def total(field: str, days: int) -> float:
+        since = today - timedelta(days=days - 1)
+        return sum(getattr(r, field) for r in rows if r.day >= since)
+
+    lines = [f"{'':<13}{'сегодня':>9}{'7 дн':>9}{'30 дн':>9}"]
+    for title, field in (
+        ("Регистрации", "signups"),
+        ("Пополнения", "deposits"),
+        ("  на сумму", "deposits_amount"),
+        ("Активации", "activations"),
+        ("Выручка", "revenue"),
+        ("Истекло", "expirations"),
+    ):
+        lines.append(f"{title:<13}" + "".join(f"{total(field, d):>9.0f}" for d in (1, 7, 30)))
+
+    # отток: доля истёкших за 30 дней от всех, кто был активен в этом окне
+    expired = total("expirations", 30)
+    churn = expired / (active + expired) * 100 if active + expired else 0
+    await m.answer(
+        f"📊 <b>Статистика</b> (UTC)\n"
+        f"Активных подписок: <b>{active}</b>\n"
+        f"Отток за 30 дн: <b>{churn:.1f}%</b>\n\n"
+        "<pre>" + "\n".join(lines) + "</pre>",
+        parse_mode="HTML",
+    )
+
+
+@router.message(Command("broadcast"))
+async def adm_broadcast(m: Message, settings, users: UsersRepo, broadcasts: BroadcastsRepo):
+    if m.from_user.id != settings.admin_id:
+        return
+    # html_text: разметка админа (жирный, ссылки) уходит получателям как есть
+    parts = (m.html_text or "").split(maxsplit=1)
+    if len(parts) < 2:
+        b = await broadcasts.get_latest()
+        if b is None:
+            await m.answer("Рассылок ещё не было.\nФормат: /broadcast <текст>")
+        else:
+            await m.answer(report_text(b), parse_mode="HTML")
+        return
+
+    running = await broadcasts.get_running()
+    if running is not None:
+        await m.answer(f"Уже идёт рассылка #{running.id}. Остановить: /broadcast_stop")
+        return
+    b = await broadcasts.create(parts[1], total=await users.count_broadcast_recipients())
+    # broadcast_worker подхватит её после commit, в каком бы процессе он ни работал
+    await m.answer(
+        f"📣 Рассылка #{b.id} поставлена: {b.total} получателей.\n"
+        "Прогресс: /broadcast, остановить: /broadcast_stop"
+    )
+
+
+@router.message(Command("broadcast_stop"))
+async def adm_broadcast_stop(m: Message, settings, broadcasts: BroadcastsRepo):
+    if m.from_user.id != settings.admin_id:
+        return
+    b = await broadcasts.get_running()
+    if b is None or not await broadcasts.finish(b.id, BroadcastsRepo.CANCELLED):
+        await m.answer("Сейчас рассылок нет.")
+        return
+    await m.answer(f"Рассылка #{b.id} остановлена, отчёт придёт после текущей пачки.")
+
+
 @router.callback_query(F.data == "activate")
-async def activate(cq: CallbackQuery, ui: UiService, subs: SubscriptionService, settings):
+async def activate(
+    cq: CallbackQuery, ui: UiService, subs: SubscriptionService, settings, users: UsersRepo, nodes: NodesRepo,
+    outbox: OutboxRepo, stats: StatsRepo,
+):
     await cq.answer()
     try:
-        await subs.activate(cq.from_user.id, days=30, settings=settings)
-        await ui.show_profile(cq.from_user.id, cq.message.chat.id)
+        await subs.activate(users, nodes, outbox, cq.from_user.id, days=30, settings=settings, stats=stats)
+        await ui.show_profile(users, cq.from_user.id, cq.message.chat.id)
     except Exception as e:
         error_msg = str(e)
         await cq.answer(f"Ошибка активации: {error_msg}", show_alert=True)
         # Still show profile even if activation failed
-        await ui.show_profile(cq.from_user.id, cq.message.chat.id)
+        await ui.show_profile(users, cq.from_user.id, cq.message.chat.id)
 
 
 @router.callback_query(F.data == "pause")
-async def pause(cq: CallbackQuery, ui: UiService, subs: SubscriptionService):
+async def pause(
+    cq: CallbackQuery, ui: UiService, subs: SubscriptionService, users: UsersRepo, outbox: OutboxRepo, stats: StatsRepo
+):
     await cq.answer()
-    await subs.pause(cq.from_user.id)
-    await ui.show_profile(cq.from_user.id, cq.message.chat.id)
+    await subs.pause(users, outbox, cq.from_user.id, stats)
+    await ui.show_profile(users, cq.from_user.id, cq.message.chat.id)
 
 
 @router.callback_query(F.data == "get_key")
-async def get_key(cq: CallbackQuery, ui: UiService, users: UsersRepo, subs: SubscriptionService, xui_config):
+async def get_key(cq: CallbackQuery, ui: UiService, users: UsersRepo, subs: SubscriptionService):
     await cq.answer()
 
-    ok, reason = await subs.can_use(cq.from_user.id)
+    ok, reason = await subs.can_use(users, cq.from_user.id)
     if not ok:
         msg = {
             "paused": "Профиль на паузе — нажмите «Активировать».",
@@ -191,7 +415,7 @@ async def get_key(cq: CallbackQuery, ui: UiService, users: UsersRepo, subs: Subs
         await cq.answer("Ключ ещё не создан. Нажмите «Активировать».", show_alert=True)
         return
 
-    link = build_vless_link(vpn_uuid=u.vpn_uuid, email=u.vpn_email, cfg=xui_config)
+    link = subs.vless_link(u)
 
     text = (
         "🔑 <b>Ваш VPN-ключ</b>\n\n"
@@ -201,8 +425,159 @@ async def get_key(cq: CallbackQuery, ui: UiService, users: UsersRepo, subs: Subs
     )
 
     await ui.render(
+        users,
         cq.from_user.id,
         cq.message.chat.id,
         text,
         reply_markup=profile_kb(u.is_active, u.is_banned),
     )
+
+
+# ----------------- USER BROWSER (/users, /find) -----------------
+
+USERS_PAGE = 10
+
+
+def _user_line(u) -> str:
+    st = "🚫" if u.is_banned else ("🟢" if u.is_active else "🟠")
+    name = f"@{u.username}" if u.username else "—"
+    until = f"{u.active_until:%d.%m.%Y}" if u.active_until else "—"
+    return f"{st} <code>{u.user_id}</code> {name} · до {until} · {round(u.balance, 2)}"
+
+
+def _user_card(u) -> str:
+    st = "🚫 BANNED" if u.is_banned else ("🟢 ACTIVE" if u.is_active else "🟠 PAUSED")
+    return (
+        f"👤 <code>{u.user_id}</code> {'@' + u.username if u.username else ''}\n"
+        f"💳 Balance: <code>{round(u.balance, 2)}</code>\n"
+        f"📌 Status: {st}\n"
+        f"🗓 Until: <code>{u.active_until or '-'}</code>\n"
+        f"🖥 Node: <code>{u.node_id or '-'}</code>\n"
+        f"📅 Since: <code>{u.created_at:%d.%m.%Y}</code>"
+    )
+
+
+def _users_text(title: str, rows) -> str:
+    body = "\n".join(_user_line(u) for u in rows) if rows else "Никого не нашлось"
+    return f"👥 <b>{title}</b>\n\n{body}"
+
+
+async def _users_view(users: UsersRepo, settings, status: str, token: str) -> tuple[str, InlineKeyboardMarkup]:
+    # +1 строка — есть ли следующая страница
+    if status == "expiring":
+        until = datetime.utcnow() + timedelta(days=settings.warning_days or 3)
+        after = None
+        if token:
+            last_until, last_id = token.rsplit(",", 1)
+            after = (datetime.fromisoformat(last_until), int(last_id))
+        rows = await users.browse_expiring(until, after, USERS_PAGE + 1)
+        cursor = lambda u: f"{u.active_until.isoformat()},{u.user_id}"
+    else:
+        rows = await users.browse(status, int(token) if token else None, USERS_PAGE + 1)
+        cursor = lambda u: str(u.user_id)
+
+    next_data = f"usr_pg:{status}:{cursor(rows[USERS_PAGE - 1])}" if len(rows) > USERS_PAGE else None
+    rows = rows[:USERS_PAGE]
+    return _users_text(f"Пользователи: {USER_FILTERS[status]}", rows), admin_users_kb(rows, next_data)
+
+
+async def _find_view(users: UsersRepo, prefix: str, after: tuple[str, int] | None) -> tuple[str, InlineKeyboardMarkup]:
+    rows = await users.find_by_username(prefix, after, USERS_PAGE + 1)
+    next_data = None
+    if len(rows) > USERS_PAGE:
+        last = rows[USERS_PAGE - 1]
+        # префикс — начало последнего username, в callback_data (до 64 байт) хватает его длины
+        next_data = f"usr_f:{len(prefix)}:{last.username.lower()},{last.user_id}"
+    rows = rows[:USERS_PAGE]
+    return _users_text(f"Поиск: {prefix}", rows), admin_users_kb(rows, next_data, with_filters=False)
+
+
+@router.message(Command("users"))
+async def adm_users(m: Message, settings, users: UsersRepo):
+    if m.from_user.id != settings.admin_id:
+        return
+    parts = m.text.split(maxsplit=1)
+    status = parts[1].strip().lower() if len(parts) > 1 else "all"
+    if status not in USER_FILTERS:
+        await m.answer(f"Формат: /users [{'|'.join(USER_FILTERS)}]")
+        return
+    text, kb = await _users_view(users, settings, status, "")
+    await m.answer(text, reply_markup=kb, parse_mode="HTML")
+
+
+@router.message(Command("find"))
+async def adm_find(m: Message, settings, users: UsersRepo):
+    if m.from_user.id != settings.admin_id:
+        return
+    parts = m.text.split(maxsplit=1)
+    query = parts[1].strip().lstrip("@") if len(parts) > 1 else ""
+    if not query:
+        await m.answer("Формат: /find <id или начало username>")
+        return
+
+    if query.isdigit():
+        u = await users.get(int(query))
+        if u:
+            await m.answer(_user_card(u), reply_markup=admin_user_kb(u.user_id, u.is_banned), parse_mode="HTML")
+            return
+    text, kb = await _find_view(users, query, None)
+    await m.answer(text, reply_markup=kb, parse_mode="HTML")
+
+
+@router.callback_query(F.data.startswith("usr_pg:") | F.data.startswith("usr_f:"))
+async def adm_users_page(cq: CallbackQuery, settings, users: UsersRepo):
+    if cq.from_user.id != settings.admin_id:
+        await cq.answer("Ты не админ", show_alert=True)
+        return
+    await cq.answer()
+    kind, arg, token = cq.data.split(":", 2)
+    if kind == "usr_pg":
+        text, kb = await _users_view(users, settings, arg, token)
+    else:
+        last_name, last_id = token.rsplit(",", 1)
+        text, kb = await _find_view(users, last_name[:int(arg)], (last_name, int(last_id)))
+    try:
+        await cq.message.edit_text(text, reply_markup=kb, parse_mode="HTML")
+    except Exception:
+        pass
+
+
+@router.callback_query(F.data.startswith("usr:"))
+async def adm_user_card(cq: CallbackQuery, settings, users: UsersRepo):
+    if cq.from_user.id != settings.admin_id:
+        await cq.answer("Ты не админ", show_alert=True)
+        return
+    u = await users.get(int(cq.data.split(":")[1]))
+    if not u:
+        await cq.answer("Пользователь не найден", show_alert=True)
+        return
+    await cq.answer()
+    # карточка — отдельным сообщением, список остаётся на месте
+    await cq.message.answer(_user_card(u), reply_markup=admin_user_kb(u.user_id, u.is_banned), parse_mode="HTML")
+
+
+@router.callback_query(F.data.startswith("usr_ban:") | F.data.startswith("usr_ext:"))
+async def adm_user_action(
+    cq: CallbackQuery, settings, subs: SubscriptionService, users: UsersRepo, outbox: OutboxRepo, stats: StatsRepo
+):
+    if cq.from_user.id != settings.admin_id:
+        await cq.answer("Ты не админ", show_alert=True)
+        return
+    action, user_id, value = cq.data.split(":")
+    user_id, value = int(user_id), int(value)
+    if not await users.get(user_id):
+        await cq.answer("Пользователь не найден", show_alert=True)
+        return
+
+    if action == "usr_ban":
+        await subs.set_ban(users, outbox, user_id, bool(value), stats)
+        await cq.answer("Забанен" if value else "Разбанен")
+    else:
+        await subs.extend(users, outbox, user_id, value)
+        await cq.answer(f"Продлено на {value} дн")
+
+    u = await users.get(user_id)
+    try:
+        await cq.message.edit_text(_user_card(u), reply_markup=admin_user_kb(u.user_id, u.is_banned), parse_mode="HTML")
+    except Exception:
+        pass
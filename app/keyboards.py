@@ -26,4 +26,58 @@ def admin_deposit_kb(dep_id: int) -> InlineKeyboardMarkup:
     b.button(text="Принять", callback_data=f"adm_dep_ok:{dep_id}")
     b.button(text="Отклонить", callback_data=f"adm_dep_no:{dep_id}")
     b.adjust(2)
-    return b.as_markup()
\ No newline at end of file
+    return b.as_markup()
+
+
+def admin_pending_kb(deps, after: str, next_after: str | None) -> InlineKeyboardMarkup:
+    """
+    Страница /pending. Выбор хранится в самих кнопках (☑/☐), поэтому переживает
+    любые воркеры; after — курсор, с которого построена страница.
+    """
+    b = InlineKeyboardBuilder()
+    for d in deps:
+        b.button(
+            text=f"☐ #{d.id} · {d.amount:g} · {d.user_id} · {d.created_at:%d.%m %H:%M}",
+            callback_data=f"pend_t:{d.id}",
+        )
+    b.button(text="Выбрать все", callback_data="pend_all")
+    b.button(text="✅ Одобрить", callback_data=f"pend_ok:{after}")
+    b.button(text="❌ Отклонить", callback_data=f"pend_no:{after}")
+    nav = 0
+    if after:
+        b.button(text="⏮ В начало", callback_data="pend_pg:")
+        nav += 1
+    if next_after:
+        b.button(text="Далее ➡️", callback_data=f"pend_pg:{next_after}")
+        nav += 1
+    b.adjust(*([1] * len(deps)), 1, 2, *([nav] if nav else []))
+    return b.as_markup()
+
+
+USER_FILTERS = {"all": "Все", "active": "Активные", "paused": "На паузе", "banned": "Бан", "expiring": "Истекают"}
+
+
+def admin_users_kb(users, next_data: str | None, with_filters: bool = True) -> InlineKeyboardMarkup:
+    """Страница /users или /find: карточка по нажатию, фильтры и «Далее» с keyset-курсором."""
+    b = InlineKeyboardBuilder()
+    for u in users:
+        b.button(text=f"{u.user_id} @{u.username}" if u.username else str(u.user_id), callback_data=f"usr:{u.user_id}")
+    sizes = [2] * ((len(users) + 1) // 2)
+    if with_filters:
+        for status, title in USER_FILTERS.items():
+            b.button(text=title, callback_data=f"usr_pg:{status}:")
+        sizes += [len(USER_FILTERS)]
+    if next_data:
+        b.button(text="Далее ➡️", callback_data=next_data)
+        sizes += [1]
+    b.adjust(*sizes)
+    return b.as_markup()
+
+
+def admin_user_kb(user_id: int, is_banned: bool) -> InlineKeyboardMarkup:
+    b = InlineKeyboardBuilder()
+    b.button(text="✅ Разбанить" if is_banned else "🚫 Забанить", callback_data=f"usr_ban:{user_id}:{int(not is_banned)}")
+    b.button(text="+7 дн", callback_data=f"usr_ext:{user_id}:7")
+    b.button(text="+30 дн", callback_data=f"usr_ext:{user_id}:30")
+    b.adjust(1, 2)
+    return b.as_markup()
@@ -0,0 +1,90 @@
+# app/lease.py
+import asyncio
+import logging
+import os
+import socket
+from datetime import timedelta
+from typing import Awaitable, Callable
+
+from .db import Db
+from .repo import LeasesRepo
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL = timedelta(seconds=30)
+HEARTBEAT = 10
+
+# идентификатор процесса-держателя аренды
+HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def _acquire(db: Db, name: str, holder: str, ttl: timedelta) -> bool:
+    # shield: отмена посреди транзакции оставила бы соединение в пуле недокатившимся
+    return await asyncio.shield(_try_acquire(db, name, holder, ttl))
+
+
+async def _try_acquire(db: Db, name: str, holder: str, ttl: timedelta) -> bool:
+    try:
+        async with db.sessionmaker() as s:
+            return await LeasesRepo(s).try_acquire(name, holder, ttl)
+    except Exception as e:
+        logger.error(f"Lease {name}: acquire failed: {e}")
+        return False
+
+
+async def _release(db: Db, name: str, holder: str):
+    try:
+        async with db.sessionmaker() as s:
+            await LeasesRepo(s).release(name, holder)
+    except Exception as e:
+        logger.error(f"Lease {name}: release failed: {e}")
+
+
+async def run_singleton(
+    db: Db,
+    name: str,
+    job: Callable[[], Awaitable],
+    holder: str = HOLDER,
+    ttl: timedelta = LEASE_TTL,
+    heartbeat: float = HEARTBEAT,
+):
+    """
+    Запускает job только в процессе, который держит аренду `name` в таблице leases.
+
+    Держатель продлевает аренду каждые `heartbeat` секунд; не сумев продлить,
+    останавливает job (аренда вот-вот достанется другому). Остальные процессы
+    раз в `heartbeat` пробуют забрать аренду и подхватывают её, когда держатель
+    умер и аренда протухла (не позже чем через ttl). При штатной остановке
+    аренда отпускается сразу.
+    """
+    while True:
+        if not await _acquire(db, name, holder, ttl):
+            await asyncio.sleep(heartbeat)
+            continue
+
+        logger.info(f"Lease {name} acquired by {holder}")
+        task = asyncio.create_task(job())
+        try:
+            while True:
+                await asyncio.wait([task], timeout=heartbeat)
+                if task.done():
+                    break
+                if not await _acquire(db, name, holder, ttl):
+                    logger.warning(f"Lease {name} lost by {holder}, stopping the job")
+                    break
+        except asyncio.CancelledError:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await _release(db, name, holder)
+            raise
+
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            continue
+
+        # job завершился сам (выключен настройкой или упал) — аренда больше не нужна
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Job {name} failed: {task.exception()}")
+        await _release(db, name, holder)
+        return
@@ -1,16 +1,27 @@
 # app/main.py
 import asyncio
 import logging
+import signal
 from aiogram import Bot, Dispatcher
 
-from .config import load_settings, load_xui_config
+from .config import load_settings
+from .container import build_container
 from .db import Db
 from .models import Base
+from .migrations import apply_migrations
 from .handlers import router
-from .middlewares import DbSessionMiddleware
-from .expire_worker import expire_worker
-from .repo import UsersRepo, DepositsRepo
-from .xui import XuiPanel
+from .middlewares import DbSessionMiddleware, SingleFlightMiddleware, ThrottlingMiddleware
+from .expire_worker import run_expire_worker
+from .warn_worker import run_warning_worker
+from .outbox_worker import run_outbox_worker
+from .traffic_worker import run_traffic_worker
+from .reconciler import run_reconciler
+from .broadcast_worker import run_broadcast_worker
+from .metrics import TelegramMetricsMiddleware, run_metrics_collector, start_metrics_server
+from .lease import run_singleton
+from .repo import NodesRepo
+from .supervisor import run_supervisor
+from .webhook import check_webhook_settings, run_webhook
 
 # Configure logging
 logging.basicConfig(
@@ -29,57 +40,93 @@ async def main():
     settings = load_settings()
     if not settings.bot_token:
         raise RuntimeError("BOT_TOKEN is empty")
+    if settings.bot_mode == "webhook":
+        check_webhook_settings(settings)
+
+    if settings.workers > 1 and settings.worker_index < 0:
+        await run_supervisor(settings)
+        return
+
+    # воркер под супервизором: штатная остановка по SIGTERM, чтобы отпустить аренды
+    is_worker = settings.worker_index >= 0
+    stop = asyncio.Event()
+    if is_worker:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
 
     bot = Bot(token=settings.bot_token)
+    bot.session.middleware(TelegramMetricsMiddleware())
     dp = Dispatcher()
 
     db = Db(settings.db_dsn)
     if settings.db_dsn.startswith("sqlite"):
         await db.init_sqlite_pragmas()
-    await create_tables(db)
+    if not is_worker:
+        # под супервизором схему и счётчики нод уже подготовил он
+        await create_tables(db)
+        await apply_migrations(db)
+
+    container = build_container(settings, bot)
+    registry = container.registry
+    if not is_worker:
+        async with db.sessionmaker() as s:
+            await NodesRepo(s).sync([n.node_id for n in registry.all()], registry.default_id)
+            await s.commit()
 
-    dp.update.outer_middleware(DbSessionMiddleware(db, settings, bot))
+    # флуд отсекается до открытия сессии БД
+    dp.update.outer_middleware(ThrottlingMiddleware(exempt_ids={settings.admin_id}))
+    # двойной тап «Активировать»/«Пауза» не списывает дважды и не плодит клиентов в панели
+    dp.update.outer_middleware(SingleFlightMiddleware({"activate", "pause"}))
+    dp.update.outer_middleware(DbSessionMiddleware(db, container))
 
     dp.include_router(router)
 
-    # Start expire worker in background
-    xui_config = load_xui_config()
-    xui = XuiPanel(xui_config.url, xui_config.username, xui_config.password)
-    
-    async def run_expire_worker():
-        while True:
-            try:
-                async with db.sessionmaker() as s:
-                    users = UsersRepo(s)
-                    expired = await users.get_expired_active()
-                    for u in expired:
-                        try:
-                            if not xui.login():
-                                logger.error(f"XUI login failed when disabling expired user {u.user_id}")
-                                continue
-                            
-                            expiry_ms = int(u.active_until.timestamp() * 1000) if u.active_until else 0
-                            ok = xui.update_client(xui_config.inbound_id, u.vpn_uuid, False, expiry_ms)
-                            if not ok:
-                                logger.error(f"Failed to disable client for expired user {u.user_id}")
-                            else:
-                                await users.set_active(u.user_id, False)
-                                await s.commit()
-                                logger.info(f"Disabled expired subscription for user {u.user_id}")
-                        except Exception as e:
-                            logger.error(f"Error processing expired user {u.user_id}: {e}")
-                            await s.rollback()
-            except Exception as e:
-                logger.error(f"Error in expire_worker: {e}")
-            await asyncio.sleep(60)
-    
-    # Start expire worker as background task
-    asyncio.create_task(run_expire_worker())
-    logger.info("Expire worker started")
-
-    await bot.delete_webhook(drop_pending_updates=True)
-    logger.info("Bot started")
-    await dp.start_polling(bot)
+    # фоновые задачи идут в одном процессе из всех — том, что держит аренду в БД
+    jobs = [
+        asyncio.create_task(run_singleton(
+            db, "expire", lambda: run_expire_worker(db, registry, container.scheduler, container.user_cache)
+        )),
+        asyncio.create_task(run_singleton(
+            db, "outbox", lambda: run_outbox_worker(db, registry, container.outbox_wakeup)
+        )),
+        asyncio.create_task(run_singleton(
+            db, "warn", lambda: run_warning_worker(db, container.sender, settings.warning_days, container.user_cache)
+        )),
+        asyncio.create_task(run_singleton(
+            db, "traffic", lambda: run_traffic_worker(
+                db, registry, settings.traffic_quota_bytes, container.user_cache, container.sender
+            )
+        )),
+        asyncio.create_task(run_singleton(
+            db, "reconcile", lambda: run_reconciler(db, registry, apply=settings.reconcile_apply)
+        )),
+        asyncio.create_task(run_singleton(
+            db, "broadcast", lambda: run_broadcast_worker(db, container.sender, settings.admin_id, container.user_cache)
+        )),
+    ]
+
+    metrics_runner = None
+    if settings.metrics_port:
+        # у каждого воркера свой порт: METRICS_PORT + номер
+        port = settings.metrics_port + max(0, settings.worker_index)
+        metrics_runner = await start_metrics_server(settings.metrics_host, port)
+        jobs.append(asyncio.create_task(run_metrics_collector(db)))
+
+    try:
+        if settings.bot_mode == "webhook":
+            logger.info("Bot started (webhook)")
+            await run_webhook(bot, dp, settings, register=not is_worker, reuse_port=is_worker, stop=stop)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            logger.info("Bot started")
+            await dp.start_polling(bot)
+    finally:
+        for job in jobs:
+            job.cancel()
+        # run_singleton отпускает аренду при отмене — соседний воркер подхватит сразу
+        await asyncio.gather(*jobs, return_exceptions=True)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await container.close()
 
 
 if __name__ == "__main__":
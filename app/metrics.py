@@ -0,0 +1,222 @@
+# app/metrics.py
+"""
+Метрики процесса в текстовом формате Prometheus без внешних зависимостей.
+
+Счётчики, gauge и гистограммы регистрируются в REGISTRY при импорте и
+отдаются на локальном /metrics (METRICS_HOST:METRICS_PORT).
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+from datetime import datetime
+
+from aiohttp import web
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import func, select
+
+from .db import Db
+from .models import PanelOp, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in zip(names, values)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(k, "") for k in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self._values: dict[tuple, float] = {}
+        super().__init__(name, help, labelnames)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # labels -> (счётчики по бакетам, сумма, количество)
+        self._values: dict[tuple, list] = {}
+        super().__init__(name, help, labelnames)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        item = self._values.get(key)
+        if item is None:
+            item = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            item[0][i] += 1
+        item[1] += value
+        item[2] += 1
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total, n) in self._values.items():
+            cumulative = 0
+            for le, c in zip(self.buckets, counts):
+                cumulative += c
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + (le,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + ('+Inf',))} {n}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+XUI_SECONDS = Histogram("xui_call_seconds", "XuiPanel call latency", ("method",))
+XUI_ERRORS = Counter("xui_call_errors_total", "XuiPanel calls that raised or returned a failure", ("method",))
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Update handling time by callback_data or command", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Handlers that raised", ("handler",))
+DB_SESSION_SECONDS = Histogram("db_session_seconds", "DbSessionMiddleware session lifetime incl. commit")
+DB_ROLLBACKS = Counter("db_session_rollbacks_total", "Sessions rolled back after a handler error")
+TELEGRAM_SECONDS = Histogram("telegram_call_seconds", "Telegram Bot API call latency", ("method",))
+TELEGRAM_ERRORS = Counter("telegram_call_errors_total", "Telegram Bot API calls that raised", ("method",))
+UPDATES_DROPPED = Counter("bot_updates_dropped_total", "Updates dropped by flood control", ("reason",))
+ACTIVE_USERS = Gauge("active_users", "Users with an active unexpired subscription")
+EXPIRE_BACKLOG = Gauge("expire_backlog_users", "Expired users still enabled, waiting for the expire worker")
+OUTBOX_PENDING = Gauge("panel_outbox_pending", "Panel operations waiting in the outbox")
+
+
+def observe_xui(fn):
+    """Время и ошибки метода XuiPanel; ошибка — исключение или пустой/False результат."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception:
+            XUI_ERRORS.inc(method=name)
+            raise
+        finally:
+            XUI_SECONDS.observe(time.perf_counter() - t0, method=name)
+        if result is None or result is False:
+            XUI_ERRORS.inc(method=name)
+        return result
+
+    return wrapper
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Мидлварь сессии бота: видит все вызовы Bot API (UiService, Sender, хендлеры)."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        t0 = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            TELEGRAM_ERRORS.inc(method=name)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - t0, method=name)
+
+
+async def _collect(db: Db):
+    now = datetime.utcnow()
+    async with db.sessionmaker() as s:
+        active = await s.scalar(
+            select(func.count()).select_from(User).where(
+                User.is_active == True,
+                User.vpn_uuid.is_not(None),
+                User.active_until > now,
+            )
+        )
+        backlog = await s.scalar(
+            select(func.count()).select_from(User).where(
+                User.is_active == True,
+                User.vpn_uuid.is_not(None),
+                User.active_until < now,
+            )
+        )
+        pending = await s.scalar(select(func.count()).select_from(PanelOp).where(PanelOp.status == "pending"))
+    ACTIVE_USERS.set(active or 0)
+    EXPIRE_BACKLOG.set(backlog or 0)
+    OUTBOX_PENDING.set(pending or 0)
+
+
+async def run_metrics_collector(db: Db, interval: float = 30):
+    """Gauge из БД обновляются раз в interval, а не на каждый запрос /metrics."""
+    while True:
+        try:
+            await _collect(db)
+        except Exception as e:
+            logger.error(f"Error collecting metrics: {e}")
+        await asyncio.sleep(interval)
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    async def handle(request: web.Request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics on http://{host}:{port}/metrics")
+    return runner
@@ -1,44 +1,212 @@
 from __future__ import annotations
 
+import asyncio
+import time
+from collections import Counter, OrderedDict
+
 from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import CallbackQuery, Update
 from typing import Any, Awaitable, Callable, Dict
 
+from .container import Container
 from .db import Db
-from .repo import UsersRepo, DepositsRepo
-from .services import SubscriptionService, PaymentService
-from .ui import UiService
-from .xui import XuiPanel
-from .config import load_xui_config
+from .metrics import DB_ROLLBACKS, DB_SESSION_SECONDS, HANDLER_ERRORS, HANDLER_SECONDS, UPDATES_DROPPED
+from .repo import UsersRepo, DepositsRepo, NodesRepo, OutboxRepo, StatsRepo, BroadcastsRepo
+
+
+async def _answer_quietly(cq: CallbackQuery):
+    """Снимает «часики» с кнопки, если апдейт не дойдёт до хендлера (или дойдёт чужой)."""
+    try:
+        await cq.answer()
+    except Exception:
+        # запрос устарел или уже отвечен — пользователю всё равно
+        pass
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Стоит перед DbSessionMiddleware и отсекает флуд до открытия сессии и
+    походов в панель: token bucket на пользователя + debounce одинаковых
+    callback_data (повторный тап той же кнопки в течение `debounce` секунд).
+
+    Состояние хранится только для недавно активных пользователей: полный
+    bucket ничем не отличается от нового, поэтому простаивающие вытесняются.
+    """
+
+    def __init__(
+        self,
+        rate: float = 2.0,
+        burst: int = 5,
+        debounce: float = 1.0,
+        exempt_ids: set[int] | None = None,
+        max_entries: int = 100_000,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.debounce = debounce
+        self.exempt_ids = exempt_ids or set()
+        self.max_entries = max_entries
+        # user_id -> (токены, время последнего пополнения), порядок — по последней активности
+        self._buckets: OrderedDict[int, tuple[float, float]] = OrderedDict()
+        # (user_id, callback_data) -> время последнего нажатия
+        self._recent: OrderedDict[tuple[int, str], float] = OrderedDict()
+        self.dropped: Counter[str] = Counter()
+
+    async def __call__(self, handler, event: Update, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id in self.exempt_ids:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self._evict(now)
+
+        cq = event.callback_query
+        if cq is not None and cq.data:
+            key = (user.id, cq.data)
+            last = self._recent.get(key)
+            if last is not None and now - last < self.debounce:
+                self.dropped["debounce"] += 1
+                UPDATES_DROPPED.inc(reason="debounce")
+                await _answer_quietly(cq)
+                return None
+            self._recent[key] = now
+            self._recent.move_to_end(key)
+
+        if not self._take(user.id, now):
+            self.dropped["rate"] += 1
+            UPDATES_DROPPED.inc(reason="rate")
+            if cq is not None:
+                await _answer_quietly(cq)
+            return None
+
+        return await handler(event, data)
+
+    def _take(self, user_id: int, now: float) -> bool:
+        tokens, updated = self._buckets.get(user_id, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        ok = tokens >= 1
+        self._buckets[user_id] = (tokens - 1 if ok else tokens, now)
+        self._buckets.move_to_end(user_id)
+        return ok
+
+    def _evict(self, now: float):
+        idle = self.burst / self.rate
+        while self._buckets:
+            user_id, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < idle and len(self._buckets) <= self.max_entries:
+                break
+            self._buckets.popitem(last=False)
+        while self._recent:
+            last = next(iter(self._recent.values()))
+            if now - last < self.debounce and len(self._recent) <= self.max_entries:
+                break
+            self._recent.popitem(last=False)
+
+
+class SingleFlightMiddleware(BaseMiddleware):
+    """
+    Сериализует действия одного пользователя из `actions` (callback_data).
+    Такой же запрос, пришедший, пока первый выполняется, не запускается заново,
+    а получает его результат; другое действие ждёт своей очереди. Стоит перед
+    DbSessionMiddleware, так что полёт включает и commit. Между процессами
+    защищают условные UPDATE в UsersRepo (try_debit, set_vpn_if_missing).
+    """
+
+    def __init__(self, actions: set[str]):
+        self.actions = actions
+        # user_id -> (callback_data, завершение текущего запроса)
+        self._inflight: dict[int, tuple[str, asyncio.Future]] = {}
+        self.shared = 0
+
+    async def __call__(self, handler, event: Update, data: Dict[str, Any]) -> Any:
+        cq = event.callback_query
+        if cq is None or cq.data not in self.actions:
+            return await handler(event, data)
+
+        user_id = cq.from_user.id
+        while user_id in self._inflight:
+            action, fut = self._inflight[user_id]
+            await asyncio.wait([fut])
+            if action == cq.data:
+                self.shared += 1
+                # хендлер ответил только на первый из одинаковых запросов
+                await _answer_quietly(cq)
+                return None if fut.cancelled() or fut.exception() else fut.result()
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[user_id] = (cq.data, fut)
+        try:
+            result = await handler(event, data)
+            fut.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception()  # без ожидающих asyncio иначе ругается на непрочитанную ошибку
+            raise
+        finally:
+            del self._inflight[user_id]
+
+
+def _handler_name(event: Update) -> str:
+    """Метка для метрик: callback_data без аргументов (adm_dep_ok:15 -> adm_dep_ok) или команда."""
+    if event.callback_query is not None:
+        return (event.callback_query.data or "").split(":", 1)[0] or "callback"
+    if event.message is not None:
+        text = event.message.text or ""
+        if text.startswith("/"):
+            return text.split()[0].split("@", 1)[0]
+        return "message"
+    return event.event_type
 
 
 class DbSessionMiddleware(BaseMiddleware):
-    def __init__(self, db: Db, settings, bot):
+    def __init__(self, db: Db, container: Container):
         self.db = db
-        self.settings = settings
-        self.bot = bot
+        self.container = container
 
     async def __call__(self, handler, event, data: Dict[str, Any]) -> Any:
-        data["settings"] = self.settings
-
-        async with self.db.sessionmaker() as s:
-            users = UsersRepo(s)
-            deposits = DepositsRepo(s)
+        c = self.container
+        data["settings"] = c.settings
+        data["subs"] = c.subs
+        data["pay"] = c.pay
+        data["ui"] = c.ui
 
+        name = _handler_name(event)
+        started = time.perf_counter()
+        # на апдейт создаются только репозитории; сама сессия откроется при первом запросе к БД
+        async with self.db.lazy_session() as s:
+            users = UsersRepo(s, c.scheduler, c.user_cache)
             data["users"] = users
-            data["deposits"] = deposits
-
-            xui_config = load_xui_config()
-            xui = XuiPanel(xui_config.url, xui_config.username, xui_config.password)
-
-            data["subs"] = SubscriptionService(users, xui, xui_config)
-            data["xui_config"] = xui_config
-            data["pay"] = PaymentService(users, deposits)
-            data["ui"] = UiService(self.bot, users)
+            data["deposits"] = DepositsRepo(s)
+            data["nodes"] = NodesRepo(s)
+            data["stats"] = StatsRepo(s)
+            data["broadcasts"] = BroadcastsRepo(s)
+            outbox = data["outbox"] = OutboxRepo(s)
+            # (chat_id, text) — уходят через Sender только после успешного commit
+            notify = data["notify"] = []
 
             try:
                 result = await handler(event, data)
+                # необработанные апдейты (в т.ч. произвольные /команды) — одной меткой
+                HANDLER_SECONDS.observe(
+                    time.perf_counter() - started, handler="unhandled" if result is UNHANDLED else name
+                )
                 await s.commit()
+                if outbox.added:
+                    c.outbox_wakeup.set()
+                c.sender.post_many(notify)
                 return result
             except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                if s.opened:
+                    DB_ROLLBACKS.inc()
                 await s.rollback()
                 raise
+            finally:
+                users.invalidate_dirty()
+                if s.opened:
+                    DB_SESSION_SECONDS.observe(time.perf_counter() - started)
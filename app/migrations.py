@@ -0,0 +1,166 @@
+# app/migrations.py
+"""
+Версионированные миграции схемы.
+
+Base.metadata.create_all создаёт только недостающие таблицы и никогда не
+меняет существующие, поэтому индексы и новые колонки живут здесь.
+Применённые версии записываются в schema_version; при старте
+накатываются только новые, каждая — в своей транзакции.
+"""
+import logging
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+from .db import Db
+
+logger = logging.getLogger(__name__)
+
+
+def _true(conn: Connection) -> str:
+    # SQLAlchemy пишет `is_active == True` как `= 1` в SQLite и `= true` в Postgres;
+    # частичный индекс подхватывается планировщиком SQLite только при буквальном совпадении условия
+    return "1" if conn.dialect.name == "sqlite" else "true"
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str):
+    """ALTER TABLE ADD COLUMN, если колонки ещё нет (на свежей базе её уже создал create_all)."""
+    if column in {c["name"] for c in inspect(conn).get_columns(table)}:
+        return
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def m0001_hot_query_indexes(conn: Connection):
+    # get_expired_active / get_upcoming_deadlines: диапазон и сортировка по active_until
+    # только среди активных клиентов с uuid
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_expiry ON users (active_until) "
+        f"WHERE is_active = {_true(conn)} AND vpn_uuid IS NOT NULL"
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_vpn_uuid ON users (vpn_uuid)"))
+    # заявки по статусу в порядке поступления (keyset по created_at, id)
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_deposit_requests_status_created "
+        "ON deposit_requests (status, created_at, id)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_deposit_requests_pending "
+        "ON deposit_requests (created_at, id) WHERE status = 'pending'"
+    ))
+
+
+def m0002_user_node(conn: Connection):
+    _add_column(conn, "users", "node_id", "INTEGER")
+    # существующие клиенты остаются с NULL: NodeRegistry относит их к ноде по умолчанию
+    # (первой в XUI_NODES), какой бы node_id ей ни дали
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_node ON users (node_id)"))
+
+
+def m0003_user_warned_until(conn: Connection):
+    _add_column(conn, "users", "warned_until", "TIMESTAMP")
+
+
+def m0004_panel_outbox_due(conn: Connection):
+    # таблицу создаёт create_all; выборка очереди — только среди pending
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_panel_outbox_due "
+        "ON panel_outbox (next_attempt_at, id) WHERE status = 'pending'"
+    ))
+
+
+def m0005_user_traffic(conn: Connection):
+    # таблицу traffic_usage создаёт create_all
+    _add_column(conn, "users", "traffic_used", "BIGINT NOT NULL DEFAULT 0")
+    _add_column(conn, "users", "traffic_seen", "BIGINT NOT NULL DEFAULT 0")
+
+
+def m0006_daily_stats_backfill(conn: Connection):
+    # таблицу создаёт create_all; заполняем то, что восстанавливается из истории
+    day = "date(created_at)" if conn.dialect.name == "sqlite" else "CAST(created_at AS DATE)"
+    conn.execute(text(
+        f"INSERT INTO daily_stats (day, signups) SELECT {day}, count(*) FROM users GROUP BY {day}"
+    ))
+    conn.execute(text(
+        f"INSERT INTO daily_stats (day, deposits, deposits_amount) "
+        f"SELECT {day}, count(*), sum(amount) FROM deposit_requests WHERE status = 'approved' GROUP BY {day} "
+        "ON CONFLICT (day) DO UPDATE SET deposits = excluded.deposits, deposits_amount = excluded.deposits_amount"
+    ))
+    # точка отсчёта для active_delta: все, кто активен на момент миграции
+    conn.execute(
+        text(
+            "INSERT INTO daily_stats (day, active_delta) "
+            f"VALUES (:today, (SELECT count(*) FROM users WHERE is_active = {_true(conn)})) "
+            "ON CONFLICT (day) DO UPDATE SET active_delta = excluded.active_delta"
+        ),
+        {"today": datetime.utcnow().date()},
+    )
+
+
+def m0007_admin_browse_indexes(conn: Connection):
+    t = _true(conn)
+    f = "0" if conn.dialect.name == "sqlite" else "false"
+    # /find: префикс по username без учёта регистра, keyset (lower(username), user_id)
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_username_lower ON users (lower(username), user_id) "
+        "WHERE username IS NOT NULL"
+    ))
+    # /users с фильтром: keyset по user_id внутри каждого статуса
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_users_active ON users (user_id) WHERE is_active = {t}"))
+    conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS ix_users_paused ON users (user_id) "
+        f"WHERE is_active = {f} AND vpn_uuid IS NOT NULL"
+    ))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_users_banned ON users (user_id) WHERE is_banned = {t}"))
+
+
+def m0008_user_blocked_at(conn: Connection):
+    # таблицу broadcasts создаёт create_all
+    _add_column(conn, "users", "blocked_at", "TIMESTAMP")
+
+
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "indexes for expiry and pending deposit lookups", m0001_hot_query_indexes),
+    (2, "users.node_id for multi-node placement", m0002_user_node),
+    (3, "users.warned_until for expiry reminders", m0003_user_warned_until),
+    (4, "due index for the panel outbox", m0004_panel_outbox_due),
+    (5, "users.traffic_used/traffic_seen for traffic accounting", m0005_user_traffic),
+    (6, "daily_stats backfill from users and approved deposits", m0006_daily_stats_backfill),
+    (7, "indexes for the admin user browser", m0007_admin_browse_indexes),
+    (8, "users.blocked_at to skip chats that blocked the bot", m0008_user_blocked_at),
+]
+
+
+def _ensure_version_table(conn: Connection):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR(255) NOT NULL, "
+        "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    ))
+
+
+def _applied_versions(conn: Connection) -> set[int]:
+    _ensure_version_table(conn)
+    return set(conn.execute(text("SELECT version FROM schema_version")).scalars())
+
+
+def _apply_one(conn: Connection, version: int, description: str, fn: Callable[[Connection], None]):
+    fn(conn)
+    conn.execute(
+        text("INSERT INTO schema_version (version, description) VALUES (:v, :d)"),
+        {"v": version, "d": description},
+    )
+
+
+async def apply_migrations(db: Db):
+    async with db.engine.begin() as conn:
+        applied = await conn.run_sync(_applied_versions)
+
+    for version, description, fn in MIGRATIONS:
+        if version in applied:
+            continue
+        async with db.engine.begin() as conn:
+            await conn.run_sync(_apply_one, version, description, fn)
+        logger.info(f"Applied migration {version}: {description}")
@@ -1,6 +1,6 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import Integer, String, Float, DateTime, Boolean, ForeignKey, func
-from datetime import datetime
+from sqlalchemy import Integer, BigInteger, String, Text, Float, Date, DateTime, Boolean, ForeignKey, func
+from datetime import date, datetime
 
 
 class Base(DeclarativeBase):
@@ -25,8 +25,22 @@ class User(Base):
     vpn_uuid: Mapped[str | None] = mapped_column(String(64), nullable=True)
     vpn_email: Mapped[str | None] = mapped_column(String(128), nullable=True)
 
+    # нода (панель + инбаунд), на которой живёт клиент; NULL — нода по умолчанию
+    node_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
     menu_message_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
 
+    # active_until, о конце которого уже предупредили; продление сбрасывает совпадение
+    warned_until: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    # трафик (up + down, байты): израсходовано за оплаченный период и последний
+    # виденный счётчик панели, от которого traffic_worker считает прирост
+    traffic_used: Mapped[int] = mapped_column(BigInteger, default=0)
+    traffic_seen: Mapped[int] = mapped_column(BigInteger, default=0)
+
+    # когда Telegram ответил, что бот заблокирован или чат удалён; рассылки таких пропускают
+    blocked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
     created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
 
 
@@ -38,3 +52,97 @@ class DepositRequest(Base):
     amount: Mapped[float] = mapped_column(Float)
     status: Mapped[str] = mapped_column(String(16), default="pending")
     created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+
+
+class Node(Base):
+    __tablename__ = "nodes"
+
+    node_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # сколько клиентов создано на ноде — по нему выбирается наименее загруженная
+    client_count: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class PanelOp(Base):
+    """
+    Outbox операций с панелью: пишется в одной транзакции с изменением users,
+    в панель уходит из outbox_worker. Состояние клиента (enable, expiry)
+    абсолютное, поэтому повтор операции безопасен.
+    """
+    __tablename__ = "panel_outbox"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # одна и та же операция (создание клиента, то же состояние) ставится один раз
+    idem_key: Mapped[str] = mapped_column(String(160), unique=True)
+    user_id: Mapped[int] = mapped_column(Integer, index=True)
+    node_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    # add | update
+    op: Mapped[str] = mapped_column(String(16))
+    vpn_uuid: Mapped[str] = mapped_column(String(64))
+    vpn_email: Mapped[str | None] = mapped_column(String(128), nullable=True)
+    enable: Mapped[bool] = mapped_column(Boolean, default=True)
+    expiry_ms: Mapped[int] = mapped_column(BigInteger, default=0)
+
+    # pending | done | failed | superseded (заменена более новой операцией по тому же клиенту)
+    status: Mapped[str] = mapped_column(String(16), default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+    last_error: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+
+
+class Lease(Base):
+    """Аренда фоновой задачи, которая должна идти ровно в одном процессе (см. lease.py)."""
+    __tablename__ = "leases"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    holder: Mapped[str] = mapped_column(String(128))
+    expires_at: Mapped[datetime] = mapped_column(DateTime)
+
+
+class TrafficUsage(Base):
+    """Прирост трафика клиента за час: одна строка на (пользователь, час), только при ненулевом приросте."""
+    __tablename__ = "traffic_usage"
+
+    user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    bucket: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    bytes: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class DailyStats(Base):
+    """
+    Дневные счётчики для /stats. Пишутся инкрементом в той же транзакции,
+    что и само событие, поэтому отчёт не сканирует users и deposit_requests.
+    """
+    __tablename__ = "daily_stats"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    signups: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    deposits: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    deposits_amount: Mapped[float] = mapped_column(Float, default=0.0, server_default="0")
+    activations: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    # списано с балансов за подписки
+    revenue: Mapped[float] = mapped_column(Float, default=0.0, server_default="0")
+    expirations: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    # изменение числа пользователей с is_active за день; сумма по всем дням — активные сейчас
+    active_delta: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+
+class Broadcast(Base):
+    """
+    Рассылка от админа. cursor — последний обработанный user_id: после
+    перезапуска broadcast_worker продолжает с него, а не с начала.
+    """
+    __tablename__ = "broadcasts"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    text: Mapped[str] = mapped_column(Text)
+    # running | done | cancelled
+    status: Mapped[str] = mapped_column(String(16), default="running")
+    cursor: Mapped[int] = mapped_column(BigInteger, default=0)
+    # сколько получателей было на момент запуска — для прогресса
+    total: Mapped[int] = mapped_column(Integer, default=0)
+    sent: Mapped[int] = mapped_column(Integer, default=0)
+    failed: Mapped[int] = mapped_column(Integer, default=0)
+    blocked: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now())
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
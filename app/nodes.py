@@ -0,0 +1,60 @@
+# app/nodes.py
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+from .config import XuiConfig
+from .xui import XuiPanel
+
+
+@dataclass(frozen=True)
+class PanelNode:
+    """Нода = панель 3x-ui + инбаунд + reality-параметры сервера для ключей."""
+    config: XuiConfig
+    xui: XuiPanel
+
+    @property
+    def node_id(self) -> int:
+        return self.config.node_id
+
+    @property
+    def inbound_id(self) -> int:
+        return self.config.inbound_id
+
+
+class NodeRegistry:
+    """
+    Все ноды процесса. Первая в списке — нода по умолчанию: на ней живут
+    клиенты, созданные до появления шардирования (users.node_id IS NULL).
+    Ноды с одной панелью делят один XuiPanel, а значит и сессию с cookie.
+    exclusive=False — в панели пишет не только этот процесс (см. XuiPanel).
+    """
+
+    def __init__(self, configs: list[XuiConfig], exclusive: bool = True):
+        if not configs:
+            raise RuntimeError("no xui nodes configured")
+        panels: dict[tuple[str, str], XuiPanel] = {}
+        self._nodes: dict[int, PanelNode] = {}
+        for cfg in configs:
+            key = (cfg.url.rstrip("/"), cfg.username)
+            if key not in panels:
+                panels[key] = XuiPanel(cfg.url, cfg.username, cfg.password, exclusive=exclusive)
+            self._nodes[cfg.node_id] = PanelNode(cfg, panels[key])
+        self._panels = list(panels.values())
+        self.default_id = configs[0].node_id
+
+    def get(self, node_id: int | None) -> PanelNode:
+        node = self._nodes.get(node_id if node_id is not None else self.default_id)
+        if node is None:
+            raise RuntimeError(f"unknown xui node {node_id}")
+        return node
+
+    def all(self) -> list[PanelNode]:
+        return list(self._nodes.values())
+
+    def weights(self) -> dict[int, int]:
+        return {n.node_id: max(1, n.config.weight) for n in self._nodes.values()}
+
+    async def close(self):
+        for xui in self._panels:
+            await xui.close()
@@ -0,0 +1,166 @@
+# app/outbox_worker.py
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from .db import Db
+from .models import PanelOp
+from .nodes import NodeRegistry, PanelNode
+from .repo import OutboxRepo
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 5
+BATCH_SIZE = 200
+CONCURRENCY = 4
+MAX_ATTEMPTS = 10
+MAX_BACKOFF = 600
+PANEL_TIMEOUT = 60
+KEEP_DONE = timedelta(days=1)
+
+
+def new_client(vpn_uuid: str, email: str, expiry_ms: int, enable: bool = True) -> dict:
+    return {
+        "id": vpn_uuid,
+        "email": email,
+        "flow": "xtls-rprx-vision",
+        "limitIp": 1,
+        "totalGB": 0,
+        "expiryTime": expiry_ms,
+        "enable": enable,
+    }
+
+
+async def _apply_node(node: PanelNode, ops: list[PanelOp]) -> tuple[list[int], dict[int, str]]:
+    """Применяет операции одной ноды: создание пачкой, потом одна запись состояний."""
+    done, failed = [], {}
+
+    adds = [op for op in ops if op.op == "add"]
+    if adds:
+        # повтор после таймаута: клиент мог успеть создаться — второй раз не добавляем
+        retried = [op.vpn_uuid for op in adds if op.attempts]
+        exists = await node.xui.existing_clients(node.inbound_id, retried, timeout=PANEL_TIMEOUT) if retried else set()
+        if exists is None:
+            exists = set()
+        todo = [op for op in adds if op.vpn_uuid not in exists]
+        done.extend(op.id for op in adds if op.vpn_uuid in exists)
+        results = await asyncio.gather(
+            *(
+                node.xui.add_client(
+                    node.inbound_id, new_client(op.vpn_uuid, op.vpn_email, op.expiry_ms, op.enable), timeout=PANEL_TIMEOUT
+                )
+                for op in todo
+            ),
+            return_exceptions=True,
+        )
+        for op, ok in zip(todo, results):
+            if ok is True:
+                done.append(op.id)
+            else:
+                failed[op.id] = str(ok) if isinstance(ok, Exception) else "add_client failed"
+
+    # состояние абсолютное: по каждому клиенту достаточно последней операции
+    latest: dict[str, PanelOp] = {}
+    superseded: dict[str, list[int]] = {}
+    for op in ops:
+        if op.op != "update":
+            continue
+        prev = latest.get(op.vpn_uuid)
+        if prev is None or op.id > prev.id:
+            latest[op.vpn_uuid] = op
+        superseded.setdefault(op.vpn_uuid, []).append(op.id)
+    # клиент из неудавшегося add ещё не создан — его обновления ждут следующей попытки
+    not_created = {op.vpn_uuid for op in adds if op.id in failed}
+    for uuid_str in not_created & latest.keys():
+        for op_id in superseded.pop(uuid_str):
+            failed[op_id] = "client is not created yet"
+        del latest[uuid_str]
+
+    if latest:
+        # одиночные изменения update_clients сам шлёт точечным updateClient с полным клиентом
+        applied = await node.xui.update_clients(
+            node.inbound_id,
+            [(op.vpn_uuid, op.enable, op.expiry_ms) for op in latest.values()],
+            timeout=PANEL_TIMEOUT,
+        )
+    else:
+        applied = set()
+    for uuid_str in latest:
+        if uuid_str in applied:
+            done.extend(superseded[uuid_str])
+        else:
+            for op_id in superseded[uuid_str]:
+                failed[op_id] = "update_clients failed"
+    return done, failed
+
+
+async def drain_outbox(
+    db: Db, registry: NodeRegistry, batch_size: int = BATCH_SIZE, concurrency: int = CONCURRENCY
+) -> int:
+    """Одна пачка due-операций; ноды обрабатываются параллельно. Возвращает размер пачки."""
+    async with db.sessionmaker() as s:
+        ops = await OutboxRepo(s).get_due(batch_size)
+    if not ops:
+        return 0
+
+    done, failed = [], {}
+    by_node: dict[int, list[PanelOp]] = {}
+    for op in ops:
+        try:
+            by_node.setdefault(registry.get(op.node_id).node_id, []).append(op)
+        except RuntimeError as e:
+            failed[op.id] = str(e)
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run(node_id: int, node_ops: list[PanelOp]):
+        async with sem:
+            try:
+                return await _apply_node(registry.get(node_id), node_ops)
+            except Exception as e:
+                return [], {op.id: str(e) for op in node_ops}
+
+    for node_done, node_failed in await asyncio.gather(*(run(n, o) for n, o in by_node.items())):
+        done.extend(node_done)
+        failed.update(node_failed)
+
+    now = datetime.utcnow()
+    attempts = {op.id: op.attempts + 1 for op in ops}
+    async with db.sessionmaker() as s:
+        outbox = OutboxRepo(s)
+        await outbox.mark_done(done)
+        for op_id, error in failed.items():
+            n = attempts[op_id]
+            retry_at = now + timedelta(seconds=min(MAX_BACKOFF, 2 ** n)) if n < MAX_ATTEMPTS else None
+            if retry_at is None:
+                logger.error(f"Panel operation {op_id} gave up after {n} attempts: {error}")
+            await outbox.mark_failed(op_id, n, retry_at, error)
+        await s.commit()
+
+    if failed:
+        logger.warning(f"Panel outbox: {len(done)} done, {len(failed)} failed")
+    return len(ops)
+
+
+async def run_outbox_worker(db: Db, registry: NodeRegistry, wakeup: asyncio.Event):
+    """
+    Разгребает panel_outbox. Новые операции будят воркер сразу после commit
+    (wakeup), отложенные повторы подхватываются опросом раз в POLL_INTERVAL.
+    """
+    pruned_at = datetime.min
+    while True:
+        wakeup.clear()
+        try:
+            if await drain_outbox(db, registry) >= BATCH_SIZE:
+                continue
+            if datetime.utcnow() - pruned_at > timedelta(hours=1):
+                async with db.sessionmaker() as s:
+                    await OutboxRepo(s).prune_done(datetime.utcnow() - KEEP_DONE)
+                    await s.commit()
+                pruned_at = datetime.utcnow()
+        except Exception as e:
+            logger.error(f"Error in outbox_worker: {e}")
+        try:
+            await asyncio.wait_for(wakeup.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
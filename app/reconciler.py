@@ -0,0 +1,232 @@
+# app/reconciler.py
+"""
+Сверка users с панелями: по одному свежему inbounds/get на ноду, индексы
+по uuid с обеих сторон и разности множеств за O(N).
+
+    python -m app.reconciler            # отчёт, ничего не меняет
+    python -m app.reconciler --apply    # отчёт и исправление
+
+Что чинится:
+- missing — клиент есть в БД, нет в панели: создаётся в состоянии из БД;
+- state — enable/expiryTime в панели расходятся с БД: одна запись update_clients;
+- orphan — включённый наш (tg_*) клиент в панели, которого нет в БД этой ноды: выключается;
+  если пользователь без клиента в БД — клиент привязывается к нему (adopted).
+Клиенты с операциями, ещё ждущими в panel_outbox, пропускаются: их доставит outbox_worker.
+Конфликты (email из БД уже занят в панели другим uuid) только попадают в отчёт.
+Недостающие перед созданием перепроверяются свежим inbounds/get: outbox мог
+создать их уже после снимка панели.
+"""
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from .config import load_nodes, load_settings
+from .db import Db
+from .nodes import NodeRegistry, PanelNode
+from .outbox_worker import new_client
+from .repo import UsersRepo, NodesRepo, OutboxRepo
+
+logger = logging.getLogger(__name__)
+
+PANEL_TIMEOUT = 60
+RECONCILE_INTERVAL = 3600
+OUR_EMAIL_PREFIX = "tg_"
+
+
+def _expiry_ms(active_until: datetime | None) -> int:
+    return int(active_until.timestamp() * 1000) if active_until else 0
+
+
+@dataclass
+class NodeReport:
+    node_id: int
+    panel_clients: int = 0
+    db_clients: int = 0
+    skipped_pending: int = 0
+    missing: list[str] = field(default_factory=list)
+    state: list[str] = field(default_factory=list)
+    orphans: list[str] = field(default_factory=list)
+    adopted: list[int] = field(default_factory=list)
+    conflicts: list[str] = field(default_factory=list)
+    failed: list[str] = field(default_factory=list)
+    panel_writes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def drift(self) -> int:
+        return len(self.missing) + len(self.state) + len(self.orphans) + len(self.adopted) + len(self.conflicts)
+
+    def summary(self) -> str:
+        def sample(items: list) -> str:
+            return f" e.g. {', '.join(map(str, items[:3]))}" if items else ""
+
+        return (
+            f"node {self.node_id}: panel={self.panel_clients} db={self.db_clients} "
+            f"pending={self.skipped_pending} | missing={len(self.missing)}{sample(self.missing)} "
+            f"state={len(self.state)}{sample(self.state)} orphans={len(self.orphans)}{sample(self.orphans)} "
+            f"adopted={len(self.adopted)} conflicts={len(self.conflicts)}{sample(self.conflicts)} "
+            f"| writes={self.panel_writes} failed={len(self.failed)} {self.elapsed:.2f}s"
+        )
+
+
+async def reconcile_node(db: Db, registry: NodeRegistry, node: PanelNode, dry_run: bool = True) -> NodeReport:
+    t0 = asyncio.get_running_loop().time()
+    report = NodeReport(node.node_id)
+
+    # сначала панель, потом БД: всё, что закоммичено после снимка панели, в БД уже видно
+    clients = await node.xui.list_clients(node.inbound_id, timeout=PANEL_TIMEOUT)
+    if clients is None:
+        raise RuntimeError(f"node {node.node_id} is unavailable")
+    panel = {c.get("id"): c for c in clients if c.get("id")}
+    panel_emails = {c.get("email"): uuid for uuid, c in panel.items()}
+
+    async with db.sessionmaker() as s:
+        users = UsersRepo(s)
+        rows = await users.get_panel_state(node.node_id, include_unassigned=node.node_id == registry.default_id)
+        pending = await OutboxRepo(s).pending_uuids()
+
+        now = datetime.utcnow()
+
+        def target(is_active: bool, active_until: datetime | None) -> tuple[bool, int]:
+            return bool(is_active and active_until and active_until > now), _expiry_ms(active_until)
+
+        # uuid -> (user_id, email, enable, expiry_ms) — каким клиент должен быть по БД
+        expected = {
+            vpn_uuid: (user_id, email or f"{OUR_EMAIL_PREFIX}{user_id}", *target(is_active, active_until))
+            for user_id, vpn_uuid, email, is_active, active_until in rows
+        }
+        report.panel_clients, report.db_clients = len(panel), len(expected)
+        report.skipped_pending = len((expected.keys() | panel.keys()) & pending)
+
+        for vpn_uuid in expected.keys() - panel.keys() - pending:
+            email = expected[vpn_uuid][1]
+            if email in panel_emails:
+                report.conflicts.append(vpn_uuid)
+            else:
+                report.missing.append(vpn_uuid)
+
+        for vpn_uuid in (expected.keys() & panel.keys()) - pending:
+            c = panel[vpn_uuid]
+            if (bool(c.get("enable")), int(c.get("expiryTime") or 0)) != expected[vpn_uuid][2:]:
+                report.state.append(vpn_uuid)
+
+        unknown = {
+            vpn_uuid: c for vpn_uuid, c in panel.items()
+            if vpn_uuid not in expected and vpn_uuid not in pending
+            and str(c.get("email") or "").startswith(OUR_EMAIL_PREFIX)
+        }
+        # клиент создан в панели, а строка users осталась без uuid (откат после записи в панель)
+        by_user = {}
+        for vpn_uuid, c in unknown.items():
+            suffix = c["email"][len(OUR_EMAIL_PREFIX):]
+            if suffix.isdigit():
+                by_user[int(suffix)] = vpn_uuid
+        adoptable = await users.get_without_vpn(list(by_user))
+        report.adopted = sorted(adoptable)
+        adopted_uuids = {by_user[user_id] for user_id in adoptable}
+        # выключенный чужак уже безвреден — удалять клиентов из панели сверка не берётся
+        report.orphans = [
+            vpn_uuid for vpn_uuid, c in unknown.items() if vpn_uuid not in adopted_uuids and c.get("enable")
+        ]
+
+        if dry_run or not report.drift:
+            report.elapsed = asyncio.get_running_loop().time() - t0
+            return report
+
+        if report.adopted:
+            for user_id in report.adopted:
+                vpn_uuid = by_user[user_id]
+                await users.set_vpn_if_missing(user_id, vpn_uuid, panel[vpn_uuid]["email"], node.node_id)
+            await NodesRepo(s).add_clients(node.node_id, len(report.adopted))
+            await s.commit()
+            users.invalidate_dirty()
+
+    updates = [(vpn_uuid, *expected[vpn_uuid][2:]) for vpn_uuid in report.state]
+    updates += [(vpn_uuid, False, int(panel[vpn_uuid].get("expiryTime") or 0)) for vpn_uuid in report.orphans]
+    for user_id, state in adoptable.items():
+        c = panel[by_user[user_id]]
+        if (bool(c.get("enable")), int(c.get("expiryTime") or 0)) != target(*state):
+            updates.append((by_user[user_id], *target(*state)))
+
+    if report.missing:
+        # снимок панели старше чтения БД: клиент, которого outbox создал между ними,
+        # выглядит недостающим. Перед созданием — свежий inbounds/get
+        present = await node.xui.existing_clients(node.inbound_id, report.missing, timeout=PANEL_TIMEOUT)
+        if present is None:
+            raise RuntimeError(f"node {node.node_id} is unavailable")
+        if present:
+            report.missing = [vpn_uuid for vpn_uuid in report.missing if vpn_uuid not in present]
+            report.skipped_pending += len(present)
+    if report.missing:
+        # add_client сам складывает одновременные вызовы в пачки
+        results = await asyncio.gather(
+            *(
+                node.xui.add_client(
+                    node.inbound_id,
+                    new_client(vpn_uuid, expected[vpn_uuid][1], expected[vpn_uuid][3], expected[vpn_uuid][2]),
+                    timeout=PANEL_TIMEOUT,
+                )
+                for vpn_uuid in report.missing
+            ),
+            return_exceptions=True,
+        )
+        report.failed += [vpn_uuid for vpn_uuid, ok in zip(report.missing, results) if ok is not True]
+        report.panel_writes += -(-len(report.missing) // node.xui.max_batch)
+
+    if updates:
+        applied = await node.xui.update_clients(node.inbound_id, updates, timeout=PANEL_TIMEOUT)
+        report.failed += [vpn_uuid for vpn_uuid, _, _ in updates if vpn_uuid not in applied]
+        report.panel_writes += 1
+
+    report.elapsed = asyncio.get_running_loop().time() - t0
+    return report
+
+
+async def reconcile(db: Db, registry: NodeRegistry, dry_run: bool = True) -> list[NodeReport]:
+    reports = []
+    for node in registry.all():
+        try:
+            report = await reconcile_node(db, registry, node, dry_run)
+        except Exception as e:
+            logger.error(f"Reconcile node {node.node_id} failed: {e}")
+            continue
+        reports.append(report)
+        if report.drift or report.failed:
+            logger.warning(f"Reconcile{' (dry run)' if dry_run else ''}: {report.summary()}")
+    return reports
+
+
+async def run_reconciler(
+    db: Db, registry: NodeRegistry, apply: bool = False, interval: float = RECONCILE_INTERVAL
+):
+    """Раз в interval; без apply (RECONCILE_APPLY) только пишет расхождения в лог."""
+    while True:
+        try:
+            await reconcile(db, registry, dry_run=not apply)
+        except Exception as e:
+            logger.error(f"Error in reconciler: {e}")
+        await asyncio.sleep(interval)
+
+
+async def main():
+    p = argparse.ArgumentParser(description="Сверка users с панелями 3x-ui")
+    p.add_argument("--apply", action="store_true", help="исправить расхождения (по умолчанию только отчёт)")
+    args = p.parse_args()
+
+    settings = load_settings()
+    db = Db(settings.db_dsn)
+    # рядом работает бот со своими записями в панель
+    registry = NodeRegistry(load_nodes(), exclusive=False)
+    try:
+        for report in await reconcile(db, registry, dry_run=not args.apply):
+            print(report.summary())
+    finally:
+        await registry.close()
+        await db.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(main())
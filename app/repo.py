@@ -1,67 +1,439 @@
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
-from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func, or_, and_, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from datetime import date, datetime, timedelta
 
-from .models import User, DepositRequest
+from .cache import UserCache
+from .models import User, DepositRequest, Node, PanelOp, Lease, TrafficUsage, DailyStats, Broadcast
+from .scheduler import ExpiryScheduler
+
+
+def _insert(s: AsyncSession, table):
+    """INSERT с on_conflict_do_update под диалект сессии (SQLite или Postgres)."""
+    dialect = s.get_bind().dialect.name
+    return (postgresql if dialect == "postgresql" else sqlite).insert(table)
 
 
 class UsersRepo:
-    def __init__(self, s: AsyncSession):
+    def __init__(self, s: AsyncSession, scheduler: ExpiryScheduler | None = None, cache: UserCache | None = None):
         self.s = s
+        self.scheduler = scheduler
+        self.cache = cache
+        # пользователи, изменённые в этой сессии: их читаем только из БД и не кладём в кэш
+        self._dirty: set[int] = set()
+        # identity map сессии держит объекты по слабым ссылкам — держим сами,
+        # чтобы повторный get в том же апдейте не делал SELECT
+        self._loaded: dict[int, User] = {}
 
     async def get(self, user_id: int) -> User | None:
-        res = await self.s.execute(select(User).where(User.user_id == user_id))
-        return res.scalar_one_or_none()
+        if self.cache is not None and user_id not in self._dirty:
+            u = self.cache.get(user_id)
+            if u is not None:
+                return u
+        u = self._loaded.get(user_id)
+        if u is not None:
+            return u
+        u = await self.s.get(User, user_id)
+        if u is None:
+            return None
+        self._loaded[user_id] = u
+        if self.cache is not None and user_id not in self._dirty:
+            self.cache.put(u)
+        return u
+
+    async def _update(self, user_id: int, **values):
+        # evaluate: объект в identity map правится на месте, следующий get обходится без SELECT
+        await self.s.execute(
+            update(User)
+            .where(User.user_id == user_id)
+            .values(**values)
+            .execution_options(synchronize_session="evaluate")
+        )
+        self._touch(user_id)
+
+    async def _update_if(self, user_id: int, *conditions, **values) -> bool:
+        """
+        Условный UPDATE, атомарный и между процессами. evaluate тут не годится:
+        условие проверялось бы по копии в памяти, поэтому объект перечитывается.
+        """
+        res = await self.s.execute(
+            update(User)
+            .where(User.user_id == user_id, *conditions)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        u = self._loaded.get(user_id)
+        if u is not None:
+            await self.s.refresh(u)
+        self._touch(user_id)
+        return res.rowcount == 1
+
+    def _touch(self, *user_ids: int):
+        self._dirty.update(user_ids)
+        if self.cache is not None:
+            for user_id in user_ids:
+                self.cache.invalidate(user_id)
+
+    def invalidate_dirty(self):
+        """
+        Вызывается после commit: между записью и коммитом параллельный апдейт
+        мог положить в кэш старую версию строки.
+        """
+        if self.cache is not None:
+            for user_id in self._dirty:
+                self.cache.invalidate(user_id)
+        self._dirty.clear()
 
     async def add_if_missing(self, user_id: int, username: str | None) -> User:
         u = await self.get(user_id)
         if u:
             if username and u.username != username:
-                u.username = username
+                await self._update(user_id, username=username)
+                return await self.get(user_id)
             return u
-        u = User(user_id=user_id, username=username)
-        self.s.add(u)
-        await self.s.flush()
-        return u
+        await self.insert_if_missing(user_id, username)
+        return await self.get(user_id)
+
+    async def insert_if_missing(self, user_id: int, username: str | None) -> bool:
+        """INSERT ... ON CONFLICT DO NOTHING: True — строку вставил именно этот вызов."""
+        res = await self.s.execute(
+            _insert(self.s, User.__table__)
+            .values(user_id=user_id, username=username)
+            .on_conflict_do_nothing(index_elements=["user_id"])
+        )
+        self._touch(user_id)
+        return res.rowcount == 1
 
     async def set_ban(self, user_id: int, banned: bool):
-        await self.s.execute(update(User).where(User.user_id == user_id).values(is_banned=banned))
+        await self._update(user_id, is_banned=banned)
 
     async def add_balance(self, user_id: int, amount: float):
-        await self.s.execute(update(User).where(User.user_id == user_id).values(balance=User.balance + amount))
+        await self._update(user_id, balance=User.balance + amount)
 
-    async def set_active(self, user_id: int, active: bool):
-        await self.s.execute(update(User).where(User.user_id == user_id).values(is_active=active))
+    async def add_balance_many(self, amounts: dict[int, float]):
+        """user_id -> сумма; один executemany вместо UPDATE на каждую заявку."""
+        if not amounts:
+            return
+        t = User.__table__
+        await self.s.execute(
+            update(t).where(t.c.user_id == bindparam("uid")).values(balance=t.c.balance + bindparam("amount")),
+            [{"uid": uid, "amount": amount} for uid, amount in amounts.items()],
+        )
+        # executemany по таблице не трогает identity map — загруженные объекты перечитываем
+        for uid in amounts:
+            u = self._loaded.get(uid)
+            if u is not None:
+                await self.s.refresh(u)
+        self._touch(*amounts)
+
+    async def try_debit(self, user_id: int, amount: float) -> bool:
+        """Списывает amount, только если хватает баланса; False — не хватило."""
+        return await self._update_if(user_id, User.balance >= amount, balance=User.balance - amount)
+
+    async def set_active(self, user_id: int, active: bool) -> bool:
+        """True — is_active действительно поменялся (для счётчика активных в daily_stats)."""
+        changed = await self._update_if(user_id, User.is_active != active, is_active=active)
+        # при выключении запись в куче просто отработает вхолостую
+        if active and self.scheduler:
+            u = await self.get(user_id)
+            self.scheduler.schedule(user_id, u.active_until if u else None)
+        return changed
 
     async def extend_until(self, user_id: int, days: int):
-        u = await self.get(user_id)
-        base = u.active_until if u and u.active_until and u.active_until > datetime.utcnow() else datetime.utcnow()
-        new_until = base + timedelta(days=days)
-        await self.s.execute(update(User).where(User.user_id == user_id).values(active_until=new_until))
+        """
+        Срок читается из БД мимо кэша и пишется условным UPDATE по прочитанному
+        значению: продление, сделанное параллельно в другом процессе, не затрётся.
+        (max(active_until, now) + interval одним UPDATE не переносим на SQLite.)
+        """
+        for _ in range(5):
+            res = await self.s.execute(select(User.active_until).where(User.user_id == user_id))
+            row = res.first()
+            if row is None:
+                return
+            current, now = row[0], datetime.utcnow()
+            new_until = (current if current and current > now else now) + timedelta(days=days)
+            seen = User.active_until.is_(None) if current is None else User.active_until == current
+            if await self._update_if(user_id, seen, active_until=new_until):
+                if self.scheduler:
+                    self.scheduler.schedule(user_id, new_until)
+                return
+        raise RuntimeError(f"active_until of user {user_id} keeps changing, extend aborted")
 
     async def set_menu_message_id(self, user_id: int, msg_id: int | None):
-        await self.s.execute(update(User).where(User.user_id == user_id).values(menu_message_id=msg_id))
+        await self._update(user_id, menu_message_id=msg_id)
 
     async def get_menu_message_id(self, user_id: int) -> int | None:
-        res = await self.s.execute(select(User.menu_message_id).where(User.user_id == user_id))
-        return res.scalar()
+        u = await self.get(user_id)
+        return u.menu_message_id if u else None
 
     # ✅ сохраняем identity клиента в панели
-    async def set_vpn(self, user_id: int, vpn_uuid: str, vpn_email: str):
-        await self.s.execute(
-            update(User).where(User.user_id == user_id).values(vpn_uuid=vpn_uuid, vpn_email=vpn_email)
+    async def set_vpn(self, user_id: int, vpn_uuid: str, vpn_email: str, node_id: int | None = None):
+        await self._update(user_id, vpn_uuid=vpn_uuid, vpn_email=vpn_email, node_id=node_id)
+
+    async def set_vpn_if_missing(self, user_id: int, vpn_uuid: str, vpn_email: str, node_id: int | None = None) -> bool:
+        """False — клиента уже завёл параллельный запрос (в т.ч. из другого процесса)."""
+        return await self._update_if(
+            user_id, User.vpn_uuid.is_(None), vpn_uuid=vpn_uuid, vpn_email=vpn_email, node_id=node_id
         )
 
+    async def deactivate_many(self, user_ids: list[int], *conditions) -> list[int]:
+        """Один set-based UPDATE (по чанкам — лимит bind-параметров SQLite). Возвращает, кого выключил."""
+        changed = []
+        for i in range(0, len(user_ids), 500):
+            chunk = user_ids[i:i + 500]
+            res = await self.s.execute(
+                update(User)
+                .where(User.user_id.in_(chunk), User.is_active == True, *conditions)
+                .values(is_active=False)
+                .returning(User.user_id)
+                .execution_options(synchronize_session="evaluate")
+            )
+            changed.extend(res.scalars().all())
+        self._touch(*user_ids)
+        return changed
+
     # ✅ для expire_worker
-    async def get_expired_active(self) -> list[User]:
+    async def get_expired_active(self, user_ids: list[int] | None = None) -> list[User]:
         now = datetime.utcnow()
+        stmt = select(User).where(
+            User.is_active == True,
+            User.active_until.is_not(None),
+            User.active_until < now,
+            User.vpn_uuid.is_not(None),
+        )
+        if user_ids is None:
+            res = await self.s.execute(stmt)
+            return list(res.scalars().all())
+
+        expired = []
+        for i in range(0, len(user_ids), 500):
+            res = await self.s.execute(stmt.where(User.user_id.in_(user_ids[i:i + 500])))
+            expired.extend(res.scalars().all())
+        return expired
+
+    async def get_upcoming_deadlines(self, limit: int) -> list[tuple[int, datetime]]:
+        """Ближайшие дедлайны активных клиентов — окно для ExpiryScheduler."""
         res = await self.s.execute(
-            select(User).where(
+            select(User.user_id, User.active_until)
+            .where(
                 User.is_active == True,
                 User.active_until.is_not(None),
-                User.active_until < now,
                 User.vpn_uuid.is_not(None),
             )
+            .order_by(User.active_until)
+            .limit(limit)
+        )
+        return [(uid, until) for uid, until in res.all()]
+
+    async def get_expiring_unwarned(
+        self, until: datetime, after: tuple[datetime, int] | None = None, limit: int = 500
+    ) -> list[tuple[int, datetime]]:
+        """
+        Активные клиенты, у которых active_until наступит до `until` и о нём ещё
+        не предупреждали. Keyset по (active_until, user_id): страницы идут по
+        ix_users_expiry без OFFSET.
+        """
+        stmt = (
+            select(User.user_id, User.active_until)
+            .where(
+                User.is_active == True,
+                User.vpn_uuid.is_not(None),
+                User.active_until > datetime.utcnow(),
+                User.active_until <= until,
+                or_(User.warned_until.is_(None), User.warned_until != User.active_until),
+            )
+            .order_by(User.active_until, User.user_id)
+            .limit(limit)
+        )
+        if after is not None:
+            last_until, last_id = after
+            stmt = stmt.where(or_(
+                User.active_until > last_until,
+                and_(User.active_until == last_until, User.user_id > last_id),
+            ))
+        res = await self.s.execute(stmt)
+        return [(uid, until) for uid, until in res.all()]
+
+    async def mark_warned(self, rows: list[tuple[int, datetime]]):
+        """
+        rows: (user_id, прочитанный active_until). Пишется именно прочитанное
+        значение и только если оно не изменилось: продлённый между чтением и
+        отметкой период остаётся непредупреждённым.
+        """
+        if not rows:
+            return
+        t = User.__table__
+        await self.s.execute(
+            update(t)
+            .where(t.c.user_id == bindparam("uid"), t.c.active_until == bindparam("seen"))
+            .values(warned_until=bindparam("seen")),
+            [{"uid": uid, "seen": seen} for uid, seen in rows],
+        )
+        for uid, _ in rows:
+            u = self._loaded.get(uid)
+            if u is not None:
+                await self.s.refresh(u)
+        self._touch(*(uid for uid, _ in rows))
+
+    # ✅ для traffic_worker
+    async def reset_traffic(self, user_id: int):
+        """Новый оплаченный период — квота считается заново."""
+        await self._update(user_id, traffic_used=0)
+
+    async def get_traffic_counters(self, node_id: int, include_unassigned: bool = False) -> dict[str, tuple[int, int]]:
+        """vpn_email -> (user_id, traffic_seen) клиентов ноды; ключ совпадает с email в clientStats панели."""
+        cond = User.node_id == node_id
+        if include_unassigned:
+            cond = or_(cond, User.node_id.is_(None))
+        res = await self.s.execute(
+            select(User.vpn_email, User.user_id, User.traffic_seen).where(User.vpn_uuid.is_not(None), cond)
+        )
+        return {email: (uid, seen or 0) for email, uid, seen in res.all()}
+
+    async def add_traffic(self, rows: list[tuple[int, int, int]]):
+        """
+        rows: (user_id, новый счётчик панели, прирост). Один executemany: счётчик
+        пишется как есть, traffic_used растёт на прирост прямо в UPDATE, чтобы не
+        затереть параллельный reset_traffic.
+        """
+        if not rows:
+            return
+        t = User.__table__
+        await self.s.execute(
+            update(t)
+            .where(t.c.user_id == bindparam("uid"))
+            .values(traffic_seen=bindparam("seen"), traffic_used=t.c.traffic_used + bindparam("delta")),
+            [{"uid": uid, "seen": seen, "delta": delta} for uid, seen, delta in rows],
+        )
+        self._touch(*(uid for uid, _, _ in rows))
+
+    # ✅ для broadcast_worker
+    def _broadcast_filter(self) -> list:
+        return [User.blocked_at.is_(None), User.is_banned == False]
+
+    async def count_broadcast_recipients(self) -> int:
+        res = await self.s.execute(select(func.count()).select_from(User).where(*self._broadcast_filter()))
+        return int(res.scalar() or 0)
+
+    async def get_broadcast_recipients(self, after: int, limit: int = 100) -> list[int]:
+        """Keyset по PK: пачка user_id после курсора рассылки."""
+        res = await self.s.execute(
+            select(User.user_id)
+            .where(User.user_id > after, *self._broadcast_filter())
+            .order_by(User.user_id)
+            .limit(limit)
+        )
+        return list(res.scalars().all())
+
+    async def mark_blocked(self, user_ids: list[int]):
+        if not user_ids:
+            return
+        await self.s.execute(
+            update(User)
+            .where(User.user_id.in_(user_ids))
+            .values(blocked_at=datetime.utcnow())
+            .execution_options(synchronize_session="evaluate")
+        )
+        self._touch(*user_ids)
+
+    async def clear_blocked(self, user_id: int):
+        await self._update(user_id, blocked_at=None)
+
+    # ✅ для /users и /find
+    def _status_filter(self, status: str) -> list:
+        # условия буквально совпадают с частичными индексами из миграции 7 (и ix_users_expiry)
+        return {
+            "active": [User.is_active == True],
+            "paused": [User.is_active == False, User.vpn_uuid.is_not(None)],
+            "banned": [User.is_banned == True],
+            "expiring": [User.is_active == True, User.vpn_uuid.is_not(None)],
+        }.get(status, [])
+
+    async def browse(self, status: str = "all", after: int | None = None, limit: int = 10) -> list[User]:
+        """Keyset по user_id: PK или частичный индекс статуса, без OFFSET."""
+        stmt = select(User).where(*self._status_filter(status)).order_by(User.user_id).limit(limit)
+        if after is not None:
+            stmt = stmt.where(User.user_id > after)
+        res = await self.s.execute(stmt)
+        return list(res.scalars().all())
+
+    async def browse_expiring(
+        self, until: datetime, after: tuple[datetime, int] | None = None, limit: int = 10
+    ) -> list[User]:
+        """Активные, у кого active_until до `until`, по сроку; keyset (active_until, user_id) по ix_users_expiry."""
+        stmt = (
+            select(User)
+            .where(*self._status_filter("expiring"), User.active_until > datetime.utcnow(), User.active_until <= until)
+            .order_by(User.active_until, User.user_id)
+            .limit(limit)
+        )
+        if after is not None:
+            last_until, last_id = after
+            stmt = stmt.where(or_(
+                User.active_until > last_until,
+                and_(User.active_until == last_until, User.user_id > last_id),
+            ))
+        res = await self.s.execute(stmt)
+        return list(res.scalars().all())
+
+    async def find_by_username(
+        self, prefix: str, after: tuple[str, int] | None = None, limit: int = 10
+    ) -> list[User]:
+        """
+        Префикс username без учёта регистра. Диапазон [prefix, prefix со
+        следующим последним символом) вместо LIKE — его берёт любой B-tree
+        индекс, здесь ix_users_username_lower.
+        """
+        prefix = prefix.lower()
+        name = func.lower(User.username)
+        stmt = (
+            select(User)
+            .where(
+                User.username.is_not(None),
+                name >= prefix,
+                name < prefix[:-1] + chr(ord(prefix[-1]) + 1),
+            )
+            .order_by(name, User.user_id)
+            .limit(limit)
+        )
+        if after is not None:
+            last_name, last_id = after
+            stmt = stmt.where(or_(name > last_name, and_(name == last_name, User.user_id > last_id)))
+        res = await self.s.execute(stmt)
+        return list(res.scalars().all())
+
+    # ✅ для reconciler
+    async def get_panel_state(
+        self, node_id: int, include_unassigned: bool = False
+    ) -> list[tuple[int, str, str | None, bool, datetime | None]]:
+        """(user_id, vpn_uuid, vpn_email, is_active, active_until) всех клиентов ноды — только нужные колонки."""
+        cond = User.node_id == node_id
+        if include_unassigned:
+            cond = or_(cond, User.node_id.is_(None))
+        res = await self.s.execute(
+            select(User.user_id, User.vpn_uuid, User.vpn_email, User.is_active, User.active_until)
+            .where(User.vpn_uuid.is_not(None), cond)
+        )
+        return [tuple(row) for row in res.all()]
+
+    async def get_without_vpn(self, user_ids: list[int]) -> dict[int, tuple[bool, datetime | None]]:
+        """user_id -> (is_active, active_until) тех из user_ids, что существуют и ещё без клиента в панели."""
+        found = {}
+        for i in range(0, len(user_ids), 500):
+            res = await self.s.execute(
+                select(User.user_id, User.is_active, User.active_until)
+                .where(User.user_id.in_(user_ids[i:i + 500]), User.vpn_uuid.is_(None))
+            )
+            found.update((uid, (is_active, until)) for uid, is_active, until in res.all())
+        return found
+
+    async def get_over_quota(self, quota: int, limit: int = 500) -> list[User]:
+        res = await self.s.execute(
+            select(User)
+            .where(User.is_active == True, User.vpn_uuid.is_not(None), User.traffic_used >= quota)
+            .order_by(User.user_id)
+            .limit(limit)
         )
         return list(res.scalars().all())
 
@@ -80,5 +452,320 @@ class DepositsRepo:
         res = await self.s.execute(select(DepositRequest).where(DepositRequest.id == dep_id))
         return res.scalar_one_or_none()
 
-    async def set_status(self, dep_id: int, status: str):
-        await self.s.execute(update(DepositRequest).where(DepositRequest.id == dep_id).values(status=status))
+    async def resolve(self, dep_ids: list[int], status: str) -> list:
+        """
+        Переводит pending-заявки в status одним UPDATE ... RETURNING на чанк.
+        Уже обработанные (в т.ч. параллельным нажатием) не попадают в результат.
+        Возвращает строки (id, user_id, amount).
+        """
+        resolved = []
+        for i in range(0, len(dep_ids), 500):
+            res = await self.s.execute(
+                update(DepositRequest)
+                .where(DepositRequest.id.in_(dep_ids[i:i + 500]), DepositRequest.status == "pending")
+                .values(status=status)
+                .returning(DepositRequest.id, DepositRequest.user_id, DepositRequest.amount)
+                .execution_options(synchronize_session=False)
+            )
+            resolved.extend(res.all())
+        return resolved
+
+    async def get_pending_page(self, after: tuple[datetime, int] | None = None, limit: int = 10) -> list[DepositRequest]:
+        """Keyset по (created_at, id) — страницы идут по ix_deposit_requests_pending без OFFSET."""
+        stmt = (
+            select(DepositRequest)
+            .where(DepositRequest.status == "pending")
+            .order_by(DepositRequest.created_at, DepositRequest.id)
+            .limit(limit)
+        )
+        if after is not None:
+            last_created, last_id = after
+            stmt = stmt.where(or_(
+                DepositRequest.created_at > last_created,
+                and_(DepositRequest.created_at == last_created, DepositRequest.id > last_id),
+            ))
+        res = await self.s.execute(stmt)
+        return list(res.scalars().all())
+
+    async def count_pending(self) -> int:
+        res = await self.s.execute(
+            select(func.count()).select_from(DepositRequest).where(DepositRequest.status == "pending")
+        )
+        return int(res.scalar() or 0)
+
+
+class NodesRepo:
+    def __init__(self, s: AsyncSession):
+        self.s = s
+
+    async def sync(self, node_ids: list[int], default_id: int):
+        """Заводит счётчики для новых нод, посчитав уже живущих на них клиентов (один раз)."""
+        res = await self.s.execute(select(Node.node_id))
+        known = set(res.scalars().all())
+        for node_id in node_ids:
+            if node_id in known:
+                continue
+            on_node = User.node_id == node_id
+            if node_id == default_id:
+                on_node = or_(on_node, User.node_id.is_(None))
+            res = await self.s.execute(
+                select(func.count()).select_from(User).where(User.vpn_uuid.is_not(None), on_node)
+            )
+            self.s.add(Node(node_id=node_id, client_count=res.scalar() or 0))
+        await self.s.flush()
+
+    async def pick_least_loaded(self, weights: dict[int, int]) -> int:
+        res = await self.s.execute(select(Node.node_id, Node.client_count).where(Node.node_id.in_(list(weights))))
+        counts = dict(res.all())
+        return min(weights, key=lambda node_id: (counts.get(node_id, 0) / weights[node_id], node_id))
+
+    async def add_clients(self, node_id: int, n: int):
+        await self.s.execute(
+            update(Node).where(Node.node_id == node_id).values(client_count=Node.client_count + n)
+        )
+
+
+class OutboxRepo:
+    def __init__(self, s: AsyncSession):
+        self.s = s
+        # были ли новые операции в этой сессии — после commit стоит разбудить воркер
+        self.added = False
+
+    async def enqueue(
+        self,
+        user_id: int,
+        node_id: int | None,
+        op: str,
+        vpn_uuid: str,
+        enable: bool,
+        expiry_ms: int,
+        vpn_email: str | None = None,
+    ):
+        key = f"{op}:{vpn_uuid}:{int(enable)}:{expiry_ms}"
+        res = await self.s.execute(select(PanelOp.id, PanelOp.status).where(PanelOp.idem_key == key))
+        existing = res.first()
+        # дубль — только операция, которая ещё ждёт отправки
+        if existing is not None and existing.status == "pending":
+            return
+        if op == "update":
+            # ещё не применённые операции по клиенту устарели: отложенный повтор
+            # старого состояния не должен перетереть новое
+            await self.s.execute(
+                update(PanelOp)
+                .where(PanelOp.vpn_uuid == vpn_uuid, PanelOp.op == "update", PanelOp.status.in_(("pending", "failed")))
+                .values(status="superseded")
+            )
+            # клиент ещё не создан — создастся сразу в нужном состоянии
+            await self.s.execute(
+                update(PanelOp)
+                .where(PanelOp.vpn_uuid == vpn_uuid, PanelOp.op == "add", PanelOp.status == "pending")
+                .values(enable=enable, expiry_ms=expiry_ms)
+            )
+        now = datetime.utcnow()
+        if existing is not None:
+            # то же состояние уже было (пауза -> возобновление с тем же сроком, исчерпанные
+            # попытки): idem_key уникален, поэтому в очередь заново встаёт старая строка
+            await self.s.execute(
+                update(PanelOp)
+                .where(PanelOp.id == existing.id)
+                .values(
+                    status="pending",
+                    user_id=user_id,
+                    node_id=node_id,
+                    vpn_email=vpn_email,
+                    attempts=0,
+                    next_attempt_at=now,
+                    last_error=None,
+                    created_at=now,
+                )
+            )
+            self.added = True
+            return
+        self.s.add(PanelOp(
+            idem_key=key,
+            user_id=user_id,
+            node_id=node_id,
+            op=op,
+            vpn_uuid=vpn_uuid,
+            vpn_email=vpn_email,
+            enable=enable,
+            expiry_ms=expiry_ms,
+            next_attempt_at=now,
+        ))
+        self.added = True
+
+    async def get_due(self, limit: int) -> list[PanelOp]:
+        res = await self.s.execute(
+            select(PanelOp)
+            .where(PanelOp.status == "pending", PanelOp.next_attempt_at <= datetime.utcnow())
+            .order_by(PanelOp.next_attempt_at, PanelOp.id)
+            .limit(limit)
+        )
+        return list(res.scalars().all())
+
+    async def pending_uuids(self) -> set[str]:
+        """Клиенты, по которым в панель ещё что-то едет: их состояние в панели пока не окончательное."""
+        res = await self.s.execute(select(PanelOp.vpn_uuid).where(PanelOp.status == "pending").distinct())
+        return set(res.scalars().all())
+
+    async def mark_done(self, ids: list[int]):
+        for i in range(0, len(ids), 500):
+            await self.s.execute(
+                update(PanelOp)
+                .where(PanelOp.id.in_(ids[i:i + 500]), PanelOp.status == "pending")
+                .values(status="done")
+            )
+
+    async def mark_failed(self, op_id: int, attempts: int, retry_at: datetime | None, error: str):
+        """retry_at=None — попытки кончились, операция остаётся в failed для разбора."""
+        await self.s.execute(
+            update(PanelOp)
+            # операцию могли заменить новой, пока она была в работе
+            .where(PanelOp.id == op_id, PanelOp.status == "pending")
+            .values(
+                attempts=attempts,
+                status="pending" if retry_at else "failed",
+                next_attempt_at=retry_at or datetime.utcnow(),
+                last_error=error[:255],
+            )
+        )
+
+    async def prune_done(self, before: datetime):
+        await self.s.execute(delete(PanelOp).where(PanelOp.status.in_(("done", "superseded")), PanelOp.created_at < before))
+
+
+class TrafficRepo:
+    def __init__(self, s: AsyncSession):
+        self.s = s
+
+    async def add_usage(self, rows: list[tuple[int, int]], bucket: datetime):
+        """rows: (user_id, прирост). Прирост прибавляется к часу `bucket` одним upsert на пакет."""
+        if not rows:
+            return
+        stmt = _insert(self.s, TrafficUsage.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "bucket"],
+            set_={"bytes": TrafficUsage.__table__.c.bytes + stmt.excluded.bytes},
+        )
+        await self.s.execute(stmt, [{"user_id": uid, "bucket": bucket, "bytes": delta} for uid, delta in rows])
+
+    async def prune(self, before: datetime):
+        await self.s.execute(delete(TrafficUsage).where(TrafficUsage.bucket < before))
+
+
+class StatsRepo:
+    COUNTERS = ("signups", "deposits", "deposits_amount", "activations", "revenue", "expirations", "active_delta")
+
+    def __init__(self, s: AsyncSession):
+        self.s = s
+
+    async def bump(self, day: date | None = None, **deltas):
+        """Прибавляет deltas к строке дня одним upsert; коммитит вызывающий — вместе с событием."""
+        deltas = {k: v for k, v in deltas.items() if v}
+        if not deltas:
+            return
+        t = DailyStats.__table__
+        stmt = _insert(self.s, t).values(day=day or datetime.utcnow().date(), **deltas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["day"],
+            set_={k: t.c[k] + stmt.excluded[k] for k in deltas},
+        )
+        await self.s.execute(stmt)
+
+    async def get_since(self, since: date) -> list[DailyStats]:
+        res = await self.s.execute(select(DailyStats).where(DailyStats.day >= since).order_by(DailyStats.day))
+        return list(res.scalars().all())
+
+    async def active_total(self) -> int:
+        # по строке на день — тысячи строк за годы, размер users не важен
+        res = await self.s.execute(select(func.coalesce(func.sum(DailyStats.active_delta), 0)))
+        return int(res.scalar() or 0)
+
+
+class BroadcastsRepo:
+    RUNNING, DONE, CANCELLED = "running", "done", "cancelled"
+
+    def __init__(self, s: AsyncSession):
+        self.s = s
+
+    async def create(self, text: str, total: int) -> Broadcast:
+        b = Broadcast(text=text, total=total, status=self.RUNNING)
+        self.s.add(b)
+        await self.s.flush()
+        return b
+
+    async def get(self, broadcast_id: int) -> Broadcast | None:
+        return await self.s.get(Broadcast, broadcast_id, populate_existing=True)
+
+    async def get_running(self) -> Broadcast | None:
+        res = await self.s.execute(
+            select(Broadcast).where(Broadcast.status == self.RUNNING).order_by(Broadcast.id).limit(1)
+        )
+        return res.scalar_one_or_none()
+
+    async def get_latest(self) -> Broadcast | None:
+        res = await self.s.execute(select(Broadcast).order_by(Broadcast.id.desc()).limit(1))
+        return res.scalar_one_or_none()
+
+    async def advance(self, broadcast_id: int, cursor: int, sent: int, failed: int, blocked: int):
+        """Курсор и счётчики пачки — одним UPDATE; статус не трогает, чтобы не затереть отмену."""
+        await self.s.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id)
+            .values(
+                cursor=cursor,
+                sent=Broadcast.sent + sent,
+                failed=Broadcast.failed + failed,
+                blocked=Broadcast.blocked + blocked,
+            )
+        )
+
+    async def finish(self, broadcast_id: int, status: str) -> bool:
+        """running -> status; False — рассылка уже завершена или отменена."""
+        res = await self.s.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.status == self.RUNNING)
+            .values(status=status, finished_at=datetime.utcnow())
+        )
+        return res.rowcount == 1
+
+
+class LeasesRepo:
+    def __init__(self, s: AsyncSession):
+        self.s = s
+
+    async def try_acquire(self, name: str, holder: str, ttl: timedelta) -> bool:
+        """
+        Берёт или продлевает аренду одним условным UPDATE: свою — всегда,
+        чужую — только протухшую. Первую аренду создаёт INSERT; проигравший
+        гонку получает IntegrityError. Коммитит сам.
+        """
+        now = datetime.utcnow()
+        res = await self.s.execute(
+            update(Lease)
+            .where(Lease.name == name, or_(Lease.holder == holder, Lease.expires_at < now))
+            .values(holder=holder, expires_at=now + ttl)
+        )
+        if res.rowcount == 1:
+            await self.s.commit()
+            return True
+        res = await self.s.execute(select(Lease.name).where(Lease.name == name))
+        if res.first() is not None:
+            await self.s.rollback()
+            return False
+        self.s.add(Lease(name=name, holder=holder, expires_at=now + ttl))
+        try:
+            await self.s.commit()
+        except IntegrityError:
+            await self.s.rollback()
+            return False
+        return True
+
+    async def release(self, name: str, holder: str):
+        await self.s.execute(
+            update(Lease)
+            .where(Lease.name == name, Lease.holder == holder)
+            .values(expires_at=datetime.utcnow())
+        )
+        await self.s.commit()
+
@@ -0,0 +1,74 @@
+# app/scheduler.py
+from __future__ import annotations
+
+import asyncio
+import heapq
+from datetime import datetime
+
+
+class ExpiryScheduler:
+    """
+    In-memory min-heap ближайших дедлайнов active_until.
+
+    Куча — только подсказка "когда проснуться": при срабатывании expire worker
+    всё равно перепроверяет пользователей в БД. Поэтому устаревшие записи
+    (продлили, поставили на паузу, транзакция откатилась) безопасны — они
+    просто дают пустую выборку, и отмена записей не нужна.
+
+    В памяти держится окно из `window` ближайших дедлайнов; всё, что позже
+    горизонта окна, догружается из БД, когда окно опустеет.
+    """
+
+    def __init__(self, window: int = 1000, max_sleep: float = 600):
+        self.window = window
+        self.max_sleep = max_sleep
+        self._heap: list[tuple[datetime, int]] = []
+        # None — в куче лежат все дедлайны из БД, иначе только те, что <= horizon
+        self._horizon: datetime | None = None
+        self._wake = asyncio.Event()
+
+    def schedule(self, user_id: int, until: datetime | None):
+        if until is None:
+            return
+        if self._horizon is not None and until > self._horizon:
+            # подхватится при следующей догрузке окна
+            return
+        heapq.heappush(self._heap, (until, user_id))
+        if self._heap[0] == (until, user_id):
+            self._wake.set()
+
+    def load(self, rows: list[tuple[int, datetime]]):
+        """Подмешивает в кучу окно ближайших дедлайнов, прочитанное из БД."""
+        full = len(rows) >= self.window
+        self._horizon = rows[-1][1] if full else None
+        # записи из памяти сохраняем: они могли появиться в ещё не закоммиченных транзакциях
+        merged = [(until, uid) for until, uid in self._heap if not full or until <= self._horizon]
+        merged.extend((until, uid) for uid, until in rows)
+        heapq.heapify(merged)
+        self._heap = merged
+
+    @property
+    def needs_reload(self) -> bool:
+        return not self._heap and self._horizon is not None
+
+    def pop_due(self, now: datetime) -> list[int]:
+        due = set()
+        while self._heap and self._heap[0][0] <= now:
+            due.add(heapq.heappop(self._heap)[1])
+        return sorted(due)
+
+    async def wait(self, now: datetime) -> bool:
+        """
+        Спит до ближайшего дедлайна или до schedule() с более ранним сроком.
+        Возвращает True, если проспали max_sleep без единого события —
+        тогда стоит перечитать окно из БД (изменения из других процессов).
+        """
+        timeout = self.max_sleep
+        if self._heap:
+            timeout = min(timeout, max(0.0, (self._heap[0][0] - now).total_seconds()))
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+            return False
+        except asyncio.TimeoutError:
+            return timeout >= self.max_sleep
@@ -0,0 +1,147 @@
+# app/sender.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramNotFound, TelegramRetryAfter, TelegramBadRequest
+
+logger = logging.getLogger(__name__)
+
+# итог доставки (send_status)
+SENT = "sent"
+# бот заблокирован или чат удалён
+BLOCKED = "blocked"
+# Telegram отклонил само сообщение
+REJECTED = "rejected"
+# не ушло после повторов
+FAILED = "failed"
+
+
+class TokenBucket:
+    """Асинхронный token bucket: acquire() ждёт, пока не наберётся токен."""
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Sender:
+    """
+    Общая очередь исходящих сообщений бота (рассылки, напоминания).
+
+    Держит лимиты Telegram: не больше `rate` сообщений в секунду на бота и
+    не чаще одного сообщения в `per_chat_interval` секунд в один чат.
+    На RetryAfter все воркеры притормаживают на указанное время.
+    """
+
+    def __init__(self, bot: Bot, rate: float = 25, per_chat_interval: float = 1.0, workers: int = 8, max_queue: int = 1000):
+        self.bot = bot
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self._bucket = TokenBucket(rate)
+        self._queue: asyncio.Queue = asyncio.Queue(max_queue)
+        # chat_id -> когда в него можно писать следующий раз
+        self._next_in_chat: dict[int, float] = {}
+        self._paused_until = 0.0
+        self._tasks: list[asyncio.Task] = []
+        # post_many без ожидания: держим ссылки, чтобы задачи не собрал GC
+        self._posted: set[asyncio.Task] = set()
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> bool:
+        """
+        Ставит сообщение в очередь и ждёт отправки. False — чат недоступен
+        (бот заблокирован, чат удалён), Telegram отклонил сообщение или
+        отправка не удалась после повторов.
+        """
+        return await self.send_status(chat_id, text, **kwargs) == SENT
+
+    async def send_status(self, chat_id: int, text: str, **kwargs) -> str:
+        """Как send, но с причиной: SENT, BLOCKED (писать больше не стоит), REJECTED или FAILED."""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((chat_id, text, kwargs, fut))
+        return await fut
+
+    async def send_many(self, messages: list[tuple[int, str]], **kwargs) -> list[bool]:
+        return list(await asyncio.gather(*(self.send(chat_id, text, **kwargs) for chat_id, text in messages)))
+
+    def post_many(self, messages: list[tuple[int, str]], **kwargs):
+        """Как send_many, но без ожидания доставки — для уведомлений из хендлеров после commit."""
+        if not messages:
+            return
+        task = asyncio.create_task(self.send_many(messages, **kwargs))
+        self._posted.add(task)
+        task.add_done_callback(self._posted.discard)
+
+    async def close(self):
+        for t in self._posted:
+            t.cancel()
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            chat_id, text, kwargs, fut = await self._queue.get()
+            if fut.cancelled():
+                # ждавшего отменили (рассылку прервали) — её пачку потом отправят заново
+                self._queue.task_done()
+                continue
+            try:
+                status = await self._deliver(chat_id, text, kwargs)
+                if not fut.done():
+                    fut.set_result(status)
+            except Exception as e:
+                logger.error(f"Failed to send to {chat_id}: {e}")
+                if not fut.done():
+                    fut.set_result(FAILED)
+            finally:
+                self._queue.task_done()
+
+    async def _wait_chat(self, chat_id: int):
+        now = time.monotonic()
+        next_at = self._next_in_chat.get(chat_id, 0.0)
+        self._next_in_chat[chat_id] = max(now, next_at) + self.per_chat_interval
+        if next_at > now:
+            await asyncio.sleep(next_at - now)
+        if len(self._next_in_chat) > 10_000:
+            self._next_in_chat = {c: t for c, t in self._next_in_chat.items() if t > now}
+
+    async def _deliver(self, chat_id: int, text: str, kwargs: dict) -> str:
+        await self._wait_chat(chat_id)
+        for _ in range(5):
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self._bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                return SENT
+            except TelegramRetryAfter as e:
+                logger.warning(f"Telegram flood limit, pausing sends for {e.retry_after}s")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            except (TelegramForbiddenError, TelegramNotFound):
+                return BLOCKED
+            except TelegramBadRequest as e:
+                logger.warning(f"Cannot send to {chat_id}: {e.message}")
+                return REJECTED
+        return FAILED
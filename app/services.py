@@ -1,20 +1,27 @@
 from datetime import datetime, timedelta
 import uuid
 
-from .repo import UsersRepo, DepositsRepo
-from .xui import XuiPanel
-from .config import XuiConfig
+from .models import User
+from .nodes import NodeRegistry
+from .repo import UsersRepo, DepositsRepo, NodesRepo, OutboxRepo, StatsRepo
 from .utils.vless import build_vless_link
 
 
 class SubscriptionService:
-    def __init__(self, users: UsersRepo, xui: XuiPanel, xui_config: XuiConfig | None = None):
-        self.users = users
-        self.xui = xui
-        self.xui_config = xui_config
+    """
+    Живёт всё время процесса (см. container.py): репозитории, привязанные
+    к сессии БД конкретного апдейта, передаются в каждый вызов.
+    """
 
-    async def can_use(self, user_id: int) -> tuple[bool, str]:
-        u = await self.users.get(user_id)
+    def __init__(self, registry: NodeRegistry):
+        self.registry = registry
+
+    def vless_link(self, u: User) -> str:
+        # ключ строится по reality-параметрам той ноды, где живёт клиент
+        return build_vless_link(vpn_uuid=u.vpn_uuid, email=u.vpn_email, cfg=self.registry.get(u.node_id).config)
+
+    async def can_use(self, users: UsersRepo, user_id: int) -> tuple[bool, str]:
+        u = await users.get(user_id)
         if not u:
             return False, "no_user"
         if u.is_banned:
@@ -27,24 +34,42 @@ class SubscriptionService:
             return False, "expired"
         return True, "ok"
 
-    async def activate(self, tg_id: int, days: int = 30, settings=None):
-        u = await self.users.get(tg_id)
+    async def activate(
+        self,
+        users: UsersRepo,
+        nodes: NodesRepo,
+        outbox: OutboxRepo,
+        tg_id: int,
+        days: int = 30,
+        settings=None,
+        stats: StatsRepo | None = None,
+    ):
+        """
+        Меняет только БД: операция с панелью пишется в outbox в той же
+        транзакции и применяется outbox_worker'ом после commit.
+        """
+        u = await users.get(tg_id)
         if not u:
             return
 
+        required_balance = 0.0
         # Check balance if settings provided
         if settings:
             required_balance = (settings.monthly_price_rub / 30) * days
-            if u.balance < required_balance:
+            # проверка и списание одним условным UPDATE: два параллельных запроса не уйдут в минус
+            if not await users.try_debit(tg_id, required_balance):
+                u = await users.get(tg_id)
                 raise RuntimeError(f"Insufficient balance. Required: {required_balance:.2f}, Available: {u.balance:.2f}")
-            # Deduct balance
-            await self.users.add_balance(tg_id, -required_balance)
 
         # всегда делаем пользователя активным и продлеваем
-        await self.users.set_active(tg_id, True)
-        await self.users.extend_until(tg_id, days)
-
-        u = await self.users.get(tg_id)
+        became_active = await users.set_active(tg_id, True)
+        await users.extend_until(tg_id, days)
+        # оплачен новый период — лимит трафика снова полный
+        await users.reset_traffic(tg_id)
+        if stats is not None:
+            await stats.bump(activations=1, revenue=required_balance, active_delta=int(became_active))
+
+        u = await users.get(tg_id)
         expires = u.active_until or (datetime.utcnow() + timedelta(days=days))
         expiry_ms = int(expires.timestamp() * 1000)
 
@@ -53,74 +78,87 @@ class SubscriptionService:
             vpn_uuid = str(uuid.uuid4())
             email = f"tg_{tg_id}"
 
-            client = {
-                "id": vpn_uuid,
-                "email": email,
-                "flow": "xtls-rprx-vision",
-                "limitIp": 1,
-                "totalGB": 0,
-                "expiryTime": expiry_ms,
-                "enable": True,
-            }
-
-            # логинимся и добавляем
-            if not self.xui.login():
-                raise RuntimeError("xui login failed - check XUI credentials and connection")
-
-            inbound_id = self.xui_config.inbound_id if self.xui_config else 2
-            ok = self.xui.add_client(inbound_id, client)
-            if not ok:
-                raise RuntimeError(f"xui add_client failed - check XUI panel logs for inbound_id={inbound_id}")
-
-            await self.users.set_vpn(tg_id, vpn_uuid, email)
+            # новый клиент — на наименее загруженную ноду
+            node_id = await nodes.pick_least_loaded(self.registry.weights())
+            if await users.set_vpn_if_missing(tg_id, vpn_uuid, email, node_id):
+                await nodes.add_clients(node_id, 1)
+                await outbox.enqueue(tg_id, node_id, "add", vpn_uuid, True, expiry_ms, vpn_email=email)
+            else:
+                # клиента успел создать параллельный запрос — только продлеваем его
+                u = await users.get(tg_id)
+                await outbox.enqueue(tg_id, u.node_id, "update", u.vpn_uuid, True, expiry_ms)
 
         else:
             # если uuid уже есть — просто обновим expiry и включение
-            if not self.xui.login():
-                raise RuntimeError("xui login failed - check XUI credentials and connection")
-
-            inbound_id = self.xui_config.inbound_id if self.xui_config else 2
-            ok = self.xui.update_client(inbound_id, u.vpn_uuid, True, expiry_ms)
-            if not ok:
-                raise RuntimeError(f"xui update_client failed - check XUI panel logs for uuid={u.vpn_uuid}")
-
-    async def pause(self, tg_id: int):
-        u = await self.users.get(tg_id)
-        if not u or not u.vpn_uuid:
-            await self.users.set_active(tg_id, False)
+            await outbox.enqueue(tg_id, u.node_id, "update", u.vpn_uuid, True, expiry_ms)
+
+    async def extend(self, users: UsersRepo, outbox: OutboxRepo, tg_id: int, days: int):
+        """Продление админом без списания; клиенту в панели уходит новый expiryTime."""
+        await users.extend_until(tg_id, days)
+        u = await users.get(tg_id)
+        if u and u.vpn_uuid:
+            enable = bool(u.is_active and u.active_until and u.active_until > datetime.utcnow())
+            expiry_ms = int(u.active_until.timestamp() * 1000) if u.active_until else 0
+            await outbox.enqueue(tg_id, u.node_id, "update", u.vpn_uuid, enable, expiry_ms)
+
+    async def pause(self, users: UsersRepo, outbox: OutboxRepo, tg_id: int, stats: StatsRepo | None = None):
+        u = await users.get(tg_id)
+        if u and u.vpn_uuid:
+            expiry_ms = int((u.active_until.timestamp() * 1000)) if u.active_until else 0
+            await outbox.enqueue(tg_id, u.node_id, "update", u.vpn_uuid, False, expiry_ms)
+        if await users.set_active(tg_id, False) and stats is not None:
+            await stats.bump(active_delta=-1)
+
+    async def set_ban(
+        self, users: UsersRepo, outbox: OutboxRepo, tg_id: int, banned: bool, stats: StatsRepo | None = None
+    ):
+        """
+        Бан выключает клиента в панели и подписку в той же транзакции; разбан
+        возвращает их, если оплаченный период ещё идёт.
+        """
+        await users.set_ban(tg_id, banned)
+        if banned:
+            await self.pause(users, outbox, tg_id, stats)
             return
-
-        if not self.xui.login():
-            raise RuntimeError("xui login failed - check XUI credentials and connection")
-
-        expiry_ms = int((u.active_until.timestamp() * 1000)) if u.active_until else 0
-        inbound_id = self.xui_config.inbound_id if self.xui_config else 2
-        ok = self.xui.update_client(inbound_id, u.vpn_uuid, False, expiry_ms)
-        if not ok:
-            raise RuntimeError(f"xui update_client failed - check XUI panel logs for uuid={u.vpn_uuid}")
-        await self.users.set_active(tg_id, False)
+        u = await users.get(tg_id)
+        if not (u and u.active_until and u.active_until > datetime.utcnow()):
+            return
+        if await users.set_active(tg_id, True) and stats is not None:
+            await stats.bump(active_delta=1)
+        if u.vpn_uuid:
+            expiry_ms = int(u.active_until.timestamp() * 1000)
+            await outbox.enqueue(tg_id, u.node_id, "update", u.vpn_uuid, True, expiry_ms)
 
 
 class PaymentService:
-    def __init__(self, users: UsersRepo, deposits: DepositsRepo):
-        self.users = users
-        self.deposits = deposits
-
-    async def create_deposit(self, user_id: int, amount: float) -> int:
-        dr = await self.deposits.create(user_id, amount)
+    async def create_deposit(self, deposits: DepositsRepo, user_id: int, amount: float) -> int:
+        dr = await deposits.create(user_id, amount)
         return dr.id
 
-    async def approve(self, dep_id: int):
-        dr = await self.deposits.get(dep_id)
-        if not dr or dr.status != "pending":
-            return None
-        await self.deposits.set_status(dep_id, "approved")
-        await self.users.add_balance(dr.user_id, dr.amount)
-        return dr
-
-    async def reject(self, dep_id: int):
-        dr = await self.deposits.get(dep_id)
-        if not dr or dr.status != "pending":
-            return None
-        await self.deposits.set_status(dep_id, "rejected")
-        return dr
\ No newline at end of file
+    async def approve(self, users: UsersRepo, deposits: DepositsRepo, dep_id: int, stats: StatsRepo | None = None):
+        resolved = await self.approve_many(users, deposits, [dep_id], stats)
+        return resolved[0] if resolved else None
+
+    async def reject(self, deposits: DepositsRepo, dep_id: int):
+        resolved = await self.reject_many(deposits, [dep_id])
+        return resolved[0] if resolved else None
+
+    async def approve_many(
+        self, users: UsersRepo, deposits: DepositsRepo, dep_ids: list[int], stats: StatsRepo | None = None
+    ) -> list:
+        """
+        Одобряет ещё не обработанные заявки из dep_ids: смена статуса и
+        пополнение балансов — set-based, в транзакции вызывающего.
+        Возвращает одобренные строки (id, user_id, amount).
+        """
+        resolved = await deposits.resolve(dep_ids, "approved")
+        amounts: dict[int, float] = {}
+        for dr in resolved:
+            amounts[dr.user_id] = amounts.get(dr.user_id, 0) + dr.amount
+        await users.add_balance_many(amounts)
+        if stats is not None:
+            await stats.bump(deposits=len(resolved), deposits_amount=sum(amounts.values()))
+        return resolved
+
+    async def reject_many(self, deposits: DepositsRepo, dep_ids: list[int]) -> list:
+        return await deposits.resolve(dep_ids, "rejected")
\ No newline at end of file
@@ -0,0 +1,101 @@
+# app/supervisor.py
+import asyncio
+import logging
+import os
+import signal
+import sys
+
+from aiogram import Bot, Dispatcher
+
+from .config import Settings, load_nodes
+from .db import Db
+from .handlers import router
+from .migrations import apply_migrations
+from .models import Base
+from .nodes import NodeRegistry
+from .repo import NodesRepo
+from .webhook import register_webhook
+
+logger = logging.getLogger(__name__)
+
+RESTART_DELAY = 5
+STOP_TIMEOUT = 20
+
+
+async def _prepare(settings: Settings):
+    """Схема, счётчики нод и setWebhook — один раз до старта воркеров, а не в каждом из них."""
+    db = Db(settings.db_dsn)
+    registry = NodeRegistry(load_nodes())
+    try:
+        if settings.db_dsn.startswith("sqlite"):
+            await db.init_sqlite_pragmas()
+        async with db.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await apply_migrations(db)
+        async with db.sessionmaker() as s:
+            await NodesRepo(s).sync([n.node_id for n in registry.all()], registry.default_id)
+            await s.commit()
+    finally:
+        await registry.close()
+        await db.dispose()
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot(token=settings.bot_token)
+    try:
+        await register_webhook(bot, dp, settings)
+    finally:
+        await bot.session.close()
+
+
+async def _watch(index: int, procs: dict[int, asyncio.subprocess.Process]):
+    env = dict(os.environ, BOT_WORKER_INDEX=str(index))
+    while True:
+        proc = procs[index] = await asyncio.create_subprocess_exec(sys.executable, "-m", "app.main", env=env)
+        logger.info(f"Worker {index} started, pid={proc.pid}")
+        code = await proc.wait()
+        logger.warning(f"Worker {index} exited with code {code}, restarting in {RESTART_DELAY}s")
+        await asyncio.sleep(RESTART_DELAY)
+
+
+async def _stop(procs: dict[int, asyncio.subprocess.Process]):
+    alive = [p for p in procs.values() if p.returncode is None]
+    for p in alive:
+        p.terminate()
+    try:
+        await asyncio.wait_for(asyncio.gather(*(p.wait() for p in alive)), STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        for p in alive:
+            if p.returncode is None:
+                p.kill()
+
+
+async def run_supervisor(settings: Settings):
+    """
+    BOT_WORKERS=N: N процессов `python -m app.main` с общим webhook-портом
+    (SO_REUSEPORT). Упавший воркер перезапускается. Фоновые задачи
+    (истечение, outbox, напоминания) в воркерах защищены арендой в БД
+    и идут только в одном из них.
+    """
+    if settings.bot_mode != "webhook":
+        # getUpdates нельзя вызывать из нескольких процессов одновременно
+        raise RuntimeError("BOT_WORKERS > 1 requires BOT_MODE=webhook")
+
+    await _prepare(settings)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    procs: dict[int, asyncio.subprocess.Process] = {}
+    logger.info(f"Supervisor starting {settings.workers} workers")
+    watchers = [asyncio.create_task(_watch(i, procs)) for i in range(settings.workers)]
+    try:
+        await stop.wait()
+        logger.info("Supervisor stopping workers")
+    finally:
+        for w in watchers:
+            w.cancel()
+        await asyncio.gather(*watchers, return_exceptions=True)
+        await _stop(procs)
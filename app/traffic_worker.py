@@ -0,0 +1,134 @@
+# app/traffic_worker.py
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from .cache import UserCache
+from .db import Db
+from .expire_worker import disable_clients, reenable_clients
+from .models import User
+from .nodes import NodeRegistry, PanelNode
+from .repo import UsersRepo, TrafficRepo, StatsRepo
+from .sender import Sender
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 300
+PANEL_TIMEOUT = 60
+QUOTA_BATCH = 500
+KEEP_USAGE = timedelta(days=90)
+PRUNE_INTERVAL = timedelta(hours=1)
+
+QUOTA_TEXT = (
+    "📶 Трафик за оплаченный период исчерпан, VPN приостановлен.\n"
+    "Пополните баланс и нажмите «Активировать», чтобы начать новый период."
+)
+
+
+def _hour(t: datetime) -> datetime:
+    return t.replace(minute=0, second=0, microsecond=0)
+
+
+async def ingest_node(
+    db: Db, registry: NodeRegistry, node: PanelNode, bucket: datetime, cache: UserCache | None = None
+) -> int:
+    """
+    Один inbounds/get на ноду: счётчики всех клиентов сравниваются с
+    traffic_seen, приросты пишутся пакетом в users и в час `bucket`
+    таблицы traffic_usage. Возвращает число клиентов с изменившимся счётчиком.
+    """
+    counters = await node.xui.get_client_traffic(node.inbound_id, timeout=PANEL_TIMEOUT)
+    if counters is None:
+        logger.error(f"Traffic: node {node.node_id} is unavailable, skipping")
+        return 0
+
+    async with db.sessionmaker() as s:
+        users = UsersRepo(s, cache=cache)
+        known = await users.get_traffic_counters(node.node_id, include_unassigned=node.node_id == registry.default_id)
+        rows = []
+        for email, (user_id, seen) in known.items():
+            raw = counters.get(email)
+            if raw is None or raw == seen:
+                continue
+            # счётчик в панели сбросили — всё, что в нём сейчас, набежало после сброса
+            rows.append((user_id, raw, raw - seen if raw > seen else raw))
+        if not rows:
+            return 0
+        await users.add_traffic(rows)
+        await TrafficRepo(s).add_usage([(user_id, delta) for user_id, _, delta in rows if delta > 0], bucket)
+        await s.commit()
+        users.invalidate_dirty()
+    return len(rows)
+
+
+async def enforce_quota(
+    db: Db, registry: NodeRegistry, quota: int, cache: UserCache | None = None, sender: Sender | None = None
+) -> int:
+    """Выключает превысивших квоту пачками по QUOTA_BATCH; возвращает, сколько выключено."""
+    disabled = 0
+    while True:
+        deactivated = []
+        async with db.sessionmaker() as s:
+            users = UsersRepo(s, cache=cache)
+            over = await users.get_over_quota(quota, QUOTA_BATCH)
+            if not over:
+                return disabled
+
+            done, failed = await disable_clients(registry, over)
+            if done:
+                # пока ходили в панель, пользователь мог оплатить новый период
+                deactivated = await users.deactivate_many(done, User.traffic_used >= quota)
+                kept = set(done) - set(deactivated)
+                await reenable_clients(s, [u for u in over if u.user_id in kept])
+                await StatsRepo(s).bump(active_delta=-len(deactivated))
+                await s.commit()
+                users.invalidate_dirty()
+
+        # соединение с БД уже отдано — в Telegram шлём вне сессии
+        if deactivated:
+            disabled += len(deactivated)
+            logger.info(f"Disabled {len(deactivated)} over-quota subscriptions")
+            if sender is not None:
+                await sender.send_many([(user_id, QUOTA_TEXT) for user_id in deactivated])
+        if failed:
+                # остальных — на следующем опросе, а не по кругу сейчас
+                logger.error(f"Failed to disable {len(failed)} over-quota clients")
+                return disabled
+
+
+async def run_traffic_worker(
+    db: Db,
+    registry: NodeRegistry,
+    quota: int = 0,
+    cache: UserCache | None = None,
+    sender: Sender | None = None,
+    interval: float = POLL_INTERVAL,
+):
+    """
+    Раз в interval снимает счётчики трафика: по одному запросу к панели на
+    ноду, сколько бы ни было клиентов. quota — лимит на период в байтах, 0 — без лимита.
+    """
+    pruned_at = None
+    while True:
+        try:
+            now = datetime.utcnow()
+            changed = 0
+            for node in registry.all():
+                try:
+                    changed += await ingest_node(db, registry, node, _hour(now), cache)
+                except Exception as e:
+                    logger.error(f"Traffic: error ingesting node {node.node_id}: {e}")
+            if changed:
+                logger.info(f"Traffic: {changed} clients updated")
+
+            if quota > 0:
+                await enforce_quota(db, registry, quota, cache, sender)
+
+            if pruned_at is None or now - pruned_at >= PRUNE_INTERVAL:
+                async with db.sessionmaker() as s:
+                    await TrafficRepo(s).prune(now - KEEP_USAGE)
+                    await s.commit()
+                pruned_at = now
+        except Exception as e:
+            logger.error(f"Error in traffic_worker: {e}")
+        await asyncio.sleep(interval)
@@ -1,69 +1,95 @@
 # app/ui.py
 from __future__ import annotations
 
+from collections import OrderedDict
 from datetime import datetime
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import InlineKeyboardMarkup
 
 from .repo import UsersRepo
 from .keyboards import main_kb, profile_kb
 
+# ответы Telegram, означающие, что menu message больше нет и его надо создать заново
+_MESSAGE_MISSING = (
+    "message to edit not found",
+    "message can't be edited",
+    "message_id_invalid",
+    "message not found",
+)
+
 
 class UiService:
-    def __init__(self, bot: Bot, users: UsersRepo):
+    def __init__(self, bot: Bot, max_cached_menus: int = 50_000, traffic_quota: int = 0):
         self.bot = bot
-        self.users = users
+        # лимит трафика на период, байты; 0 — без лимита
+        self.traffic_quota = traffic_quota
+        # user_id -> (menu message_id, хэш последнего отрисованного экрана), LRU
+        self.max_cached_menus = max_cached_menus
+        self._menus: OrderedDict[int, tuple[int, int]] = OrderedDict()
 
-    async def reset_menu(self, user_id: int, chat_id: int):
+    async def reset_menu(self, users: UsersRepo, user_id: int, chat_id: int):
         """
         Всегда создаёт новое меню-сообщение (для /start).
         """
-        await self.users.set_menu_message_id(user_id, None)
-        msg = await self.bot.send_message(chat_id=chat_id, text="⚡️ Меню:")
-        await self.users.set_menu_message_id(user_id, msg.message_id)
+        self._menus.pop(user_id, None)
+        await users.set_menu_message_id(user_id, None)
         # сразу покажем главное меню
-        await self.show_main_menu(user_id, chat_id)
+        await self.show_main_menu(users, user_id, chat_id)
 
-    async def ensure_menu_message(self, user_id: int, chat_id: int) -> int:
+    async def render(
+        self,
+        users: UsersRepo,
+        user_id: int,
+        chat_id: int,
+        text: str,
+        reply_markup: InlineKeyboardMarkup | None = None,
+    ):
         """
-        Гарантирует существование живого menu message.
-        Если старое удалили (chat очистили) — создаёт новое автоматически.
+        Редактирует menu message сразу, без тестового редактирования.
+        Новое сообщение создаётся только если Telegram ответил, что старого нет
+        (chat очистили). Повторный рендер того же экрана — no-op.
         """
-        msg_id = await self.users.get_menu_message_id(user_id)
+        parse_mode = "HTML" if "<code>" in text else None
+        digest = hash((text, parse_mode, reply_markup.model_dump_json() if reply_markup else None))
+
+        cached = self._menus.get(user_id)
+        if cached is not None:
+            self._menus.move_to_end(user_id)
+            msg_id, last_digest = cached
+        else:
+            msg_id, last_digest = await users.get_menu_message_id(user_id), None
+
         if msg_id:
+            if last_digest == digest:
+                return
             try:
-                # тест-редактирование (если сообщение удалено — будет исключение)
                 await self.bot.edit_message_text(
                     chat_id=chat_id,
                     message_id=msg_id,
-                    text="⚡️ Меню (обновление)...",
+                    text=text,
+                    reply_markup=reply_markup,
+                    parse_mode=parse_mode,
                 )
-                return msg_id
-            except Exception:
-                # сообщение удалили/чат очистили → сбрасываем и создаём новое
-                await self.users.set_menu_message_id(user_id, None)
-                msg_id = None
+                self._remember(user_id, msg_id, digest)
+                return
+            except TelegramBadRequest as e:
+                err = e.message.lower()
+                if "message is not modified" in err:
+                    self._remember(user_id, msg_id, digest)
+                    return
+                if not any(m in err for m in _MESSAGE_MISSING):
+                    raise
 
-        msg = await self.bot.send_message(chat_id=chat_id, text="⚡️ Меню:")
-        await self.users.set_menu_message_id(user_id, msg.message_id)
-        return msg.message_id
+        msg = await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+        await users.set_menu_message_id(user_id, msg.message_id)
+        self._remember(user_id, msg.message_id, digest)
 
-    async def render(
-        self,
-        user_id: int,
-        chat_id: int,
-        text: str,
-        reply_markup: InlineKeyboardMarkup | None = None,
-    ):
-        msg_id = await self.ensure_menu_message(user_id, chat_id)
-        parse_mode = "HTML" if "<code>" in text else None
-        await self.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=msg_id,
-            text=text,
-            reply_markup=reply_markup,
-            parse_mode=parse_mode,
-        )
+    def _remember(self, user_id: int, msg_id: int, digest: int):
+        self._menus[user_id] = (msg_id, digest)
+        self._menus.move_to_end(user_id)
+        while len(self._menus) > self.max_cached_menus:
+            self._menus.popitem(last=False)
 
     # async def show_main_menu(self, user_id: int, chat_id: int):
     #     u = await self.users.get(user_id)
@@ -74,8 +100,8 @@ class UiService:
     #     ])
     #
     #     await self.render(user_id, chat_id, text, main_kb())
-    async def show_main_menu(self, user_id: int, chat_id: int):
-        u = await self.users.get(user_id)
+    async def show_main_menu(self, users: UsersRepo, user_id: int, chat_id: int):
+        u = await users.get(user_id)
 
         text = "\n".join([
             "⚡️ <b>FLASH VPN | PREMIUM NETWORK</b>",
@@ -92,10 +118,10 @@ class UiService:
             f"⚙️ <b>User ID:</b> <code>{u.user_id}</code>",
         ])
 
-        await self.render(user_id, chat_id, text, main_kb())
+        await self.render(users, user_id, chat_id, text, main_kb())
 
-    async def show_profile(self, user_id: int, chat_id: int):
-        u = await self.users.get(user_id)
+    async def show_profile(self, users: UsersRepo, user_id: int, chat_id: int):
+        u = await users.get(user_id)
         if not u:
             return
 
@@ -107,9 +133,16 @@ class UiService:
             f"💳 Balance: <code>{round(u.balance, 2)}</code>\n"
             f"📌 Status: {st}\n"
             f"⏳ Days left: <code>{dl}</code>\n"
-            f"🗓 Until: <code>{u.active_until or '-'}</code>"
+            f"🗓 Until: <code>{u.active_until or '-'}</code>\n"
+            f"📶 Traffic: <code>{self._traffic(u.traffic_used)}</code>"
         )
-        await self.render(user_id, chat_id, text, profile_kb(u.is_active, u.is_banned))
+        await self.render(users, user_id, chat_id, text, profile_kb(u.is_active, u.is_banned))
+
+    def _traffic(self, used: int | None) -> str:
+        gb = (used or 0) / 1024 ** 3
+        if not self.traffic_quota:
+            return f"{gb:.2f} GB"
+        return f"{gb:.2f} / {self.traffic_quota / 1024 ** 3:g} GB"
 
     def _days_left(self, active_until):
         if not active_until:
@@ -0,0 +1,65 @@
+# app/warn_worker.py
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from .cache import UserCache
+from .db import Db
+from .repo import UsersRepo
+from .sender import Sender
+
+logger = logging.getLogger(__name__)
+
+WARN_INTERVAL = 3600
+BATCH_SIZE = 500
+
+
+def _warning_text(active_until: datetime) -> str:
+    days = max(1, (active_until - datetime.utcnow()).days + 1)
+    return (
+        f"⏳ Подписка закончится через {days} дн. ({active_until:%d.%m.%Y %H:%M} UTC).\n"
+        "Пополните баланс и нажмите «Активировать», чтобы продлить."
+    )
+
+
+async def warn_expiring(
+    db: Db, sender: Sender, warning_days: int, cache: UserCache | None = None, batch_size: int = BATCH_SIZE
+) -> int:
+    """
+    Предупреждает всех, чья подписка кончится в ближайшие warning_days дней.
+    В памяти только одна пачка; возвращает число доставленных сообщений.
+    """
+    until = datetime.utcnow() + timedelta(days=warning_days)
+    after = None
+    sent = 0
+    while True:
+        async with db.sessionmaker() as s:
+            users = UsersRepo(s, cache=cache)
+            rows = await users.get_expiring_unwarned(until, after, batch_size)
+            if not rows:
+                return sent
+            # отмечаем до отправки: упав посреди пачки, лучше не предупредить, чем предупредить дважды
+            await users.mark_warned(rows)
+            await s.commit()
+            users.invalidate_dirty()
+
+        # курсор keyset — (active_until, user_id), строки приходят как (user_id, active_until)
+        after = (rows[-1][1], rows[-1][0])
+        results = await sender.send_many([(user_id, _warning_text(active_until)) for user_id, active_until in rows])
+        sent += sum(results)
+
+
+async def run_warning_worker(
+    db: Db, sender: Sender, warning_days: int, cache: UserCache | None = None, interval: float = WARN_INTERVAL
+):
+    if warning_days <= 0:
+        logger.info("Expiry warnings disabled (WARNING_DAYS <= 0)")
+        return
+    while True:
+        try:
+            sent = await warn_expiring(db, sender, warning_days, cache)
+            if sent:
+                logger.info(f"Sent {sent} expiry warnings")
+        except Exception as e:
+            logger.error(f"Error in warn_worker: {e}")
+        await asyncio.sleep(interval)
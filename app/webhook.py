@@ -0,0 +1,87 @@
+# app/webhook.py
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from .config import Settings
+
+logger = logging.getLogger(__name__)
+
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+
+def check_webhook_settings(settings: Settings):
+    """
+    Без WEBHOOK_SECRET любой, кто достучится до порта, может прислать апдейт
+    от имени ADMIN_ID. Без секрета можно только локально: сервер на loopback
+    и без setWebhook (прогон bench/replay_updates.py).
+    """
+    if settings.webhook_secret:
+        return
+    if settings.webhook_base_url or settings.webhook_host not in LOOPBACK_HOSTS:
+        raise RuntimeError(
+            "BOT_MODE=webhook requires WEBHOOK_SECRET "
+            "(without it only WEBHOOK_HOST=127.0.0.1 and an empty WEBHOOK_BASE_URL are allowed)"
+        )
+
+
+def build_webhook_app(bot: Bot, dp: Dispatcher, settings: Settings) -> web.Application:
+    """
+    aiohttp-приложение, которое кормит апдейтами тот же Dispatcher, что и polling.
+    Заголовок X-Telegram-Bot-Api-Secret-Token сверяется с WEBHOOK_SECRET;
+    Telegram получает 200 сразу, обработка идёт фоновой задачей.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=settings.webhook_secret or None,
+    ).register(app, path=settings.webhook_path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def register_webhook(bot: Bot, dp: Dispatcher, settings: Settings):
+    if settings.webhook_base_url:
+        await bot.set_webhook(
+            url=f"{settings.webhook_base_url}{settings.webhook_path}",
+            secret_token=settings.webhook_secret or None,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True,
+        )
+        logger.info("Webhook registered in Telegram")
+    else:
+        # локальный режим: апдейты можно слать POST-запросами (bench/replay_updates.py)
+        logger.info("WEBHOOK_BASE_URL is empty, setWebhook skipped")
+
+
+async def run_webhook(
+    bot: Bot,
+    dp: Dispatcher,
+    settings: Settings,
+    register: bool = True,
+    reuse_port: bool = False,
+    stop: asyncio.Event | None = None,
+):
+    """
+    reuse_port — несколько процессов слушают один порт (SO_REUSEPORT), ядро
+    раскидывает соединения Telegram между ними; setWebhook тогда делает супервизор.
+    Работает, пока не выставлен stop.
+    """
+    runner = web.AppRunner(build_webhook_app(bot, dp, settings))
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port, reuse_port=reuse_port or None)
+    await site.start()
+    logger.info(f"Webhook server listening on {settings.webhook_host}:{settings.webhook_port}{settings.webhook_path}")
+
+    if register:
+        await register_webhook(bot, dp, settings)
+
+    try:
+        await (stop or asyncio.Event()).wait()
+    finally:
+        await runner.cleanup()
@@ -1,149 +1,473 @@
+import asyncio
 import json
 import logging
-import requests
+import time
+import aiohttp
+
+from .metrics import observe_xui
 
 logger = logging.getLogger(__name__)
 
+# признаки протухшей сессии в {"success": false, "msg": ...} у разных версий/локалей панели
+_AUTH_ERROR_MARKERS = ("login", "log in", "unauthorized", "войдите", "登录")
+
+
+class _InboundMirror:
+    """
+    Клиенты инбаунда в памяти процесса: список в порядке панели + индекс по uuid.
+    inbound — весь объект из inbounds/get: inbounds/update заменяет инбаунд
+    целиком, поэтому port, protocol, streamSettings и т. д. уходят обратно как были.
+    """
+
+    def __init__(self, inbound: dict, settings: dict, clients: list[dict]):
+        self.inbound = inbound
+        self.settings = {k: v for k, v in settings.items() if k != "clients"}
+        self.clients = clients
+        self.index = {c.get("id"): c for c in clients}
+        self.loaded_at = time.monotonic()
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.loaded_at
+
+    def extend(self, clients: list[dict]):
+        for c in clients:
+            self.clients.append(c)
+            self.index[c.get("id")] = c
+
 
 class XuiPanel:
-    def __init__(self, base_url: str, username: str, password: str):
+    def __init__(
+        self,
+        base_url: str,
+        username: str,
+        password: str,
+        timeout: float = 10,
+        pool_size: int = 10,
+        mirror_ttl: float = 30,
+        batch_window: float = 0.05,
+        exclusive: bool = True,
+    ):
         self.base_url = base_url.rstrip("/")
         self.username = username
         self.password = password
-        self.session = requests.Session()
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session: aiohttp.ClientSession | None = None
+        # состояние авторизации: cookie живёт в сессии, логинимся только когда панель её отвергла
+        self._authed = False
+        self._auth_epoch = 0
+        self._login_task: asyncio.Future | None = None
+        # локальные копии инбаундов и очередь добавлений, которые уходят в панель пачками
+        self.mirror_ttl = mirror_ttl
+        self.batch_window = batch_window
+        self.max_batch = 200
+        self._mirrors: dict[int, _InboundMirror] = {}
+        self._pending_adds: dict[int, list[tuple[dict, asyncio.Future]]] = {}
+        self._add_flushers: dict[int, asyncio.Future] = {}
+        self._add_client_supported = True
+        # запись всего инбаунда (get -> update) и добавления идут под одним замком на инбаунд;
+        # exclusive=False — в панель пишут и другие процессы, замок их не видит
+        self.exclusive = exclusive
+        # столько изменений и меньше — updateClient на каждого вместо inbounds/update
+        self.per_client_max = 5
+        self._inbound_locks: dict[int, asyncio.Lock] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # одна keep-alive сессия на панель: TCP/TLS соединения и cookie переиспользуются
+        if self._session is None or self._session.closed:
+            self._authed = False
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                # панель часто висит на голом IP — без unsafe cookie для IP не сохраняются
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def _lock(self, inbound_id: int) -> asyncio.Lock:
+        lock = self._inbound_locks.get(inbound_id)
+        if lock is None:
+            lock = self._inbound_locks[inbound_id] = asyncio.Lock()
+        return lock
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._authed = False
+
+    async def _request(self, method: str, path: str, timeout: float | None = None, **kwargs) -> tuple[int, str]:
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        session = self._get_session()
+        async with session.request(method, f"{self.base_url}{path}", **kwargs) as r:
+            return r.status, await r.text()
+
+    @staticmethod
+    def _is_auth_rejected(status: int, text: str) -> bool:
+        # 401 — ajax-ответ панели, 3xx — редирект на страницу логина
+        if status == 401 or 300 <= status < 400:
+            return True
+        if status != 200:
+            return False
+        try:
+            response_json = json.loads(text)
+        except Exception:
+            return False
+        if not isinstance(response_json, dict) or response_json.get("success"):
+            return False
+        msg = str(response_json.get("msg", "")).lower()
+        return any(m in msg for m in _AUTH_ERROR_MARKERS)
+
+    async def _relogin(self, stale_epoch: int) -> bool:
+        """
+        Single-flight логин: все корутины, упёршиеся в протухшую сессию,
+        ждут один и тот же запрос /login.
+        """
+        if self._authed and self._auth_epoch != stale_epoch:
+            # пока мы ждали ответ, кто-то уже перелогинился
+            return True
+        if self._login_task is None:
+            self._login_task = asyncio.ensure_future(self._shared_login())
+        return await asyncio.shield(self._login_task)
+
+    async def _shared_login(self) -> bool:
+        try:
+            return await self.login()
+        except Exception as e:
+            logger.error(f"XUI login exception: {e}")
+            return False
+        finally:
+            self._login_task = None
+
+    async def _api(self, method: str, path: str, timeout: float | None = None, **kwargs) -> tuple[int, str]:
+        """Запрос к API панели с переиспользованием cookie и одним повтором после re-login."""
+        if not self._authed and not await self._relogin(self._auth_epoch):
+            return 401, "xui login failed"
+
+        kwargs["allow_redirects"] = False
+        kwargs["headers"] = {"X-Requested-With": "XMLHttpRequest"}
+
+        epoch = self._auth_epoch
+        status, text = await self._request(method, path, timeout=timeout, **kwargs)
+        if not self._is_auth_rejected(status, text):
+            return status, text
+
+        logger.info(f"XUI session rejected on {path} (status={status}), re-login")
+        if not await self._relogin(epoch):
+            return status, text
+        return await self._request(method, path, timeout=timeout, **kwargs)
 
-    def login(self) -> bool:
-        url = f"{self.base_url}/login"
-        r = self.session.post(url, data={"username": self.username, "password": self.password}, timeout=10)
-        if r.status_code != 200:
-            logger.error(f"XUI login failed: status={r.status_code}, response={r.text}")
+    @observe_xui
+    async def login(self, timeout: float | None = None) -> bool:
+        self._authed = False
+        status, text = await self._request(
+            "POST", "/login", data={"username": self.username, "password": self.password}, timeout=timeout
+        )
+        if status != 200:
+            logger.error(f"XUI login failed: status={status}, response={text}")
             return False
         try:
-            response_json = r.json()
+            response_json = json.loads(text)
             success = bool(response_json.get("success"))
             if not success:
                 logger.error(f"XUI login failed: response={response_json}")
+            self._authed = success
+            if success:
+                self._auth_epoch += 1
             return success
         except Exception as e:
-            logger.error(f"XUI login exception: {e}, response={r.text}")
+            logger.error(f"XUI login exception: {e}, response={text}")
             return False
 
-    def get_inbound(self, inbound_id: int) -> dict | None:
+    @observe_xui
+    async def get_inbound(self, inbound_id: int, timeout: float | None = None) -> dict | None:
         """Get inbound settings by ID"""
-        url = f"{self.base_url}/panel/api/inbounds/get/{inbound_id}"
-        r = self.session.get(url, timeout=10)
-        if r.status_code != 200:
-            logger.error(f"XUI get_inbound failed: status={r.status_code}, response={r.text}")
+        status, text = await self._api("GET", f"/panel/api/inbounds/get/{inbound_id}", timeout=timeout)
+        if status != 200:
+            logger.error(f"XUI get_inbound failed: status={status}, response={text}")
             return None
         try:
-            response_json = r.json()
+            response_json = json.loads(text)
             if response_json.get("success"):
                 return response_json.get("obj")
             return None
         except Exception as e:
-            logger.error(f"XUI get_inbound exception: {e}, response={r.text}")
+            logger.error(f"XUI get_inbound exception: {e}, response={text}")
             return None
 
-    def update_inbound(self, inbound_id: int, settings: dict) -> bool:
-        """Update entire inbound settings"""
-        url = f"{self.base_url}/panel/api/inbounds/update/{inbound_id}"
+    @observe_xui
+    async def update_inbound(
+        self, inbound_id: int, inbound: dict, settings: dict, timeout: float | None = None
+    ) -> bool:
+        """
+        Перезаписывает инбаунд целиком: inbound — объект из inbounds/get,
+        в нём заменяется только settings. Вызывать под self._lock(inbound_id).
+        """
         # Include id in payload as some XUI versions require it
-        payload = {"id": inbound_id, "settings": json.dumps(settings)}
-        r = self.session.post(url, json=payload, timeout=10)
-        if r.status_code != 200:
-            logger.error(f"XUI update_inbound failed: status={r.status_code}, response={r.text}")
+        payload = dict(inbound, id=inbound_id, settings=json.dumps(settings))
+        status, text = await self._api(
+            "POST", f"/panel/api/inbounds/update/{inbound_id}", json=payload, timeout=timeout
+        )
+        if status != 200:
+            logger.error(f"XUI update_inbound failed: status={status}, response={text}")
             return False
         try:
-            response_json = r.json()
+            response_json = json.loads(text)
             success = bool(response_json.get("success"))
             if not success:
                 logger.error(f"XUI update_inbound failed: response={response_json}")
             return success
         except Exception as e:
-            logger.error(f"XUI update_inbound exception: {e}, response={r.text}")
+            logger.error(f"XUI update_inbound exception: {e}, response={text}")
             return False
 
-    def add_client(self, inbound_id: int, client: dict) -> bool:
-        # First try the simple addClient endpoint
-        url = f"{self.base_url}/panel/api/inbounds/addClient"
-        payload = {"id": inbound_id, "settings": json.dumps({"clients": [client]})}
-        r = self.session.post(url, json=payload, timeout=10)
-        if r.status_code == 200:
-            try:
-                response_json = r.json()
-                if response_json.get("success"):
-                    return True
-            except Exception:
-                pass
-        
-        # If addClient fails, try getting the inbound and updating it with all clients
-        logger.info(f"XUI addClient direct failed, trying get+update approach...")
-        inbound = self.get_inbound(inbound_id)
+    @staticmethod
+    def _parse_clients(inbound: dict) -> tuple[dict, list[dict]]:
+        """Достаёт settings и список клиентов из ответа inbounds/get."""
+        settings_str = inbound.get("settings", "{}")
+        if isinstance(settings_str, str):
+            settings = json.loads(settings_str)
+        else:
+            settings = settings_str
+
+        existing_clients = settings.get("clients", [])
+
+        # Ensure all existing clients have an email field to avoid SQL errors
+        # If email is missing or None, generate one based on UUID
+        for c in existing_clients:
+            if not c.get("email"):
+                # Generate email from UUID if available, otherwise use a default
+                client_id = c.get("id", "")
+                if client_id:
+                    c["email"] = f"client_{client_id[:8]}"
+                else:
+                    c["email"] = "client_unknown"
+
+        return settings, existing_clients
+
+    async def _load_mirror(self, inbound_id: int, timeout: float | None = None, fresh: bool = False) -> _InboundMirror | None:
+        """
+        Локальная копия клиентов инбаунда; качается заново, когда протухла или fresh.
+        Перед любой полной записью инбаунда — только fresh=True.
+        """
+        mirror = self._mirrors.get(inbound_id)
+        if mirror is not None and not fresh and mirror.age < self.mirror_ttl:
+            return mirror
+
+        inbound = await self.get_inbound(inbound_id, timeout=timeout)
         if not inbound:
-            logger.error(f"XUI add_client failed: could not get inbound {inbound_id}")
-            return False
-        
-        # Parse existing clients from inbound settings
+            self._mirrors.pop(inbound_id, None)
+            return None
         try:
-            settings_str = inbound.get("settings", "{}")
-            if isinstance(settings_str, str):
-                settings = json.loads(settings_str)
-            else:
-                settings = settings_str
-            
-            existing_clients = settings.get("clients", [])
-            
-            # Ensure all existing clients have an email field to avoid SQL errors
-            # If email is missing or None, generate one based on UUID
-            for c in existing_clients:
-                if not c.get("email"):
-                    # Generate email from UUID if available, otherwise use a default
-                    client_id = c.get("id", "")
-                    if client_id:
-                        c["email"] = f"client_{client_id[:8]}"
-                    else:
-                        c["email"] = "client_unknown"
-            
-            # Add our new client
-            existing_clients.append(client)
-            settings["clients"] = existing_clients
-            
-            # Update the inbound with all clients
-            return self.update_inbound(inbound_id, settings)
-            
+            settings, clients = self._parse_clients(inbound)
         except Exception as e:
-            logger.error(f"XUI add_client exception parsing inbound: {e}")
-            return False
+            logger.error(f"XUI exception parsing inbound {inbound_id}: {e}")
+            self._mirrors.pop(inbound_id, None)
+            return None
+        mirror = self._mirrors[inbound_id] = _InboundMirror(inbound, settings, clients)
+        return mirror
+
+    @observe_xui
+    async def existing_clients(self, inbound_id: int, uuids: list[str], timeout: float | None = None) -> set[str] | None:
+        """Какие из uuids уже есть в инбаунде (по свежей копии); None — панель недоступна."""
+        mirror = await self._load_mirror(inbound_id, timeout=timeout, fresh=True)
+        if mirror is None:
+            return None
+        return {u for u in uuids if u in mirror.index}
+
+    @observe_xui
+    async def list_clients(self, inbound_id: int, timeout: float | None = None) -> list[dict] | None:
+        """Все клиенты инбаунда по свежей копии (один inbounds/get); None — панель недоступна."""
+        mirror = await self._load_mirror(inbound_id, timeout=timeout, fresh=True)
+        if mirror is None:
+            return None
+        return list(mirror.clients)
 
-    def update_client(self, inbound_id: int, uuid_str: str, enable: bool, expiry_ms: int) -> bool:
+    @observe_xui
+    async def get_client_traffic(self, inbound_id: int, timeout: float | None = None) -> dict[str, int] | None:
         """
-        В 3x-ui обычно есть:
-        POST /panel/api/inbounds/updateClient/{uuid}
-        body: {"id": inbound_id, "settings": "..."} либо отдельные поля.
-        Но у разных форков эндпоинты отличаются.
+        Счётчики трафика (up + down, байты) всех клиентов инбаунда по email —
+        один inbounds/get на инбаунд, сколько бы клиентов в нём ни было.
+        None — панель недоступна.
+        """
+        inbound = await self.get_inbound(inbound_id, timeout=timeout)
+        if not inbound:
+            return None
+        try:
+            return {
+                st["email"]: int(st.get("up") or 0) + int(st.get("down") or 0)
+                for st in inbound.get("clientStats") or []
+                if st.get("email")
+            }
+        except Exception as e:
+            logger.error(f"XUI exception parsing clientStats of inbound {inbound_id}: {e}")
+            return None
 
-        Самый "живучий" способ — использовать updateClient/{uuid} с settings clients[0].
+    @observe_xui
+    async def add_client(self, inbound_id: int, client: dict, timeout: float | None = None) -> bool:
+        """
+        Клиенты, добавленные почти одновременно, уходят в панель одной пачкой:
+        первый вызов ждёт batch_window и отправляет всё, что накопилось.
         """
-        url = f"{self.base_url}/panel/api/inbounds/updateClient/{uuid_str}"
+        fut = asyncio.get_running_loop().create_future()
+        self._pending_adds.setdefault(inbound_id, []).append((client, fut))
+        if inbound_id not in self._add_flushers:
+            self._add_flushers[inbound_id] = asyncio.ensure_future(self._flush_adds(inbound_id, timeout))
+        return await asyncio.shield(fut)
 
-        client = {
-            "id": uuid_str,
-            "enable": enable,
-            "expiryTime": expiry_ms,
-        }
+    async def _flush_adds(self, inbound_id: int, timeout: float | None):
+        try:
+            await asyncio.sleep(self.batch_window)
+            while self._pending_adds.get(inbound_id):
+                batch = self._pending_adds[inbound_id][:self.max_batch]
+                del self._pending_adds[inbound_id][:self.max_batch]
+                try:
+                    ok = await self._add_clients(inbound_id, [c for c, _ in batch], timeout=timeout)
+                except Exception as e:
+                    for _, fut in batch:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_result(ok)
+        finally:
+            self._add_flushers.pop(inbound_id, None)
 
-        payload = {"id": inbound_id, "settings": json.dumps({"clients": [client]})}
+    async def _add_clients(self, inbound_id: int, clients: list[dict], timeout: float | None = None) -> bool:
+        # добавление не должно попасть между get и update у update_clients — иначе его затрёт
+        async with self._lock(inbound_id):
+            return await self._add_clients_locked(inbound_id, clients, timeout)
 
-        r = self.session.post(url, json=payload, timeout=10)
-        if r.status_code != 200:
-            logger.error(f"XUI update_client failed: status={r.status_code}, response={r.text}")
+    async def _add_clients_locked(self, inbound_id: int, clients: list[dict], timeout: float | None = None) -> bool:
+        # First try the simple addClient endpoint — он принимает дифф, а не весь список
+        if self._add_client_supported:
+            payload = {"id": inbound_id, "settings": json.dumps({"clients": clients})}
+            status, text = await self._api(
+                "POST", "/panel/api/inbounds/addClient", json=payload, timeout=timeout
+            )
+            if status == 200:
+                try:
+                    response_json = json.loads(text)
+                    if response_json.get("success"):
+                        mirror = self._mirrors.get(inbound_id)
+                        if mirror is not None:
+                            mirror.extend(clients)
+                        return True
+                except Exception:
+                    pass
+            elif status == 404:
+                # у форка нет addClient — дальше сразу через полное обновление
+                self._add_client_supported = False
+
+        # If addClient fails, update the inbound with all clients from a fresh copy:
+        # зеркало может отстать на mirror_ttl, а полная запись из него стёрла бы
+        # клиентов, добавленных с тех пор сверкой, другим процессом или руками
+        logger.info(f"XUI addClient direct failed, trying get+update approach...")
+        mirror = await self._load_mirror(inbound_id, timeout=timeout, fresh=True)
+        if mirror is None:
+            logger.error(f"XUI add_client failed: could not get inbound {inbound_id}")
             return False
-        try:
-            response_json = r.json()
-            success = bool(response_json.get("success"))
-            if not success:
-                logger.error(f"XUI update_client failed: response={response_json}")
-            return success
-        except Exception as e:
-            logger.error(f"XUI update_client exception: {e}, response={r.text}")
-            return False
\ No newline at end of file
+
+        settings = dict(mirror.settings, clients=mirror.clients + clients)
+        if not await self.update_inbound(inbound_id, mirror.inbound, settings, timeout=timeout):
+            # состояние панели неизвестно — следующий вызов перечитает её
+            self._mirrors.pop(inbound_id, None)
+            return False
+        mirror.extend(clients)
+        return True
+
+    async def update_client(
+        self, inbound_id: int, uuid_str: str, enable: bool, expiry_ms: int, timeout: float | None = None
+    ) -> bool:
+        """
+        Включение/выключение одного клиента. updateClient/{uuid} заменяет клиента
+        целиком, поэтому клиент берётся из свежей копии инбаунда (см. update_clients) —
+        иначе пропали бы email, flow, limitIp и привязка статистики.
+        """
+        return uuid_str in await self.update_clients(inbound_id, [(uuid_str, enable, expiry_ms)], timeout=timeout)
+
+    @observe_xui
+    async def update_clients(
+        self, inbound_id: int, updates: list[tuple[str, bool, int]], timeout: float | None = None
+    ) -> set[str]:
+        """
+        Массовое включение/выключение: один inbounds/get и один inbounds/update
+        на весь список (uuid, enable, expiry_ms) вместо запроса на каждого клиента.
+        Без exclusive или при малом числе изменений (per_client_max) — один
+        inbounds/get и updateClient на каждого клиента.
+        Возвращает uuid, которые после вызова находятся в нужном состоянии.
+        """
+        if not updates:
+            return set()
+
+        wanted = {uuid_str: (enable, expiry_ms) for uuid_str, enable, expiry_ms in updates}
+        async with self._lock(inbound_id):
+            # полная запись затирает чужие изменения, поэтому перед ней всегда свежая копия
+            mirror = await self._load_mirror(inbound_id, timeout=timeout, fresh=True)
+            if mirror is None:
+                # без копии клиента updateClient стёр бы его поля — повторим позже
+                logger.error(f"XUI update_clients: could not get inbound {inbound_id}")
+                return set()
+            # несколько клиентов дешевле точечными updateClient, чем перезаписью всего инбаунда
+            if not self.exclusive or len(wanted) <= self.per_client_max:
+                return await self._update_clients_each(inbound_id, mirror, wanted, timeout)
+            return await self._update_clients_full(inbound_id, mirror, wanted, timeout)
+
+    async def _update_clients_full(
+        self, inbound_id: int, mirror: _InboundMirror, wanted: dict[str, tuple[bool, int]], timeout: float | None
+    ) -> set[str]:
+        found = set()
+        for uuid_str, target in wanted.items():
+            c = mirror.index.get(uuid_str)
+            if c is None:
+                continue
+            c["enable"], c["expiryTime"] = target
+            found.add(uuid_str)
+
+        missing = wanted.keys() - found
+        if missing:
+            logger.warning(f"XUI update_clients: {len(missing)} clients not found in inbound {inbound_id}")
+        # клиента нет в панели — выключать нечего, для disable считаем состояние достигнутым
+        applied = {u for u in missing if not wanted[u][0]}
+        if not found:
+            return applied
+
+        settings = dict(mirror.settings, clients=mirror.clients)
+        if not await self.update_inbound(inbound_id, mirror.inbound, settings, timeout=timeout):
+            self._mirrors.pop(inbound_id, None)
+            return set()
+        return applied | found
+
+    async def _update_clients_each(
+        self, inbound_id: int, mirror: _InboundMirror, wanted: dict[str, tuple[bool, int]], timeout: float | None
+    ) -> set[str]:
+        """
+        updateClient на каждого клиента: панель правит одного клиента у себя,
+        чужие записи между нашим get и update не теряются. Клиент уходит целиком
+        из свежей копии — updateClient заменяет его, а не сливает поля.
+        """
+        sem = asyncio.Semaphore(self.pool_size)
+        applied = {u for u, (enable, _) in wanted.items() if u not in mirror.index and not enable}
+
+        async def one(uuid_str: str, enable: bool, expiry_ms: int):
+            client = dict(mirror.index[uuid_str], enable=enable, expiryTime=expiry_ms)
+            payload = {"id": inbound_id, "settings": json.dumps({"clients": [client]})}
+            async with sem:
+                status, text = await self._api(
+                    "POST", f"/panel/api/inbounds/updateClient/{uuid_str}", json=payload, timeout=timeout
+                )
+            try:
+                ok = status == 200 and bool(json.loads(text).get("success"))
+            except Exception:
+                ok = False
+            if not ok:
+                logger.error(f"XUI updateClient {uuid_str} failed: status={status}, response={text}")
+                return
+            mirror.index[uuid_str].update(enable=enable, expiryTime=expiry_ms)
+            applied.add(uuid_str)
+
+        await asyncio.gather(*(one(u, *target) for u, target in wanted.items() if u in mirror.index))
+        return applied
@@ -0,0 +1,219 @@
+# bench/bench_flows.py
+"""
+Пропускная способность и перцентили задержек основных сценариев поверх
+bench.fake_xui: регистрация, активация и пауза (запрос + доставка в панель
+через outbox), опрос трафика и массовое истечение.
+
+    python -m bench.bench_flows [--users 2000] [--seed-clients 100000] [--latency-ms 5] [--fail-rate 0.01]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.cache import UserCache
+from app.config import Settings, XuiConfig
+from app.db import Db
+from app.expire_worker import expire_due
+from app.main import create_tables
+from app.migrations import apply_migrations
+from app.nodes import NodeRegistry
+from app.outbox_worker import drain_outbox
+from app.traffic_worker import enforce_quota, ingest_node
+from app.repo import UsersRepo, NodesRepo, OutboxRepo
+from app.scheduler import ExpiryScheduler
+from app.services import SubscriptionService
+
+from .fake_xui import FakeXui
+
+INBOUND_ID = 2
+
+
+def _report(name: str, latencies: list[float], elapsed: float, errors: int = 0):
+    if not latencies:
+        print(f"{name:<14} no operations")
+        return
+    latencies = sorted(latencies)
+
+    def pct(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    print(
+        f"{name:<14} {len(latencies):>6} ops {elapsed:7.2f}s {len(latencies) / elapsed:8.0f}/s  "
+        f"p50={statistics.median(latencies):7.1f} p95={pct(0.95):7.1f} p99={pct(0.99):7.1f} "
+        f"max={latencies[-1]:7.1f} ms  errors={errors}"
+    )
+
+
+class Bench:
+    def __init__(self, db: Db, registry: NodeRegistry, settings: Settings):
+        self.db = db
+        self.registry = registry
+        self.settings = settings
+        self.subs = SubscriptionService(registry)
+        self.scheduler = ExpiryScheduler()
+        self.cache = UserCache()
+
+    async def _in_session(self, fn):
+        # как DbSessionMiddleware: сессия и репозитории на один запрос, commit в конце
+        async with self.db.sessionmaker() as s:
+            users = UsersRepo(s, self.scheduler, self.cache)
+            try:
+                await fn(users, NodesRepo(s), OutboxRepo(s))
+                await s.commit()
+            finally:
+                users.invalidate_dirty()
+
+    async def run(self, name: str, user_ids: list[int], fn, concurrency: int):
+        sem = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+
+        async def one(user_id: int):
+            nonlocal errors
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    await self._in_session(lambda users, nodes, outbox: fn(users, nodes, outbox, user_id))
+                except Exception:
+                    errors += 1
+                    return
+                latencies.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(user_id) for user_id in user_ids))
+        _report(name, latencies, time.perf_counter() - t0, errors)
+
+    async def drain(self, name: str):
+        """Доставка накопленного outbox в панель; повторы после ошибок не ждут backoff."""
+        t0, batches = time.perf_counter(), 0
+        while True:
+            async with self.db.engine.begin() as conn:
+                await conn.execute(text(
+                    "UPDATE panel_outbox SET next_attempt_at = :now WHERE status = 'pending'"
+                ), {"now": datetime.utcnow()})
+                pending = (await conn.execute(text(
+                    "SELECT count(*) FROM panel_outbox WHERE status = 'pending'"
+                ))).scalar()
+            if not pending:
+                break
+            await drain_outbox(self.db, self.registry)
+            batches += 1
+        async with self.db.engine.begin() as conn:
+            rows = (await conn.execute(text(
+                "SELECT status, count(*) FROM panel_outbox GROUP BY status"
+            ))).all()
+        elapsed = time.perf_counter() - t0
+        print(f"{name:<14} {batches:>6} batches {elapsed:5.2f}s  outbox={dict(rows)}")
+
+
+async def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--seed-clients", type=int, default=100_000, help="клиентов в инбаунде до начала прогона")
+    p.add_argument("--concurrency", type=int, default=50)
+    p.add_argument("--latency-ms", type=float, default=5)
+    p.add_argument("--jitter-ms", type=float, default=5)
+    p.add_argument("--fail-rate", type=float, default=0)
+    p.add_argument("--port", type=int, default=18053)
+    p.add_argument("--db", default="/tmp/bench_flows.db")
+    args = p.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+
+    fake = FakeXui(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, fail_rate=args.fail_rate)
+    fake.seed(INBOUND_ID, args.seed_clients)
+    runner = await fake.start(port=args.port)
+
+    settings = Settings(
+        bot_token="", admin_id=0, db_dsn=f"sqlite+aiosqlite:///{args.db}", monthly_price_rub=150, warning_days=3
+    )
+    db = Db(settings.db_dsn)
+    await db.init_sqlite_pragmas()
+    await create_tables(db)
+    await apply_migrations(db)
+
+    registry = NodeRegistry([XuiConfig(
+        url=f"http://127.0.0.1:{args.port}", username="admin", password="admin", inbound_id=INBOUND_ID,
+        server_ip="127.0.0.1", server_port=443, public_key="", sni="", short_id="",
+    )])
+    async with db.sessionmaker() as s:
+        await NodesRepo(s).sync([n.node_id for n in registry.all()], registry.default_id)
+        await s.commit()
+
+    bench = Bench(db, registry, settings)
+    ids = list(range(1, args.users + 1))
+    print(
+        f"users={args.users} seed_clients={args.seed_clients} concurrency={args.concurrency} "
+        f"panel latency={args.latency_ms}+{args.jitter_ms}ms fail_rate={args.fail_rate}"
+    )
+    try:
+        await bench.run(
+            "signup", ids, lambda users, nodes, outbox, uid: users.add_if_missing(uid, f"user{uid}"), args.concurrency
+        )
+        async with db.engine.begin() as conn:
+            await conn.execute(text("UPDATE users SET balance = 1000"))
+        bench.cache = UserCache()
+
+        await bench.run(
+            "activate",
+            ids,
+            lambda users, nodes, outbox, uid: bench.subs.activate(users, nodes, outbox, uid, 30, settings),
+            args.concurrency,
+        )
+        await bench.drain("  -> panel")
+
+        paused = ids[::2]
+        await bench.run(
+            "pause", paused, lambda users, nodes, outbox, uid: bench.subs.pause(users, outbox, uid), args.concurrency
+        )
+        await bench.drain("  -> panel")
+
+        await bench.run(
+            "re-activate",
+            paused,
+            lambda users, nodes, outbox, uid: bench.subs.activate(users, nodes, outbox, uid, 30, settings),
+            args.concurrency,
+        )
+        await bench.drain("  -> panel")
+
+        inbound = fake.inbounds[INBOUND_ID]
+        for c in inbound.clients:
+            if c["email"].startswith("tg_"):
+                inbound.add_traffic(c["email"], 10 << 20, 200 << 20)
+        gets = fake.calls["/panel/api/inbounds/get/{id}"]
+        t0 = time.perf_counter()
+        changed = await ingest_node(db, registry, registry.get(None), datetime.utcnow(), bench.cache)
+        disabled = await enforce_quota(db, registry, 100 << 20, bench.cache)
+        print(
+            f"{'traffic poll':<14} {changed:>6} users {time.perf_counter() - t0:5.2f}s  "
+            f"over quota={disabled} inbound gets={fake.calls['/panel/api/inbounds/get/{id}'] - gets}"
+        )
+        async with db.engine.begin() as conn:
+            await conn.execute(text("UPDATE users SET is_active = 1"))
+
+        async with db.engine.begin() as conn:
+            await conn.execute(
+                text("UPDATE users SET active_until = :t WHERE is_active = 1"),
+                {"t": datetime.utcnow() - timedelta(minutes=1)},
+            )
+        t0 = time.perf_counter()
+        failed = await expire_due(db, registry, cache=bench.cache)
+        print(f"{'mass expiry':<14} {args.users:>6} users {time.perf_counter() - t0:5.2f}s  failed={len(failed)}")
+
+        created = len(inbound.clients) - args.seed_clients
+        still_enabled = sum(1 for c in inbound.clients if c.get("email", "").startswith("tg_") and c.get("enable"))
+        print(f"panel: {created} clients created, {still_enabled} still enabled, calls={dict(fake.calls)}")
+    finally:
+        await registry.close()
+        await runner.cleanup()
+        await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,151 @@
+# bench/bench_indexes.py
+"""
+Время горячих запросов на 1M пользователей до и после миграций.
+
+    python -m bench.bench_indexes [--users 1000000] [--db /tmp/bench_indexes.db]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, text
+
+from app.db import Db
+from app.main import create_tables
+from app.migrations import apply_migrations
+from app.models import User, DepositRequest
+from app.repo import UsersRepo
+
+
+def _users(n: int, now: datetime):
+    for user_id in range(1, n + 1):
+        r = random.random()
+        if r < 0.35:
+            # активные: подавляющее большинство ещё не истекли, небольшой хвост ждёт expire worker
+            until = now + timedelta(minutes=random.randint(-30, 60 * 24 * 60))
+            yield dict(user_id=user_id, balance=0.0, is_banned=False, is_active=True, active_until=until,
+                       vpn_uuid=str(uuid.uuid4()), vpn_email=f"tg_{user_id}", created_at=now)
+        elif r < 0.6:
+            until = now - timedelta(days=random.randint(1, 365))
+            yield dict(user_id=user_id, balance=0.0, is_banned=False, is_active=False, active_until=until,
+                       vpn_uuid=str(uuid.uuid4()), vpn_email=f"tg_{user_id}", created_at=now)
+        else:
+            yield dict(user_id=user_id, balance=0.0, is_banned=False, is_active=False, active_until=None,
+                       vpn_uuid=None, vpn_email=None, created_at=now)
+
+
+def _deposits(n: int, users: int, now: datetime):
+    for _ in range(n):
+        status = "pending" if random.random() < 0.01 else random.choice(("approved", "rejected"))
+        yield dict(user_id=random.randint(1, users), amount=150.0, status=status,
+                   created_at=now - timedelta(seconds=random.randint(0, 86400 * 365)))
+
+
+async def _fill(db: Db, users: int):
+    now = datetime.utcnow()
+    rows, chunk = [], 50_000
+    async with db.engine.begin() as conn:
+        for row in _users(users, now):
+            rows.append(row)
+            if len(rows) == chunk:
+                await conn.execute(insert(User), rows)
+                rows = []
+        if rows:
+            await conn.execute(insert(User), rows)
+        deps = list(_deposits(users // 5, users, now))
+        for i in range(0, len(deps), chunk):
+            await conn.execute(insert(DepositRequest), deps[i:i + chunk])
+
+
+def _pending_stmt():
+    return (
+        select(DepositRequest)
+        .where(DepositRequest.status == "pending")
+        .order_by(DepositRequest.created_at, DepositRequest.id)
+        .limit(50)
+    )
+
+
+async def _measure(db: Db, repeat: int) -> dict[str, float]:
+    async def expired(users):
+        return await users.get_expired_active()
+
+    async def upcoming(users):
+        return await users.get_upcoming_deadlines(1000)
+
+    async def pending(users):
+        return (await users.s.execute(_pending_stmt())).scalars().all()
+
+    out = {}
+    for name, fn in (("get_expired_active", expired), ("get_upcoming_deadlines", upcoming), ("pending_deposits", pending)):
+        samples = []
+        for _ in range(repeat):
+            async with db.sessionmaker() as s:
+                t0 = time.perf_counter()
+                await fn(UsersRepo(s))
+                samples.append((time.perf_counter() - t0) * 1000)
+        out[name] = statistics.median(samples)
+    return out
+
+
+async def _plans(db: Db):
+    now = datetime.utcnow()
+    stmts = {
+        "get_expired_active": select(User).where(
+            User.is_active == True, User.active_until.is_not(None),
+            User.active_until < now, User.vpn_uuid.is_not(None),
+        ),
+        "pending_deposits": _pending_stmt(),
+    }
+    async with db.engine.connect() as conn:
+        for name, stmt in stmts.items():
+            compiled = stmt.compile(conn.engine, compile_kwargs={"literal_binds": True})
+            rows = (await conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))).all()
+            print(f"  {name}: " + "; ".join(r[-1] for r in rows))
+
+
+async def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--users", type=int, default=1_000_000)
+    p.add_argument("--db", default="/tmp/bench_indexes.db")
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+
+    db = Db(f"sqlite+aiosqlite:///{args.db}")
+    await db.init_sqlite_pragmas()
+    await create_tables(db)
+
+    t0 = time.perf_counter()
+    await _fill(db, args.users)
+    print(f"filled {args.users} users in {time.perf_counter() - t0:.1f}s")
+
+    before = await _measure(db, args.repeat)
+    print("before migrations:")
+    await _plans(db)
+
+    t0 = time.perf_counter()
+    await apply_migrations(db)
+    print(f"migrations applied in {time.perf_counter() - t0:.1f}s")
+
+    after = await _measure(db, args.repeat)
+    print("after migrations:")
+    await _plans(db)
+
+    print(f"\n{'query':<26}{'before, ms':>12}{'after, ms':>12}")
+    for name in before:
+        print(f"{name:<26}{before[name]:>12.2f}{after[name]:>12.2f}")
+
+    await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+# bench/bench_race.py
+"""
+Одновременные add_client и update_clients по одному инбаунду bench.fake_xui:
+после каждого раунда добавленный клиент должен остаться в панели, а поля
+инбаунда (port, protocol, streamSettings, ...) и клиентов (email, flow,
+limitIp) — не пропасть. Прогоняется
+при разной задержке панели, с addClient и без него (полная запись), в
+монопольном режиме и поклиентном (exclusive=False). Ненулевой код выхода — потери.
+
+    python -m bench.bench_race [--rounds 50] [--clients 500]
+"""
+import argparse
+import asyncio
+import random
+import sys
+import uuid
+
+from app.outbox_worker import new_client
+from app.xui import XuiPanel
+
+from .fake_xui import FakeXui
+
+INBOUND_ID = 2
+
+
+async def run_case(args, latency: float, exclusive: bool, add_client: bool) -> int:
+    fake = FakeXui(latency=latency, add_client=add_client)
+    inbound = fake.seed(INBOUND_ID, args.clients)
+    fields = dict(inbound.fields)
+    # updateClient и inbounds/update не должны терять поля клиентов
+    seeded = {c["id"]: (c["email"], c["flow"], c["limitIp"]) for c in inbound.clients}
+    runner = await fake.start(port=args.port)
+    xui = XuiPanel(f"http://127.0.0.1:{args.port}", "admin", "admin", exclusive=exclusive)
+    lost = 0
+    try:
+        for i in range(args.rounds):
+            vpn_uuid = str(uuid.uuid4())
+            # 1 и 3 изменения идут поклиентными updateClient, 10 — перезаписью инбаунда
+            updates = [(c["id"], i % 2 == 0, 0) for c in inbound.clients[:(1, 3, 10)[i % 3]]]
+
+            async def update_later():
+                # add_client уходит в панель через batch_window — сдвигаем get/update так,
+                # чтобы addClient попадал и до, и между, и после них
+                await asyncio.sleep(random.uniform(0, xui.batch_window + 2 * latency))
+                return await xui.update_clients(INBOUND_ID, updates)
+
+            added, _ = await asyncio.gather(
+                xui.add_client(INBOUND_ID, new_client(vpn_uuid, f"tg_race_{i}", 0, True)),
+                update_later(),
+            )
+            inbound = fake.inbounds[INBOUND_ID]
+            if added is True and vpn_uuid not in inbound.index:
+                lost += 1
+        fields_kept = inbound.fields == fields
+        damaged = sum(
+            (c.get("email"), c.get("flow"), c.get("limitIp")) != seeded[c["id"]]
+            for c in inbound.clients if c["id"] in seeded
+        )
+    finally:
+        await xui.close()
+        await runner.cleanup()
+
+    print(
+        f"latency={latency * 1000:>3.0f}ms exclusive={exclusive!s:<5} addClient={add_client!s:<5} "
+        f"lost={lost}/{args.rounds} damaged clients={damaged} inbound fields {'kept' if fields_kept else 'LOST'}"
+    )
+    return lost + damaged + (not fields_kept)
+
+
+async def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--rounds", type=int, default=50)
+    p.add_argument("--clients", type=int, default=500)
+    p.add_argument("--port", type=int, default=18055)
+    args = p.parse_args()
+
+    failures = 0
+    for latency in (0, 0.02):
+        for exclusive, add_client in ((True, True), (False, True), (True, False)):
+            failures += await run_case(args, latency, exclusive, add_client)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+# bench/bench_reconcile.py
+"""
+Сверка БД с панелью на большом инбаунде: N пользователей в users и в
+bench.fake_xui, часть расхождений внесена нарочно. Прогоняет отчёт,
+исправление и повторный отчёт (после исправления расхождений быть не должно).
+
+    python -m bench.bench_reconcile [--users 100000] [--drift 0.01] [--latency-ms 5]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.config import XuiConfig
+from app.db import Db
+from app.main import create_tables
+from app.migrations import apply_migrations
+from app.nodes import NodeRegistry
+from app.outbox_worker import new_client
+from app.reconciler import reconcile, _expiry_ms
+from app.repo import NodesRepo
+
+from .fake_xui import FakeInbound, FakeXui
+
+INBOUND_ID = 2
+
+
+async def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--users", type=int, default=100_000)
+    p.add_argument("--drift", type=float, default=0.01, help="доля клиентов каждого вида расхождений")
+    p.add_argument("--latency-ms", type=float, default=5)
+    p.add_argument("--port", type=int, default=18054)
+    p.add_argument("--db", default="/tmp/bench_reconcile.db")
+    args = p.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+
+    db = Db(f"sqlite+aiosqlite:///{args.db}")
+    await db.init_sqlite_pragmas()
+    await create_tables(db)
+    await apply_migrations(db)
+
+    now = datetime.utcnow()
+    rows, clients = [], []
+    for user_id in range(1, args.users + 1):
+        vpn_uuid = str(uuid.uuid4())
+        active = user_id % 3 != 0
+        until = now + timedelta(days=random.randint(1, 30) if active else -random.randint(1, 30))
+        rows.append({
+            "uid": user_id, "uuid": vpn_uuid, "email": f"tg_{user_id}", "active": active, "until": until, "now": now,
+        })
+        clients.append(new_client(vpn_uuid, f"tg_{user_id}", _expiry_ms(until), active))
+
+    # расхождения: клиент пропал из панели, включён у неактивного, строка users без uuid, чужой клиент
+    n = max(1, int(args.users * args.drift))
+    picked = random.sample(range(args.users), 4 * n)
+    missing, flipped, lost, foreign = (set(picked[i * n:(i + 1) * n]) for i in range(4))
+    for i in flipped:
+        clients[i]["enable"] = not clients[i]["enable"]
+    for i in lost:
+        rows[i]["uuid"] = None
+    panel_clients = [c for i, c in enumerate(clients) if i not in missing]
+    panel_clients += [new_client(str(uuid.uuid4()), f"tg_{args.users + i}", 0, True) for i in foreign]
+
+    async with db.engine.begin() as conn:
+        await conn.execute(text(
+            "INSERT INTO users (user_id, balance, is_banned, is_active, active_until, vpn_uuid, vpn_email, node_id, "
+            "traffic_used, traffic_seen, created_at) "
+            "VALUES (:uid, 0, 0, :active, :until, :uuid, :email, 1, 0, 0, :now)"
+        ), rows)
+
+    fake = FakeXui(latency=args.latency_ms / 1000)
+    fake.inbounds[INBOUND_ID] = FakeInbound(INBOUND_ID, panel_clients)
+    runner = await fake.start(port=args.port)
+    registry = NodeRegistry([XuiConfig(
+        url=f"http://127.0.0.1:{args.port}", username="admin", password="admin", inbound_id=INBOUND_ID,
+        server_ip="127.0.0.1", server_port=443, public_key="", sni="", short_id="",
+    )])
+    async with db.sessionmaker() as s:
+        await NodesRepo(s).sync([nd.node_id for nd in registry.all()], registry.default_id)
+        await s.commit()
+
+    print(f"users={args.users} injected per kind={n} panel latency={args.latency_ms}ms")
+    try:
+        for name, dry_run in (("dry run", True), ("apply", False), ("dry run", True)):
+            calls = sum(fake.calls.values())
+            t0 = time.perf_counter()
+            reports = await reconcile(db, registry, dry_run=dry_run)
+            elapsed = time.perf_counter() - t0
+            for r in reports:
+                print(f"{name:<8} {elapsed:5.2f}s panel requests={sum(fake.calls.values()) - calls}  {r.summary()}")
+    finally:
+        await registry.close()
+        await runner.cleanup()
+        await db.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
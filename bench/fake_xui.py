@@ -0,0 +1,244 @@
+# bench/fake_xui.py
+"""
+Локальная замена панели 3x-ui для нагрузочных прогонов: те эндпоинты, которые
+дёргает XuiPanel, с настраиваемой задержкой и инъекцией ошибок.
+
+    python -m bench.fake_xui --port 2053 --clients 100000 --latency-ms 20 --fail-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import random
+import secrets
+import uuid
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeInbound:
+    def __init__(self, inbound_id: int, clients: list[dict]):
+        self.id = inbound_id
+        # всё, кроме settings: inbounds/update заменяет это целиком, как настоящая панель
+        self.fields = {
+            "protocol": "vless",
+            "port": 443,
+            "listen": "",
+            "enable": True,
+            "remark": f"inbound {inbound_id}",
+            "streamSettings": json.dumps({"network": "tcp", "security": "reality"}),
+            "sniffing": json.dumps({"enabled": True}),
+        }
+        self.extra_settings = {"decryption": "none", "fallbacks": []}
+        self.clients = clients
+        self.index = {c["id"]: c for c in clients}
+        self.emails = {c["email"] for c in clients}
+        # email -> [up, down], отдаётся в clientStats
+        self.traffic: dict[str, list[int]] = {}
+
+    def replace(self, clients: list[dict]):
+        self.clients = clients
+        self.index = {c["id"]: c for c in clients}
+        self.emails = {c.get("email") for c in clients}
+
+    def dump(self) -> dict:
+        settings = dict(self.extra_settings, clients=self.clients)
+        stats = [
+            {"inboundId": self.id, "email": email, "up": up, "down": down, "enable": True}
+            for email, (up, down) in self.traffic.items()
+        ]
+        return dict(self.fields, id=self.id, settings=json.dumps(settings), clientStats=stats)
+
+    def add_traffic(self, email: str, up: int, down: int = 0):
+        counters = self.traffic.setdefault(email, [0, 0])
+        counters[0] += up
+        counters[1] += down
+
+
+class FakeXui:
+    """
+    Состояние в памяти. latency/jitter — задержка каждого запроса (секунды),
+    fail_rate — доля ответов 500, session_ttl — через сколько запросов cookie
+    перестаёт приниматься (0 — никогда), add_client=False — форк без addClient.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        fail_rate: float = 0.0,
+        session_ttl: int = 0,
+        add_client: bool = True,
+        username: str = "admin",
+        password: str = "admin",
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.session_ttl = session_ttl
+        self.add_client = add_client
+        self.username = username
+        self.password = password
+        self.inbounds: dict[int, FakeInbound] = {}
+        # cookie -> сколько запросов по ней ещё примут
+        self._sessions: dict[str, float] = {}
+        self.calls: Counter[str] = Counter()
+
+    def seed(self, inbound_id: int, n: int, enabled: float = 0.5) -> FakeInbound:
+        clients = [
+            {
+                "id": str(uuid.uuid4()),
+                "email": f"seed_{inbound_id}_{i}",
+                "flow": "xtls-rprx-vision",
+                "limitIp": 1,
+                "totalGB": 0,
+                "expiryTime": 0,
+                "enable": random.random() < enabled,
+            }
+            for i in range(n)
+        ]
+        inbound = self.inbounds[inbound_id] = FakeInbound(inbound_id, clients)
+        return inbound
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=1 << 30, middlewares=[self._inject])
+        app.router.add_post("/login", self._login)
+        app.router.add_get("/panel/api/inbounds/get/{id}", self._get)
+        app.router.add_post("/panel/api/inbounds/update/{id}", self._update)
+        app.router.add_post("/panel/api/inbounds/addClient", self._add)
+        app.router.add_post("/panel/api/inbounds/updateClient/{uuid}", self._update_client)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 2053) -> web.AppRunner:
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+    @web.middleware
+    async def _inject(self, request: web.Request, handler):
+        resource = request.match_info.route.resource
+        self.calls[resource.canonical if resource else request.path] += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.fail_rate and random.random() < self.fail_rate:
+            self.calls["injected_failure"] += 1
+            return web.Response(status=500, text="injected failure")
+        if request.path != "/login" and not self._authorized(request):
+            return web.json_response({"success": False, "msg": "You have to login first"}, status=401)
+        return await handler(request)
+
+    def _authorized(self, request: web.Request) -> bool:
+        token = request.cookies.get("3x-ui")
+        left = self._sessions.get(token)
+        if left is None:
+            return False
+        if self.session_ttl:
+            if left <= 0:
+                del self._sessions[token]
+                return False
+            self._sessions[token] = left - 1
+        return True
+
+    async def _login(self, request: web.Request):
+        form = await request.post()
+        if form.get("username") != self.username or form.get("password") != self.password:
+            return web.json_response({"success": False, "msg": "wrong username or password"})
+        token = secrets.token_hex(16)
+        self._sessions[token] = self.session_ttl or float("inf")
+        resp = web.json_response({"success": True, "msg": "Login Successfully"})
+        resp.set_cookie("3x-ui", token)
+        return resp
+
+    def _inbound(self, request: web.Request, inbound_id=None) -> FakeInbound | None:
+        return self.inbounds.get(int(inbound_id if inbound_id is not None else request.match_info["id"]))
+
+    async def _get(self, request: web.Request):
+        inbound = self._inbound(request)
+        if inbound is None:
+            return web.json_response({"success": False, "msg": "record not found"})
+        return web.json_response({"success": True, "obj": inbound.dump()})
+
+    async def _update(self, request: web.Request):
+        inbound = self._inbound(request)
+        if inbound is None:
+            return web.json_response({"success": False, "msg": "record not found"})
+        body = await request.json()
+        settings = json.loads(body["settings"])
+        clients = settings.pop("clients", [])
+        emails = [c.get("email") for c in clients]
+        if len(set(emails)) != len(emails):
+            return web.json_response({"success": False, "msg": "Duplicate email"})
+        # как в 3x-ui: присланный объект заменяет инбаунд целиком — чего нет в теле, то пропадает
+        inbound.fields = {k: v for k, v in body.items() if k not in ("id", "settings", "clientStats")}
+        inbound.extra_settings = settings
+        inbound.replace(clients)
+        return web.json_response({"success": True})
+
+    async def _add(self, request: web.Request):
+        if not self.add_client:
+            return web.Response(status=404, text="404 page not found")
+        body = await request.json()
+        inbound = self._inbound(request, body.get("id"))
+        if inbound is None:
+            return web.json_response({"success": False, "msg": "record not found"})
+        clients = json.loads(body["settings"]).get("clients", [])
+        for c in clients:
+            if c["id"] in inbound.index or c.get("email") in inbound.emails:
+                return web.json_response({"success": False, "msg": f"Duplicate email: {c.get('email')}"})
+        inbound.clients.extend(clients)
+        for c in clients:
+            inbound.index[c["id"]] = c
+            inbound.emails.add(c.get("email"))
+        return web.json_response({"success": True})
+
+    async def _update_client(self, request: web.Request):
+        body = await request.json()
+        inbound = self._inbound(request, body.get("id"))
+        if inbound is None:
+            return web.json_response({"success": False, "msg": "record not found"})
+        uuid_str = request.match_info["uuid"]
+        current = inbound.index.get(uuid_str)
+        if current is None:
+            return web.json_response({"success": False, "msg": "client not found"})
+        clients = json.loads(body["settings"]).get("clients", [])
+        if not clients or clients[0].get("id") != uuid_str:
+            return web.json_response({"success": False, "msg": "empty client ID"})
+        # как в 3x-ui: присланный клиент заменяет старого целиком (email, flow, limitIp — тоже)
+        new = clients[0]
+        inbound.clients[inbound.clients.index(current)] = new
+        inbound.index[uuid_str] = new
+        inbound.emails.discard(current.get("email"))
+        inbound.emails.add(new.get("email"))
+        return web.json_response({"success": True})
+
+
+async def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=2053)
+    p.add_argument("--inbound-id", type=int, default=2)
+    p.add_argument("--clients", type=int, default=0, help="сколько клиентов засеять в инбаунд")
+    p.add_argument("--latency-ms", type=float, default=0)
+    p.add_argument("--jitter-ms", type=float, default=0)
+    p.add_argument("--fail-rate", type=float, default=0)
+    p.add_argument("--session-ttl", type=int, default=0, help="запросов на одну cookie, 0 — без ограничения")
+    p.add_argument("--no-add-client", action="store_true", help="вести себя как форк без addClient")
+    args = p.parse_args()
+
+    fake = FakeXui(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        fail_rate=args.fail_rate,
+        session_ttl=args.session_ttl,
+        add_client=not args.no_add_client,
+    )
+    fake.seed(args.inbound_id, args.clients)
+    await fake.start(args.host, args.port)
+    print(f"fake 3x-ui on http://{args.host}:{args.port} (admin/admin), inbound {args.inbound_id} with {args.clients} clients")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
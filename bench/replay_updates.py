@@ -0,0 +1,61 @@
+# bench/replay_updates.py
+"""
+Шлёт записанные апдейты (JSONL, по одному Update на строку) в локальный webhook.
+
+    BOT_MODE=webhook WEBHOOK_SECRET=s python -m app.main
+    python -m bench.replay_updates updates.jsonl --secret s --repeat 100 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from collections import Counter
+
+import aiohttp
+
+
+async def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("file")
+    p.add_argument("--url", default="http://127.0.0.1:8080/tg/webhook")
+    p.add_argument("--secret", default="")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--concurrency", type=int, default=10)
+    args = p.parse_args()
+
+    with open(args.file, encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(args.repeat):
+        for u in updates:
+            queue.put_nowait(dict(u, update_id=u.get("update_id", 0) + i * len(updates)))
+
+    statuses, latencies = Counter(), []
+
+    async def worker(session: aiohttp.ClientSession):
+        while not queue.empty():
+            update = queue.get_nowait()
+            t0 = time.perf_counter()
+            async with session.post(args.url, json=update, headers=headers) as r:
+                await r.read()
+                statuses[r.status] += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    print(f"sent {len(latencies)} updates in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s), statuses={dict(statuses)}")
+    print(
+        f"latency ms: p50={statistics.median(latencies):.1f} "
+        f"p95={latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.1f} max={latencies[-1]:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())